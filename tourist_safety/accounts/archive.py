@@ -0,0 +1,249 @@
+# accounts/archive.py
+# Cold Location history: rows past the archive horizon move out of the
+# OLTP table into one .npy file per (UTC day, tourist). Each file is a
+# fixed-width record array sorted by time, read back with np.load(mmap_mode)
+# so a multi-week track is a few page-ins and array slices, not ORM rows.
+# Size comes from fixed-point packing (16 bytes per fix): ms since midnight,
+# 1e-7 degree lat/lon (~1 cm) and float32 accuracy; a compressed container
+# (npz, zlib) could not be memory-mapped.
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .models import ArchivedDay, Location, RetentionCheckpoint
+from .retention import protected_windows, _protected
+
+ARCHIVE_DIR = getattr(settings, 'LOCATION_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'var', 'location_archive'))
+ARCHIVE_AFTER = timedelta(days=getattr(settings, 'LOCATION_ARCHIVE_AFTER_DAYS', 30))
+CHECKPOINT = 'location_archive'
+DELETE_BATCH = 1000
+DEG_SCALE = 10_000_000
+
+RECORD = np.dtype([('t', '<u4'), ('lat', '<i4'), ('lon', '<i4'), ('accuracy', '<f4')])
+
+
+def day_start(day):
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+
+
+def pack(day, timestamps, lats, lons, accuracies):
+    """Fixes as RECORD rows; fixes without finite coordinates have no fixed-point form and are dropped."""
+    base = day_start(day)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    out = np.empty(int(valid.sum()), dtype=RECORD)
+    out['t'] = [round((ts - base).total_seconds() * 1000) for ts, ok in zip(timestamps, valid) if ok]
+    out['lat'] = np.round(lats[valid] * DEG_SCALE)
+    out['lon'] = np.round(lons[valid] * DEG_SCALE)
+    out['accuracy'] = [np.nan if a is None else a for a, ok in zip(accuracies, valid) if ok]
+    return out
+
+
+def dedupe(records):
+    """Drop byte-identical records and sort by time; compares raw bytes, so NaN accuracies match."""
+    records = np.ascontiguousarray(records)
+    _, first = np.unique(records.view(f'V{records.dtype.itemsize}'), return_index=True)
+    records = records[np.sort(first)]
+    return records[np.argsort(records['t'], kind='stable')]
+
+
+def unpack(day, records):
+    return {
+        'epoch': day_start(day).timestamp() + records['t'] / 1000.0,
+        'lat': records['lat'] / DEG_SCALE,
+        'lon': records['lon'] / DEG_SCALE,
+        'accuracy': records['accuracy'].astype(np.float64),
+    }
+
+
+def _empty():
+    return {k: np.empty(0, dtype=np.float64) for k in ('epoch', 'lat', 'lon', 'accuracy')}
+
+
+def _write(day, tourist_id, records):
+    # new file name per write: the row still points at the old file until commit
+    rel = os.path.join(day.isoformat(), f"{tourist_id}-{uuid.uuid4().hex[:8]}.npy")
+    path = os.path.join(ARCHIVE_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        np.save(f, records)
+    os.replace(path + '.part', path)
+    return rel
+
+
+def _unlink(rel):
+    try:
+        os.unlink(os.path.join(ARCHIVE_DIR, rel))
+    except FileNotFoundError:
+        pass
+
+
+def archive_day(day):
+    """Move one UTC day of unprotected Location rows into the archive. -> rows archived."""
+    start = day_start(day)
+    end = start + timedelta(days=1)
+    rows = list(Location.objects.filter(timestamp__gte=start, timestamp__lt=end)
+                .order_by('tourist_id', 'timestamp', 'pk')
+                .values_list('pk', 'tourist_id', 'timestamp', 'latitude', 'longitude', 'accuracy'))
+    windows = protected_windows(start, end)
+    groups = {}
+    for pk, tourist_id, ts, lat, lon, accuracy in rows:
+        # SOS trails stay in the live table next to their event
+        if tourist_id in windows and _protected(ts, windows[tourist_id]):
+            continue
+        groups.setdefault(tourist_id, []).append((pk, ts, lat, lon, accuracy))
+    existing = {a.tourist_id: a for a in ArchivedDay.objects.filter(day=day, tourist_id__in=list(groups))}
+    written, replaced, unarchivable = [], [], []
+    try:
+        for tourist_id, group in groups.items():
+            pks, ts, lats, lons, accs = zip(*group)
+            records = pack(day, ts, lats, lons, accs)
+            if tourist_id in existing:
+                old = np.load(os.path.join(ARCHIVE_DIR, existing[tourist_id].path))
+                records = np.concatenate([old, records])
+            # sorted by time; drops copies left by a run that died before its commit
+            records = dedupe(records)
+            if not len(records):
+                # no finite coordinates, nothing to archive: the rows are just removed
+                unarchivable.extend(pks)
+                continue
+            written.append((tourist_id, _write(day, tourist_id, records), records, pks))
+        with transaction.atomic():
+            for tourist_id, rel, records, pks in written:
+                first, last = (start + timedelta(milliseconds=int(records['t'][i])) for i in (0, -1))
+                ArchivedDay.objects.update_or_create(
+                    tourist_id=tourist_id, day=day,
+                    defaults={'path': rel, 'rows': len(records), 'first_at': first, 'last_at': last},
+                )
+                if tourist_id in existing:
+                    replaced.append(existing[tourist_id].path)
+                for i in range(0, len(pks), DELETE_BATCH):
+                    Location.objects.filter(pk__in=pks[i:i + DELETE_BATCH]).delete()
+            for i in range(0, len(unarchivable), DELETE_BATCH):
+                Location.objects.filter(pk__in=unarchivable[i:i + DELETE_BATCH]).delete()
+            RetentionCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'cursor': end})
+    except BaseException:
+        for _, rel, _, _ in written:
+            _unlink(rel)
+        raise
+    for rel in replaced:
+        _unlink(rel)
+    return sum(len(w[3]) for w in written)
+
+
+def run(max_days=7, time_budget=None, now=None):
+    """Archive whole days from the checkpoint up to the archive horizon, bounded per run."""
+    now = now or datetime.now(dt_timezone.utc)
+    horizon = (now - ARCHIVE_AFTER).astimezone(dt_timezone.utc).date()
+    cursor = RetentionCheckpoint.objects.filter(name=CHECKPOINT).values_list('cursor', flat=True).first()
+    if cursor is None:
+        first = Location.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        day = first.astimezone(dt_timezone.utc).date() if first else horizon
+    else:
+        day = cursor.astimezone(dt_timezone.utc).date()
+    started = time.perf_counter()
+    stats = {'days': 0, 'archived': 0, 'done': False}
+    while day < horizon and stats['days'] < max_days:
+        if time_budget and time.perf_counter() - started >= time_budget:
+            break
+        nxt = (Location.objects.filter(timestamp__gte=day_start(day)).order_by('timestamp')
+               .values_list('timestamp', flat=True).first())
+        if nxt is None or nxt.astimezone(dt_timezone.utc).date() >= horizon:
+            day = horizon
+            RetentionCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'cursor': day_start(day)})
+            break
+        # skip empty days in one step
+        day = max(day, nxt.astimezone(dt_timezone.utc).date())
+        stats['archived'] += archive_day(day)
+        stats['days'] += 1
+        day += timedelta(days=1)
+    stats['cursor'] = day
+    stats['done'] = day >= horizon
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_second'] = stats['archived'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def _archived_parts(tourist_id, start, end):
+    days = ArchivedDay.objects.filter(tourist_id=tourist_id)
+    if start is not None:
+        days = days.filter(last_at__gte=start)
+    if end is not None:
+        days = days.filter(first_at__lt=end)
+    for day, rel in days.order_by('day').values_list('day', 'path'):
+        records = np.load(os.path.join(ARCHIVE_DIR, rel), mmap_mode='r')
+        base = day_start(day)
+        lo = 0 if start is None else np.searchsorted(records['t'], max((start - base).total_seconds() * 1000, 0), 'left')
+        hi = len(records) if end is None else np.searchsorted(records['t'], (end - base).total_seconds() * 1000, 'left')
+        if hi > lo:
+            yield unpack(day, records[lo:hi])
+
+
+def load_track(tourist_id, start, end):
+    """
+    A tourist's fixes in [start, end) as arrays (epoch, lat, lon, accuracy
+    with NaN for unknown), archived days and live rows merged in time order.
+    `start` may be None (from the first fix); `end` is required so callers
+    always read a fixed window rather than whatever has arrived since.
+    """
+    if end is None:
+        raise ValueError("load_track needs an end.")
+    parts = list(_archived_parts(tourist_id, start, end))
+    live = Location.objects.filter(tourist_id=tourist_id)
+    if start is not None:
+        live = live.filter(timestamp__gte=start)
+    if end is not None:
+        live = live.filter(timestamp__lt=end)
+    rows = list(live.order_by('timestamp').values_list('timestamp', 'latitude', 'longitude', 'accuracy'))
+    if rows:
+        ts, lat, lon, acc = zip(*rows)
+        parts.append({
+            'epoch': np.fromiter((t.timestamp() for t in ts), dtype=np.float64, count=len(ts)),
+            'lat': np.asarray(lat, dtype=np.float64),
+            'lon': np.asarray(lon, dtype=np.float64),
+            'accuracy': np.asarray([np.nan if a is None else a for a in acc], dtype=np.float64),
+        })
+    if not parts:
+        return _empty()
+    track = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    order = np.argsort(track['epoch'], kind='stable')
+    return {k: v[order] for k, v in track.items()}
+
+
+def track_version(tourist_id, start, end):
+    """
+    A cheap stand-in for load_track(tourist_id, start, end): counts and
+    high-water marks of the live rows and archived days it would read, so
+    a late fix or a re-archived day changes it. Fixes are append-only, so
+    edits to existing rows are not tracked.
+    """
+    live = Location.objects.filter(tourist_id=tourist_id, timestamp__lt=end)
+    days = ArchivedDay.objects.filter(tourist_id=tourist_id, first_at__lt=end)
+    if start is not None:
+        live = live.filter(timestamp__gte=start)
+        days = days.filter(last_at__gte=start)
+    live = live.aggregate(n=Count('pk'), pk=Max('pk'), ts=Max('timestamp'))
+    days = days.aggregate(n=Count('pk'), rows=Sum('rows'), path=Max('path'))
+    return (live['n'], live['pk'], live['ts'] and live['ts'].isoformat(), days['n'], days['rows'], days['path'])
+
+
+def iter_archive_arrays(start=None, end=None, tourist_ids=None):
+    """Archived fixes as scan chunks for batch_geofence (one chunk per file)."""
+    days = ArchivedDay.objects.all()
+    if start is not None:
+        days = days.filter(last_at__gte=start)
+    if end is not None:
+        days = days.filter(first_at__lt=end)
+    if tourist_ids:
+        days = days.filter(tourist_id__in=tourist_ids)
+    for tourist_id in days.order_by('tourist_id').values_list('tourist_id', flat=True).distinct():
+        for part in _archived_parts(tourist_id, start, end):
+            part['tourist_id'] = np.full(len(part['epoch']), tourist_id, dtype=np.int64)
+            yield part
@@ -0,0 +1,222 @@
+# accounts/batch_geofence.py
+# Vectorised point-vs-zone evaluation for bulk/historical questions such as
+# "which tourists entered a danger zone yesterday". Live per-ping checks use
+# the grid index in accounts/geo.py instead. Polygon zones are tested
+# through their bounding circle first; only points inside it get the exact
+# polygon test. Scheduled zones only count for points whose timestamp falls
+# in one of their windows (accounts/schedule.py).
+from dataclasses import dataclass, field
+from itertools import chain
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_M, M_PER_DEG_LAT, PreparedPolygon
+from .models import DangerZone, Location
+from .schedule import DAY, EPOCH_WEEKDAY, WEEK, ZoneTimeline
+
+# upper bound on the points x zones distance matrix held in memory at once
+MAX_MATRIX_CELLS = 2_000_000
+DEFAULT_FETCH_SIZE = 50_000
+# UTC offsets of the schedule time zone are looked up once per bucket of this many seconds
+OFFSET_BUCKET_S = 900
+
+
+@dataclass
+class ZoneSet:
+    ids: np.ndarray
+    names: list
+    lat: np.ndarray
+    lon: np.ndarray
+    radius_m: np.ndarray
+    # zone position -> PreparedPolygon; lat/lon/radius_m are then its bounding circle
+    polygons: dict = field(default_factory=dict)
+    timeline: ZoneTimeline = field(default_factory=ZoneTimeline)
+    _tables: tuple = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_zones(cls, zones=None):
+        if zones is None:
+            zones = DangerZone.objects.order_by('pk')
+        zones = list(zones)
+        rows = [(z.pk, z.name, z.center_lat, z.center_lon, z.radius_m) for z in zones]
+        ids, names, lat, lon, radius = zip(*rows) if rows else ((), (), (), (), ())
+        polygons = {i: PreparedPolygon(z.geometry) for i, z in enumerate(zones) if z.geometry}
+        timeline = ZoneTimeline((z.pk, z.schedule) for z in zones)
+        return cls(np.asarray(ids, dtype=np.int64), list(names), np.asarray(lat, dtype=np.float64),
+                   np.asarray(lon, dtype=np.float64), np.asarray(radius, dtype=np.float64), polygons, timeline)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bbox_mask(self, min_lat, min_lon, max_lat, max_lon):
+        # zones whose circle can reach the given box (longitude test is
+        # skipped near the poles / antimeridian where the box math breaks down)
+        dlat = self.radius_m / M_PER_DEG_LAT
+        coslat = np.cos(np.radians(np.minimum(np.abs(self.lat) + dlat, 89.999)))
+        dlon = self.radius_m / (M_PER_DEG_LAT * coslat)
+        mask = (self.lat + dlat >= min_lat) & (self.lat - dlat <= max_lat)
+        lon_ok = (self.lon + dlon >= min_lon) & (self.lon - dlon <= max_lon)
+        wraps = (self.lon - dlon < -180) | (self.lon + dlon > 180)
+        return mask & (lon_ok | wraps)
+
+    def active_mask(self, epochs):
+        """(n_points, n_zones) booleans: zone active at each epoch (unix seconds)."""
+        epochs = np.asarray(epochs, dtype=np.float64)
+        if not self.timeline:
+            return np.ones((len(epochs), len(self)), dtype=bool)
+        if self._tables is None:
+            self._tables = (~np.isin(self.ids, list(self.timeline.scheduled)),
+                            self._table(self.timeline.week_sets), self._table(self.timeline.once_sets))
+        always, week_table, once_table = self._tables
+        buckets, inverse = np.unique(np.floor(epochs / OFFSET_BUCKET_S), return_inverse=True)
+        offsets = np.array([self.timeline.utc_offset(b * OFFSET_BUCKET_S) for b in buckets.tolist()])
+        week_s = (epochs + offsets[inverse.ravel()] + EPOCH_WEEKDAY * DAY) % WEEK
+        # row 0 of each table is "before the first boundary": nothing active
+        week_row = np.searchsorted(self.timeline.week_bounds, week_s, side='right')
+        once_row = np.searchsorted(self.timeline.once_bounds, epochs, side='right')
+        return always[None, :] | week_table[week_row] | once_table[once_row]
+
+    def _table(self, sets):
+        table = np.zeros((len(sets) + 1, len(self)), dtype=bool)
+        for i, active in enumerate(sets, 1):
+            if active:
+                table[i] = np.isin(self.ids, list(active))
+        return table
+
+
+@dataclass
+class BatchResult:
+    zone_index: np.ndarray     # index into ZoneSet of the first containing zone, -1 if none
+    nearest_index: np.ndarray  # index of the zone with the closest edge, -1 if none considered
+    distance_m: np.ndarray     # distance to that zone's edge (<= 0 inside, inf if none considered)
+
+    @property
+    def inside(self):
+        return self.zone_index >= 0
+
+
+def haversine_matrix(lat, lon, zlat, zlon):
+    # (n_points, n_zones) great-circle distances in metres
+    phi1 = np.radians(lat)[:, None]
+    phi2 = np.radians(zlat)[None, :]
+    dphi = phi2 - phi1
+    dlambda = np.radians(zlon)[None, :] - np.radians(lon)[:, None]
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def evaluate(lat, lon, zones, max_cells=MAX_MATRIX_CELLS, exact_nearest=True, epochs=None):
+    """
+    Membership and nearest-zone edge distance for every point, computed in
+    chunks so the distance matrix never exceeds `max_cells` entries.
+    With exact_nearest=False each chunk is only tested against zones that can
+    reach its bounding box, so nearest/distance cover those candidates only.
+    With `epochs` (unix seconds per point), scheduled zones are skipped for
+    points outside their windows; without, every zone counts.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    epochs = None if epochs is None else np.asarray(epochs, dtype=np.float64)
+    n = len(lat)
+    zone_index = np.full(n, -1, dtype=np.int64)
+    nearest = np.full(n, -1, dtype=np.int64)
+    distance = np.full(n, np.inf)
+    if not n or not len(zones):
+        return BatchResult(zone_index, nearest, distance)
+    all_zones = np.arange(len(zones))
+    step = max(1, max_cells // len(zones))
+    for start in range(0, n, step):
+        sl = slice(start, min(start + step, n))
+        clat, clon = lat[sl], lon[sl]
+        candidates = all_zones
+        active = zones.active_mask(epochs[sl]) if epochs is not None and zones.timeline else None
+        if not exact_nearest:
+            reach = zones.bbox_mask(clat.min(), clon.min(), clat.max(), clon.max())
+            if active is not None:
+                reach &= active.any(axis=0)
+            candidates = np.flatnonzero(reach)
+            if not len(candidates):
+                continue
+        edge = haversine_matrix(clat, clon, zones.lat[candidates], zones.lon[candidates]) - zones.radius_m[candidates][None, :]
+        if active is not None:
+            edge[~active[:, candidates]] = np.inf
+        if zones.polygons:
+            _refine_polygons(edge, clat, clon, candidates, zones.polygons)
+        closest = edge.argmin(axis=1)
+        distance[sl] = edge[np.arange(edge.shape[0]), closest]
+        # points for which no candidate was active have no nearest zone
+        nearest[sl] = np.where(np.isfinite(distance[sl]), candidates[closest], -1)
+        inside = edge <= 0
+        zone_index[sl] = np.where(inside.any(axis=1), candidates[inside.argmax(axis=1)], -1)
+    return BatchResult(zone_index, nearest, distance)
+
+
+def _refine_polygons(edge, lat, lon, candidates, polygons):
+    # inside a polygon's bounding circle, replace the circle distance with the
+    # polygon's own (0 inside); outside it the circle distance is a lower bound
+    for j, zi in enumerate(candidates.tolist()):
+        polygon = polygons.get(zi)
+        if polygon is None:
+            continue
+        for r in np.flatnonzero(edge[:, j] <= 0).tolist():
+            distance = polygon.distance_m(float(lat[r]), float(lon[r]))
+            edge[r, j] = distance if distance > 0 else -0.0
+
+
+def iter_location_arrays(queryset=None, fetch_size=DEFAULT_FETCH_SIZE):
+    # keyset-paginated column fetch: no model instances are built
+    queryset = Location.objects.all() if queryset is None else queryset
+    queryset = queryset.order_by('pk')
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'tourist_id', 'timestamp', 'latitude', 'longitude')[:fetch_size])
+        if not rows:
+            return
+        pk, tourist, ts, lat, lon = zip(*rows)
+        yield {
+            'pk': np.asarray(pk, dtype=np.int64),
+            'tourist_id': np.asarray(tourist, dtype=np.int64),
+            'epoch': np.fromiter((t.timestamp() for t in ts), dtype=np.float64, count=len(ts)),
+            'lat': np.asarray(lat, dtype=np.float64),
+            'lon': np.asarray(lon, dtype=np.float64),
+        }
+        last_pk = pk[-1]
+
+
+def scan_locations(queryset=None, zones=None, fetch_size=DEFAULT_FETCH_SIZE, max_cells=MAX_MATRIX_CELLS, extra_chunks=()):
+    """
+    Evaluate stored Location rows against the zone set. Returns one summary
+    dict per (tourist, zone) pair that had at least one point inside the zone.
+    `extra_chunks` are further arrays in the same shape (e.g. archived days).
+    """
+    zones = zones if isinstance(zones, ZoneSet) else ZoneSet.from_zones(zones)
+    hits = {}
+    processed = 0
+    for chunk in chain(iter_location_arrays(queryset, fetch_size), extra_chunks):
+        processed += len(chunk['lat'])
+        result = evaluate(chunk['lat'], chunk['lon'], zones, max_cells=max_cells, exact_nearest=False,
+                          epochs=chunk['epoch'])
+        inside = np.flatnonzero(result.inside)
+        if not len(inside):
+            continue
+        tourists = chunk['tourist_id'][inside]
+        zone_idx = result.zone_index[inside]
+        epochs = chunk['epoch'][inside]
+        # group hits of this chunk by (tourist, zone)
+        keys = np.stack([tourists, zone_idx], axis=1)
+        uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        first = np.full(len(uniq), np.inf)
+        last = np.full(len(uniq), -np.inf)
+        np.minimum.at(first, inverse, epochs)
+        np.maximum.at(last, inverse, epochs)
+        counts = np.bincount(inverse, minlength=len(uniq))
+        for (tourist_id, zi), f, l, c in zip(uniq.tolist(), first, last, counts):
+            entry = hits.setdefault((tourist_id, zi), {'first_epoch': f, 'last_epoch': l, 'points': 0})
+            entry['first_epoch'] = min(entry['first_epoch'], f)
+            entry['last_epoch'] = max(entry['last_epoch'], l)
+            entry['points'] += int(c)
+    return processed, [
+        dict(tourist_id=tourist_id, zone_id=int(zones.ids[zi]), zone_name=zones.names[zi], **entry)
+        for (tourist_id, zi), entry in sorted(hits.items())
+    ]
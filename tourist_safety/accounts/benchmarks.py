@@ -0,0 +1,71 @@
+# accounts/benchmarks.py
+# Shared helpers for the bench_* management commands.
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def isolated_database(keepdb=False):
+    # run against a throwaway test database so benchmarks never touch real data
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+@contextmanager
+def threaded_database():
+    # isolated_database for multi-threaded runs: SQLite gets a real file, as
+    # the shared in-memory test database has no journal to contend on
+    with tempfile.TemporaryDirectory() as tmp:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        with isolated_database():
+            yield
+
+
+def git_revision():
+    # recorded with benchmark results so runs can be compared across commits
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples_ms):
+    return {
+        'n': len(samples_ms),
+        'mean_ms': round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else None,
+        'p50_ms': _round(percentile(samples_ms, 50)),
+        'p95_ms': _round(percentile(samples_ms, 95)),
+        'p99_ms': _round(percentile(samples_ms, 99)),
+        'max_ms': _round(max(samples_ms) if samples_ms else None),
+    }
+
+
+def _round(v):
+    return None if v is None else round(v, 3)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000.0, result
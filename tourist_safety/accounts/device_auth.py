@@ -0,0 +1,175 @@
+# accounts/device_auth.py
+# Stateless bearer tokens for the high-frequency device endpoints (location
+# pings, SOS, audio uploads and the resumable recording). A token is the tourist's id and role signed with
+# SECRET_KEY (django.core.signing), so checking it needs no session row and
+# no user row. Revocations are kept in DeviceTokenRevocation; workers read
+# the still-relevant ones as one small snapshot from the cache, refilled from
+# the table at most every DENYLIST_TTL seconds. Revoking clears the cached
+# snapshot on commit, so with a shared cache every worker sees it at once.
+#
+# DeviceTokenMiddleware sits right after SecurityMiddleware: a request to one
+# of the device views that carries `Authorization: Bearer <token>` is
+# authenticated from the token and handed to the view directly, skipping
+# sessions, CSRF (there is no cookie to forge), auth and messages. Being
+# below SecurityMiddleware, the fast path still gets its HTTPS redirect and
+# headers; X-Frame-Options is added here, and an exception from the view is
+# noted for the metrics, as the handler's process_exception hooks never see it.
+import secrets
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.http import JsonResponse
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from . import metrics
+from .models import CustomUser, DeviceTokenRevocation
+
+SALT = 'accounts.device_token'
+MAX_AGE = timedelta(seconds=getattr(settings, 'DEVICE_TOKEN_MAX_AGE', 30 * 86400))
+DENYLIST_TTL = getattr(settings, 'DEVICE_TOKEN_DENYLIST_TTL', 10)
+DENYLIST_CACHE_KEY = 'accounts:device_token_denylist'
+# url names served on the token fast path
+VIEWS = frozenset(getattr(settings, 'DEVICE_TOKEN_VIEWS',
+                          ('api_location', 'update_location', 'api_sos', 'upload_sos_audio',
+                           'sos_recording', 'sos_recording_finalize')))
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def issue(user):
+    """A device token for a tourist; -> (token, expires_at)."""
+    now = timezone.now()
+    claims = {'u': user.pk, 'r': user.role, 'j': secrets.token_urlsafe(12), 'i': int(now.timestamp() * 1000)}
+    return signing.dumps(claims, salt=SALT, compress=False), now + MAX_AGE
+
+
+def verify(token):
+    """Claims of a valid, unexpired, unrevoked token: {'u': user id, 'r': role, 'j': token id, 'i': issued ms}."""
+    try:
+        claims = signing.loads(token, salt=SALT, max_age=MAX_AGE)
+    except signing.SignatureExpired:
+        raise InvalidToken("token expired")
+    except signing.BadSignature:
+        raise InvalidToken("invalid token")
+    jtis, not_before = denylist()
+    if claims['j'] in jtis or claims['i'] < not_before.get(claims['u'], 0):
+        raise InvalidToken("token revoked")
+    return claims
+
+
+def authenticate(token):
+    """The token's user, built from its claims without a query."""
+    claims = verify(token)
+    return CustomUser(pk=claims['u'], role=claims['r'])
+
+
+def bearer(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return header[7:].strip() if header[:7].lower() == 'bearer ' else None
+
+
+def denylist():
+    """(revoked token ids, {user id: tokens issued before this many ms are revoked})."""
+    state = cache.get(DENYLIST_CACHE_KEY)
+    if state is None:
+        jtis, not_before = set(), {}
+        rows = DeviceTokenRevocation.objects.filter(expires_at__gt=timezone.now())
+        for user_id, jti, revoked_at in rows.values_list('user_id', 'jti', 'revoked_at'):
+            if jti:
+                jtis.add(jti)
+            else:
+                not_before[user_id] = max(not_before.get(user_id, 0), int(revoked_at.timestamp() * 1000) + 1)
+        state = (frozenset(jtis), not_before)
+        cache.set(DENYLIST_CACHE_KEY, state, DENYLIST_TTL)
+    return state
+
+
+def invalidate_denylist():
+    cache.delete(DENYLIST_CACHE_KEY)
+
+
+def _revoke(user_id, jti=''):
+    now = timezone.now()
+    # rows whose tokens have all expired are dropped, keeping the list short
+    DeviceTokenRevocation.objects.filter(expires_at__lte=now).delete()
+    DeviceTokenRevocation.objects.create(user_id=user_id, jti=jti, revoked_at=now, expires_at=now + MAX_AGE)
+    transaction.on_commit(invalidate_denylist)
+
+
+def revoke(claims):
+    """Revoke one token, given its claims."""
+    _revoke(claims['u'], claims['j'])
+
+
+def revoke_user(user_id):
+    """Revoke every token issued to the user so far."""
+    _revoke(user_id)
+
+
+def unauthorized(message):
+    response = JsonResponse({'error': message}, status=401)
+    response['WWW-Authenticate'] = f'Bearer error="invalid_token", error_description="{message}"'
+    return response
+
+
+class DeviceTokenMiddleware:
+    """Put right after SecurityMiddleware; everything after it is skipped on the fast path."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.xframe = XFrameOptionsMiddleware(get_response)
+
+    def route(self, request):
+        # -> (resolver match, token) for a device view called with a token, else None
+        token = bearer(request)
+        if token is None:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return (match, token) if match.url_name in VIEWS else None
+
+    def call_view(self, request, match, token):
+        try:
+            request.user = authenticate(token)
+        except InvalidToken as e:
+            response = unauthorized(str(e))
+        else:
+            request.resolver_match = match
+            request._dont_enforce_csrf_checks = True
+            try:
+                response = match.func(request, *match.args, **match.kwargs)
+            except Exception:
+                metrics.note_exception(request)
+                raise
+        return self.xframe.process_response(request, response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        routed = self.route(request)
+        if routed is None:
+            return self.get_response(request)
+        return self.call_view(request, *routed)
+
+    async def __acall__(self, request):
+        routed = self.route(request)
+        if routed is None:
+            return await self.get_response(request)
+        # the device views are sync and use the database
+        return await sync_to_async(self.call_view)(request, *routed)
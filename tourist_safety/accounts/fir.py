@@ -0,0 +1,391 @@
+# accounts/fir.py
+# FIR PDF rendering off the request path. The view gathers the FIR inputs
+# into a plain dict, hashes them, and either serves a cached artifact or hands
+# the render to a process pool; ReportLab never runs inside the request. The
+# hash is remembered under a fingerprint of every source the inputs come from
+# (SOS row, tourist profile, officer, trail window), so further downloads and
+# status polls find the artifact or job with two aggregate queries instead of
+# collecting the inputs again, and any change to a source re-collects.
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .archive import load_track, track_version
+from .trajectory import simplify
+
+# bump when the PDF layout changes so cached artifacts are not reused
+RENDER_VERSION = 2
+# raw fixes read for the trail, and how many significant ones the table shows
+TRACK_MAX_RAW = getattr(settings, 'FIR_TRACK_MAX_RAW', 5000)
+TRACK_MAX_POINTS = getattr(settings, 'FIR_TRACK_MAX_POINTS', 60)
+# the trail covers TRACK_BEFORE up to the SOS, plus TRACK_AFTER for device clocks running ahead
+TRACK_BEFORE = timedelta(minutes=getattr(settings, 'FIR_TRACK_BEFORE_MINUTES', 10))
+TRACK_AFTER = timedelta(seconds=getattr(settings, 'FIR_TRACK_AFTER_SECONDS', 60))
+
+# FIRs hold Aadhaar/passport data: keep them out of MEDIA_ROOT, which is served
+ARTIFACT_DIR = getattr(settings, 'FIR_ARTIFACT_DIR', os.path.join(settings.BASE_DIR, 'var', 'fir'))
+ARTIFACT_MAX_AGE = getattr(settings, 'FIR_ARTIFACT_MAX_AGE', 7 * 24 * 3600)
+ARTIFACT_MAX_BYTES = getattr(settings, 'FIR_ARTIFACT_MAX_BYTES', 500 * 1024 * 1024)
+# 'process' renders in a ProcessPoolExecutor; 'inline' renders in the caller
+# (tests, management commands)
+EXECUTOR = getattr(settings, 'FIR_PDF_EXECUTOR', 'process')
+WORKERS = getattr(settings, 'FIR_PDF_WORKERS', 2)
+
+PENDING, READY, FAILED = 'pending', 'ready', 'failed'
+
+
+def track_window(sos):
+    return sos.created_at - TRACK_BEFORE, sos.created_at + TRACK_AFTER
+
+
+def _profile(tourist_user):
+    try:
+        return tourist_user.tourist_profile
+    except Exception:
+        return None
+
+
+def _officer(officer):
+    return {
+        'officer': officer.get_full_name() or officer.username,
+        'station': getattr(officer, 'police_profile').station_name if hasattr(officer, 'police_profile') else '',
+    }
+
+
+def collect_inputs(sos, officer):
+    """Everything the PDF shows, as JSON-serialisable data (read in the request)."""
+    tourist_user = sos.tourist
+    tp = _profile(tourist_user)
+    # the fixed window leading up to the SOS: later pings do not change the
+    # report. The first TRACK_MAX_RAW fixes of it (live rows merged with any
+    # archived days), reduced to the significant ones so the table stays bounded
+    track = load_track(tourist_user.pk, *track_window(sos))
+    track = {k: v[:TRACK_MAX_RAW] for k, v in track.items()}
+    keep = simplify(track['epoch'].tolist(), track['lat'].tolist(), track['lon'].tolist(), max_points=TRACK_MAX_POINTS)
+    profile = None
+    if tp:
+        profile = {
+            'full_name': tp.full_name,
+            'age': tp.age,
+            'phone_number': tp.phone_number,
+            'aadhaar_number': tp.aadhaar_number or '',
+            'passport_id': tp.passport_id or '',
+            'entry_date': tp.entry_date.isoformat(),
+            'leave_date': tp.leave_date.isoformat(),
+        }
+    return {
+        'render_version': RENDER_VERSION,
+        'sos_id': sos.id,
+        **_officer(officer),
+        'created_at': sos.created_at.strftime('%Y-%m-%d %H:%M:%S %Z'),
+        'lat': sos.lat,
+        'lon': sos.lon,
+        'description': sos.description,
+        'username': tourist_user.username,
+        'profile': profile,
+        'raw_location_count': len(track['epoch']),
+        'locations': [_location_row(track, i) for i in keep],
+    }
+
+
+def _location_row(track, i):
+    ts = datetime.fromtimestamp(float(track['epoch'][i]), tz=dt_timezone.utc).astimezone()
+    accuracy = float(track['accuracy'][i])
+    return [ts.isoformat(), float(track['lat'][i]), float(track['lon'][i]), None if math.isnan(accuracy) else accuracy]
+
+
+def inputs_hash(inputs):
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def digest_key(sos, officer):
+    # every source collect_inputs reads; hashed, as the profile holds Aadhaar/passport numbers
+    tp = _profile(sos.tourist)
+    sources = [
+        sos.pk, sos.updated_at.isoformat(), sos.tourist.username,
+        [getattr(tp, f.attname) for f in tp._meta.concrete_fields] if tp else None,
+        officer.pk, _officer(officer),
+        track_version(sos.tourist_id, *track_window(sos)),
+    ]
+    version = hashlib.sha256(json.dumps(sources, default=str).encode()).hexdigest()[:32]
+    return f'accounts:fir_digest:{sos.pk}:{version}'
+
+
+def remembered_digest(key):
+    return cache.get(key)
+
+
+def remember_digest(key, digest):
+    cache.set(key, digest, ARTIFACT_MAX_AGE)
+
+
+def artifact_path(sos_id, digest):
+    return os.path.join(ARTIFACT_DIR, f"FIR_SOS_{sos_id}_{digest}.pdf")
+
+
+def render_pdf(inputs):
+    """Build the FIR document from collected inputs -> PDF bytes. No DB access."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=40, rightMargin=40, topMargin=40, bottomMargin=40)
+    styles = getSampleStyleSheet()
+    normal = styles['Normal']
+    heading = styles['Heading1']
+    small = ParagraphStyle('small', parent=normal, fontSize=9, leading=11)
+
+    elements = []
+
+    # Header
+    elements.append(Paragraph("DIGITAL FIR - EMERGENCY SOS REPORT", heading))
+    elements.append(Spacer(1, 12))
+
+    # Meta
+    elements.append(Paragraph(f"<b>FIR ID:</b> {inputs['sos_id']}", normal))
+    elements.append(Paragraph(f"<b>Generated by (police):</b> {inputs['officer']}", normal))
+    elements.append(Paragraph(f"<b>FIR Created At:</b> {inputs['created_at']}", normal))
+    elements.append(Spacer(1, 12))
+
+    # Tourist info block
+    elements.append(Paragraph("<b>Tourist Information</b>", styles['Heading2']))
+    t_rows = [["Username", inputs['username']]]
+    tp = inputs['profile']
+    if tp:
+        t_rows.append(["Full name", tp['full_name']])
+        t_rows.append(["Age", str(tp['age'])])
+        t_rows.append(["Phone", tp['phone_number']])
+        # Aadhaar/passport are sensitive; only included because police requested FIR
+        t_rows.append(["Aadhaar / National ID", tp['aadhaar_number']])
+        t_rows.append(["Passport ID", tp['passport_id']])
+        t_rows.append(["Entry Date", tp['entry_date']])
+        t_rows.append(["Leave Date", tp['leave_date']])
+    else:
+        t_rows.append(["Profile", "No tourist profile data available."])
+
+    t_table = Table(t_rows, colWidths=[140, 340])
+    t_table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+        ('BOX', (0,0), (-1,-1), 0.25, colors.black),
+        ('INNERGRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('LEFTPADDING', (0,0), (-1,-1), 6),
+        ('RIGHTPADDING', (0,0), (-1,-1), 6),
+    ]))
+    elements.append(t_table)
+    elements.append(Spacer(1, 12))
+
+    # SOS summary
+    elements.append(Paragraph("<b>SOS Event Summary</b>", styles['Heading2']))
+    elements.append(Paragraph(f"<b>SOS Created at:</b> {inputs['created_at']}", normal))
+    if inputs['lat'] and inputs['lon']:
+        elements.append(Paragraph(f"<b>Reported Location (summary):</b> {inputs['lat']}, {inputs['lon']}", normal))
+    if inputs['description']:
+        elements.append(Paragraph(f"<b>Description:</b> {inputs['description']}", normal))
+    elements.append(Spacer(1, 12))
+
+    # Locations table
+    elements.append(Paragraph("<b>Recent Location Points (chronological)</b>", styles['Heading3']))
+    raw_count = inputs.get('raw_location_count', len(inputs['locations']))
+    if raw_count > len(inputs['locations']):
+        elements.append(Paragraph(
+            f"{len(inputs['locations'])} significant points of {raw_count} recorded; "
+            "points on a straight, steady path between them are omitted.", small))
+    if inputs['locations']:
+        loc_table_data = [["#", "Timestamp (ISO)", "Latitude", "Longitude", "Accuracy (m)"]]
+        for i, (ts, lat, lon, accuracy) in enumerate(inputs['locations'], start=1):
+            loc_table_data.append([
+                str(i),
+                ts,
+                f"{lat:.6f}",
+                f"{lon:.6f}",
+                f"{accuracy if accuracy is not None else ''}"
+            ])
+        # Try to keep the table width reasonable
+        loc_table = Table(loc_table_data, colWidths=[30, 160, 90, 90, 90])
+        loc_table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f0f0f0')),
+            ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+            ('FONTSIZE', (0,0), (-1,-1), 9),
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ]))
+        elements.append(loc_table)
+    else:
+        elements.append(Paragraph("No recent location points found for the 10 minutes before the SOS creation.", normal))
+
+    elements.append(Spacer(1, 16))
+
+    # Footer / signature placeholder
+    elements.append(Paragraph("Statement:", styles['Heading3']))
+    elements.append(Paragraph("This digital FIR was generated automatically from the SOS event record stored in the Tourist Safety System. For any further verification, please contact the station.", small))
+    elements.append(Spacer(1, 24))
+    elements.append(Paragraph("Signature (Police Officer): ______________________", normal))
+    elements.append(Spacer(1, 6))
+    elements.append(Paragraph(f"Station: {inputs['station'] or ''}", small))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def render_to_artifact(inputs, path):
+    # runs in the pool worker: render and publish the file atomically
+    pdf = render_pdf(inputs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(pdf)
+
+
+def evict_artifacts(max_age=ARTIFACT_MAX_AGE, max_bytes=ARTIFACT_MAX_BYTES, now=None):
+    """Drop artifacts unused for `max_age` seconds, then the least recently used until under `max_bytes`."""
+    now = time.time() if now is None else now
+    try:
+        names = [n for n in os.listdir(ARTIFACT_DIR) if n.endswith('.pdf')]
+    except FileNotFoundError:
+        return 0
+    entries = []
+    for name in names:
+        path = os.path.join(ARTIFACT_DIR, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+class JobRunner:
+    """Dedupes renders per artifact and tracks their state for the status endpoint."""
+
+    def __init__(self, mode=EXECUTOR, workers=WORKERS):
+        self.mode = mode
+        self.workers = workers
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, inputs, digest):
+        path = artifact_path(inputs['sos_id'], digest)
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is not None and not (job.done() and job.exception()):
+                return job
+            if self.mode == 'inline':
+                job = _InlineJob(render_to_artifact, inputs, path)
+            else:
+                job = self._pool().submit(render_to_artifact, inputs, path)
+            self._jobs[path] = job
+        job.add_done_callback(lambda _: self._finished(path))
+        return job
+
+    def _finished(self, path):
+        job = self._jobs.get(path)
+        if job is not None and job.exception() is None:
+            with self._lock:
+                self._jobs.pop(path, None)
+            evict_artifacts()
+
+    def status(self, sos_id, digest):
+        """-> (state, error)"""
+        path = artifact_path(sos_id, digest)
+        if os.path.exists(path):
+            return READY, None
+        job = self._jobs.get(path)
+        if job is None:
+            return None, None
+        if job.done() and job.exception() is not None:
+            return FAILED, str(job.exception())
+        return PENDING, None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class _InlineJob:
+    # Future-like wrapper for renders done in the calling thread
+    def __init__(self, fn, *args):
+        self._exception = None
+        self._result = None
+        try:
+            self._result = fn(*args)
+        except Exception as e:
+            self._exception = e
+
+    def done(self):
+        return True
+
+    def exception(self):
+        return self._exception
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner()
+    return _runner
+
+
+def open_artifact(sos_id, digest):
+    """Open a cached FIR for reading (and mark it recently used), or None."""
+    path = artifact_path(sos_id, digest)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return f
@@ -4,6 +4,7 @@ from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from .models import CustomUser, TouristProfile, EmergencyContact
 from django.conf import settings
 from django.core.exceptions import ValidationError
+import json
 
 class TouristRegistrationForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -81,13 +82,95 @@ class PoliceRegistrationForm(UserCreationForm):
 # accounts/forms.py
 from django import forms
 from .models import DangerZone
+from .geo import normalize_geometry
+from .schedule import DAY_NAMES, normalize_schedule, schedule_tz
+from datetime import datetime
+from django.utils import timezone
 
 # accounts/forms.py
 class DangerZoneForm(forms.ModelForm):
+    # GeoJSON drawn on the map; when given, the circle fields are derived from it
+    geometry = forms.CharField(required=False, widget=forms.HiddenInput())
+    # one weekly and one one-off activation window; with neither the zone is always active.
+    # Times are wall-clock times in the schedule time zone.
+    active_days = forms.MultipleChoiceField(
+        required=False, choices=[(str(i), name) for i, name in enumerate(DAY_NAMES)],
+        widget=forms.CheckboxSelectMultiple, label="Active on")
+    active_from = forms.TimeField(required=False, widget=forms.TimeInput(attrs={"type": "time"}, format="%H:%M"))
+    active_until = forms.TimeField(required=False, widget=forms.TimeInput(attrs={"type": "time"}, format="%H:%M"),
+                                   help_text="Earlier than the start: runs past midnight.")
+    event_start = forms.DateTimeField(
+        required=False, widget=forms.DateTimeInput(attrs={"type": "datetime-local"}, format="%Y-%m-%dT%H:%M"))
+    event_end = forms.DateTimeField(
+        required=False, widget=forms.DateTimeInput(attrs={"type": "datetime-local"}, format="%Y-%m-%dT%H:%M"))
+
     class Meta:
         model = DangerZone
-        fields = ["name", "radius_m", "center_lat", "center_lon"]
+        fields = ["name", "radius_m", "center_lat", "center_lon", "geometry"]
         widgets = {
             "center_lat": forms.HiddenInput(),
             "center_lon": forms.HiddenInput(),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in ("radius_m", "center_lat", "center_lon"):
+            self.fields[name].required = False
+        if self.instance.geometry:
+            self.initial["geometry"] = json.dumps(self.instance.geometry)
+        schedule = self.instance.schedule or {}
+        # further windows (set outside this form) are kept as they are
+        self._extra_weekly = schedule.get("weekly", [])[1:]
+        self._extra_once = schedule.get("once", [])[1:]
+        if schedule.get("weekly"):
+            window = schedule["weekly"][0]
+            self.initial.update(active_days=[str(d) for d in window["days"]],
+                                active_from=window["start"], active_until=window["end"])
+        if schedule.get("once"):
+            tz = schedule_tz()
+            start, end = (datetime.fromisoformat(v).astimezone(tz).replace(tzinfo=None) for v in schedule["once"][0])
+            self.initial.update(event_start=start, event_end=end)
+
+    def clean_geometry(self):
+        value = self.cleaned_data.get("geometry")
+        if not value:
+            return None
+        try:
+            return normalize_geometry(value)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+    def clean(self):
+        cleaned = super().clean()
+        circle = ("radius_m", "center_lat", "center_lon")
+        if cleaned.get("geometry"):
+            # the model derives the circle around a polygon zone on save
+            for name in circle:
+                if cleaned.get(name) is None:
+                    cleaned[name] = 0.0
+        elif "geometry" not in self.errors and any(cleaned.get(name) is None for name in circle):
+            raise ValidationError("Pick a centre and radius, or draw a polygon.")
+        cleaned["schedule"] = self._clean_schedule(cleaned)
+        return cleaned
+
+    def _clean_schedule(self, cleaned):
+        weekly, once = list(self._extra_weekly), list(self._extra_once)
+        days, start, end = cleaned.get("active_days"), cleaned.get("active_from"), cleaned.get("active_until")
+        if days or start or end:
+            if not (days and start and end):
+                raise ValidationError("A weekly window needs its days and both times.")
+            weekly.insert(0, {"days": [int(d) for d in days], "start": start, "end": end})
+        event_start, event_end = cleaned.get("event_start"), cleaned.get("event_end")
+        if event_start or event_end:
+            if not (event_start and event_end):
+                raise ValidationError("A one-off window needs a start and an end.")
+            # entered as wall-clock times of the schedule time zone
+            once.insert(0, [timezone.make_naive(event_start), timezone.make_naive(event_end)])
+        try:
+            return normalize_schedule({"weekly": weekly, "once": once})
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+    def save(self, commit=True):
+        self.instance.schedule = self.cleaned_data.get("schedule")
+        return super().save(commit)
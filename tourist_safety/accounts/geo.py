@@ -0,0 +1,429 @@
+# accounts/geo.py
+import bisect
+import json
+import math
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DangerZone, ZoneSetVersion
+from .schedule import ZoneTimeline
+
+EARTH_RADIUS_M = 6371000
+M_PER_DEG_LAT = 111320.0
+
+# grid cell size in degrees (~5.5 km at the equator)
+CELL_DEG = getattr(settings, 'ZONE_INDEX_CELL_DEG', 0.05)
+# zones spanning more cells than this are kept in a short "always check" list
+MAX_CELLS_PER_ZONE = getattr(settings, 'ZONE_INDEX_MAX_CELLS_PER_ZONE', 400)
+# how long a worker trusts its cached zone-set version before re-reading it.
+# With a shared cache backend (redis/memcached) writes are seen immediately;
+# with the default per-process LocMemCache other workers catch up within this.
+VERSION_TTL = getattr(settings, 'ZONE_INDEX_VERSION_TTL', 2)
+VERSION_CACHE_KEY = 'accounts:zone_set_state'
+# pre-serialised /api/zones/ bodies, keyed by zone-set version
+ZONE_LIST_CACHE_TIMEOUT = getattr(settings, 'ZONE_LIST_CACHE_TIMEOUT', 24 * 3600)
+MAX_POLYGON_VERTICES = getattr(settings, 'DANGER_ZONE_MAX_VERTICES', 10_000)
+# slab tables larger than this (pathological, comb-like shapes) fall back to bands
+MAX_SLAB_ENTRIES = 200_000
+POLYGON_BANDS = 256
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # returns distance in meters
+    R = EARTH_RADIUS_M
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+def bbox_for_radius(lat, lon, radius_m):
+    # (min_lat, min_lon, max_lat, max_lon); longitudes may run past +-180
+    dlat = radius_m / M_PER_DEG_LAT
+    coslat = math.cos(math.radians(min(abs(lat) + dlat, 89.999)))
+    dlon = min(radius_m / (M_PER_DEG_LAT * coslat), 180.0)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def normalize_geometry(geometry):
+    """
+    Validate a GeoJSON Polygon or MultiPolygon (or a Feature holding one,
+    or its JSON text) -> {'type': 'MultiPolygon', 'coordinates': ...} with
+    closed [lon, lat] rings. Raises ValueError.
+    """
+    if isinstance(geometry, str):
+        try:
+            geometry = json.loads(geometry)
+        except ValueError:
+            raise ValueError("geometry is not valid JSON")
+    if isinstance(geometry, dict) and geometry.get('type') == 'Feature':
+        geometry = geometry.get('geometry')
+    if not isinstance(geometry, dict) or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+        raise ValueError("geometry must be a GeoJSON Polygon or MultiPolygon")
+    polygons = geometry.get('coordinates')
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    if not isinstance(polygons, list) or not polygons:
+        raise ValueError("geometry has no coordinates")
+    out, vertices = [], 0
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError("a polygon needs at least an outer ring")
+        rings = []
+        for ring in polygon:
+            try:
+                points = [(round(float(lon), 7), round(float(lat), 7)) for lon, lat, *_ in ring]
+            except (TypeError, ValueError):
+                raise ValueError("ring positions must be [lon, lat] numbers")
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            if len(set(points)) < 3:
+                raise ValueError("a ring needs at least 3 distinct positions")
+            if not all(-180 <= lon <= 180 and -90 <= lat <= 90 for lon, lat in points):
+                raise ValueError("positions must be within lon -180..180, lat -90..90")
+            vertices += len(points)
+            rings.append([list(p) for p in points + points[:1]])
+        out.append(rings)
+    if vertices > MAX_POLYGON_VERTICES:
+        raise ValueError(f"at most {MAX_POLYGON_VERTICES} vertices per zone")
+    geometry = {'type': 'MultiPolygon', 'coordinates': out}
+    _check_simple(geometry)
+    return geometry
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def _crosses(e, f):
+    # proper crossing only: edges that merely share or touch at a vertex do not count
+    (ax, ay, bx, by), (cx, cy, dx, dy) = e, f
+    return (_orientation(ax, ay, bx, by, cx, cy) * _orientation(ax, ay, bx, by, dx, dy) < 0
+            and _orientation(cx, cy, dx, dy, ax, ay) * _orientation(cx, cy, dx, dy, bx, by) < 0)
+
+
+def _in_ring(x, y, ring):
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            inside = not inside
+    return inside
+
+
+def _on_ring(x, y, ring):
+    return any(_orientation(x0, y0, x1, y1, x, y) == 0 and min(x0, x1) <= x <= max(x0, x1)
+               and min(y0, y1) <= y <= max(y0, y1) for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def _inside(x, y, rings):
+    # even-odd over the rings; None on a boundary, where the answer says nothing
+    if any(_on_ring(x, y, ring) for ring in rings):
+        return None
+    return sum(_in_ring(x, y, ring) for ring in rings) % 2 == 1
+
+
+def _check_simple(geometry):
+    # even-odd membership is only right for simple shapes: no ring may cross
+    # itself or another ring, holes sit inside their outer ring, and members
+    # of a MultiPolygon do not overlap (an overlap would count as outside)
+    polygons, edges = [], []
+    for polygon in geometry['coordinates']:
+        rings = list(_rings({'type': 'Polygon', 'coordinates': polygon}))
+        polygons.append(rings)
+        for ring in rings:
+            edges.extend((x0, y0, x1, y1) for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+    # sweep bottom to top, testing each edge against the edges whose y-range it overlaps
+    active = []
+    for edge in sorted(edges, key=lambda e: min(e[1], e[3])):
+        y_lo = min(edge[1], edge[3])
+        active = [e for e in active if max(e[1], e[3]) >= y_lo]
+        x_lo, x_hi = min(edge[0], edge[2]), max(edge[0], edge[2])
+        for other in active:
+            if min(other[0], other[2]) <= x_hi and max(other[0], other[2]) >= x_lo and _crosses(edge, other):
+                raise ValueError("rings must not cross themselves or each other")
+        active.append(edge)
+    # with no crossings, a ring is on one side of another throughout: the
+    # first of its vertices not on the other's boundary tells which
+    def side(ring, rings):
+        return next((inside for inside in (_inside(x, y, rings) for x, y in ring) if inside is not None), None)
+
+    for rings in polygons:
+        for hole in rings[1:]:
+            if side(hole, rings[:1]) is False:
+                raise ValueError("a hole must lie inside its outer ring")
+    boxes = [(min(x for x, _ in r[0]), min(y for _, y in r[0]), max(x for x, _ in r[0]), max(y for _, y in r[0]))
+             for r in polygons]
+    for i, rings in enumerate(polygons):
+        for j, other in enumerate(polygons):
+            a, b = boxes[i], boxes[j]
+            if i == j or not (a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]):
+                continue
+            inside = side(rings[0], other)
+            if inside is None:
+                # every vertex on the other's boundary (e.g. the same ring twice): try its vertex centroid
+                cx, cy = (sum(c) / len(rings[0]) for c in zip(*rings[0]))
+                inside = _inside(cx, cy, rings) and _inside(cx, cy, other)
+            if inside:
+                raise ValueError("polygons of a MultiPolygon must not overlap")
+
+
+def _rings(geometry):
+    # [(lon, lat), ...] rings without the closing position, longitudes of each
+    # polygon unwrapped so it never jumps across the antimeridian
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    for polygon in polygons:
+        ref = polygon[0][0][0]
+        for ring in polygon:
+            yield [(lon + 360.0 * round((ref - lon) / 360.0), lat) for lon, lat in ring[:-1]]
+
+
+class Circle:
+    def __init__(self, lat, lon, radius_m):
+        self.lat, self.lon, self.radius_m = lat, lon, radius_m
+        self.bbox = bbox_for_radius(lat, lon, radius_m)
+
+    def contains(self, lat, lon):
+        return haversine(lat, lon, self.lat, self.lon) <= self.radius_m
+
+    def distance_m(self, lat, lon):
+        """Metres to the zone, 0 inside."""
+        return max(haversine(lat, lon, self.lat, self.lon) - self.radius_m, 0.0)
+
+
+class PreparedPolygon:
+    """
+    Even-odd point-in-polygon over every ring of a (multi)polygon. The
+    distinct vertex latitudes cut it into horizontal slabs; the edges
+    crossing a slab cannot cross each other inside it, so they are kept
+    sorted west to east and a test is two binary searches: the slab, then
+    the number of edges west of the point.
+    """
+
+    def __init__(self, geometry):
+        rings = list(_rings(geometry))
+        edges = []
+        # every edge, horizontal ones included, for distances
+        self.segments = [(x0, y0, x1, y1) for ring in rings for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1])]
+        for x0, y0, x1, y1 in self.segments:
+            if y0 != y1:
+                # (lower y, upper y, x at lower y, dx/dy)
+                lo, hi = ((x0, y0), (x1, y1)) if y0 < y1 else ((x1, y1), (x0, y0))
+                edges.append((lo[1], hi[1], lo[0], (hi[0] - lo[0]) / (hi[1] - lo[1])))
+        xs = [x for ring in rings for x, _ in ring]
+        ys = [y for ring in rings for _, y in ring]
+        self.bbox = (min(ys), min(xs), max(ys), max(xs))
+        self.vertices = len(xs)
+        if not self._build_slabs(edges):
+            self._build_bands(edges)
+
+    def _build_slabs(self, edges):
+        ys = sorted({y for edge in edges for y in edge[:2]})
+        by_low = sorted(edges)
+        active, slabs, entries, k = [], [], 0, 0
+        for y, y_next in zip(ys, ys[1:]):
+            active = [e for e in active if e[1] > y]
+            while k < len(by_low) and by_low[k][0] <= y:
+                active.append(by_low[k])
+                k += 1
+            mid = (y + y_next) / 2
+            slabs.append(sorted(((e[2] - e[0] * e[3], e[3]) for e in active), key=lambda e: e[0] + mid * e[1]))
+            entries += len(active)
+            if entries > MAX_SLAB_ENTRIES:
+                return False
+        # each entry is (x at y=0, dx/dy): x at y is e[0] + y * e[1]
+        self.ys, self.slabs, self.bands = ys, slabs, None
+        return True
+
+    def _build_bands(self, edges):
+        min_y, max_y = self.bbox[0], self.bbox[2]
+        self.ys = self.slabs = None
+        self.band_h = (max_y - min_y) / POLYGON_BANDS or 1.0
+        self.bands = [[] for _ in range(POLYGON_BANDS)]
+        for edge in edges:
+            first = int((edge[0] - min_y) / self.band_h)
+            last = min(int((edge[1] - min_y) / self.band_h), POLYGON_BANDS - 1)
+            for band in range(first, last + 1):
+                self.bands[band].append(edge)
+
+    def _local(self, lat, lon):
+        # the point's longitude on the same side of the antimeridian as the polygon
+        if lon < self.bbox[1]:
+            lon += 360.0
+        elif lon > self.bbox[3]:
+            lon -= 360.0
+        return lon
+
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not min_lat <= lat < max_lat:
+            return False
+        lon = self._local(lat, lon)
+        if not min_lon <= lon <= max_lon:
+            return False
+        if self.bands is None:
+            slab = self.slabs[bisect.bisect_right(self.ys, lat) - 1]
+            return bisect.bisect_left(slab, lon, key=lambda e: e[0] + lat * e[1]) % 2 == 1
+        band = self.bands[min(int((lat - min_lat) / self.band_h), POLYGON_BANDS - 1)]
+        return sum(1 for y0, y1, x0, dxdy in band if y0 <= lat < y1 and x0 + (lat - y0) * dxdy < lon) % 2 == 1
+
+    def distance_m(self, lat, lon):
+        """Metres to the nearest edge (local equirectangular), 0 inside."""
+        if self.contains(lat, lon):
+            return 0.0
+        lon = self._local(lat, lon)
+        kx = M_PER_DEG_LAT * math.cos(math.radians(lat))
+        best = math.inf
+        for x0, y0, x1, y1 in self.segments:
+            ax, ay = (x0 - lon) * kx, (y0 - lat) * M_PER_DEG_LAT
+            dx, dy = (x1 - x0) * kx, (y1 - y0) * M_PER_DEG_LAT
+            t = min(max(-(ax * dx + ay * dy) / (dx * dx + dy * dy), 0.0), 1.0)
+            best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+        return best
+
+
+def polygon_bounds(geometry):
+    """((min_lat, min_lon, max_lat, max_lon), (center_lat, center_lon, radius_m)) of a normalized geometry."""
+    rings = list(_rings(geometry))
+    xs = [x for ring in rings for x, _ in ring]
+    ys = [y for ring in rings for _, y in ring]
+    bbox = (min(ys), min(xs), max(ys), max(xs))
+    lat, lon = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+    radius = max(haversine(lat, lon, y, x) for x, y in zip(xs, ys))
+    return bbox, (lat, (lon + 180.0) % 360.0 - 180.0, radius)
+
+
+def zone_shape(zone):
+    if zone.geometry:
+        return PreparedPolygon(zone.geometry)
+    return Circle(zone.center_lat, zone.center_lon, zone.radius_m)
+
+
+class ZoneIndex:
+    """Uniform lat/lon grid over zone bounding boxes, with the activation timeline of scheduled zones."""
+
+    def __init__(self, zones, version=None, cell_deg=CELL_DEG):
+        self.version = version
+        self.cell_deg = cell_deg
+        self.n_cols = int(math.ceil(360.0 / cell_deg))
+        self.cells = defaultdict(list)
+        self.large = []
+        self.by_id = {}
+        self.shapes = {}
+        self.size = 0
+        zones = sorted(zones, key=lambda z: z.pk)
+        for zone in zones:
+            self.add(zone)
+        self.timeline = ZoneTimeline((zone.pk, zone.schedule) for zone in zones)
+
+    def _col(self, lon):
+        return int(math.floor((lon + 180.0) / self.cell_deg))
+
+    def _row(self, lat):
+        return int(math.floor((lat + 90.0) / self.cell_deg))
+
+    def add(self, zone):
+        self.size += 1
+        self.by_id[zone.pk] = zone
+        shape = self.shapes[zone.pk] = zone_shape(zone)
+        min_lat, min_lon, max_lat, max_lon = shape.bbox
+        rows = range(self._row(min_lat), self._row(max_lat) + 1)
+        cols = range(self._col(min_lon), self._col(max_lon) + 1)
+        if len(rows) * len(cols) > MAX_CELLS_PER_ZONE:
+            self.large.append(zone)
+            return
+        for r in rows:
+            for c in cols:
+                # wrap across the antimeridian
+                self.cells[(r, c % self.n_cols)].append(zone)
+
+    def candidates(self, lat, lon):
+        found = self.cells.get((self._row(lat), self._col(lon) % self.n_cols), [])
+        if self.large:
+            found = sorted(found + self.large, key=lambda z: z.pk)
+        return found
+
+    def is_active(self, zone_id, at=None):
+        return self.timeline.is_active(zone_id, at)
+
+    def find(self, lat, lon, at=None):
+        """First zone active at `at` (default now) containing the point, or None."""
+        active = None
+        for zone in self.candidates(lat, lon):
+            if zone.pk in self.timeline.scheduled:
+                if active is None:
+                    active = self.timeline.active(at)
+                if zone.pk not in active:
+                    continue
+            # polygons reject points outside their bounding box before any edge test
+            if self.shapes[zone.pk].contains(lat, lon):
+                return zone
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def zone_set_state():
+    # (version, updated_at); updated_at is None until the first zone write
+    state = cache.get(VERSION_CACHE_KEY)
+    if state is None:
+        row = ZoneSetVersion.objects.order_by('pk').values_list('version', 'updated_at').first()
+        state = row or (0, None)
+        cache.set(VERSION_CACHE_KEY, state, VERSION_TTL)
+    return state
+
+
+def zone_set_version():
+    return zone_set_state()[0]
+
+
+def zone_list_body(version, updated_at):
+    """JSON body for get_zones, built once per zone-set version and shared through the cache."""
+    # updated_at is part of the key so a reset version counter can't serve old bodies
+    key = f'accounts:zone_list:{version}:{updated_at.timestamp() if updated_at else 0}'
+    body = cache.get(key)
+    if body is None:
+        zones = DangerZone.objects.order_by('pk').values_list(
+            'name', 'center_lat', 'center_lon', 'radius_m', 'geometry', 'schedule')
+        # polygons also carry their bounding circle, for clients that only draw circles;
+        # scheduled zones carry their windows (the body is cached across them)
+        body = json.dumps({'version': version, 'zones': [
+            {'name': name, 'lat': lat, 'lon': lon, 'radius_m': radius_m,
+             **({'geometry': geometry} if geometry else {}), **({'schedule': schedule} if schedule else {})}
+            for name, lat, lon, radius_m, geometry, schedule in zones
+        ]}).encode()
+        cache.set(key, body, ZONE_LIST_CACHE_TIMEOUT)
+    return body
+
+
+def bump_zone_set_version():
+    if not ZoneSetVersion.objects.update(version=F('version') + 1, updated_at=timezone.now()):
+        ZoneSetVersion.objects.create(version=1)
+    # readers only refill the cache after the new version is visible
+    transaction.on_commit(invalidate_zone_index)
+
+
+def invalidate_zone_index():
+    global _index
+    cache.delete(VERSION_CACHE_KEY)
+    _index = None
+
+
+def get_zone_index():
+    global _index
+    version = zone_set_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = ZoneIndex(DangerZone.objects.all(), version)
+            index = _index
+    return index
@@ -0,0 +1,158 @@
+# accounts/geofence.py
+# Per-tourist danger-zone state machine. Each fix is checked against the
+# zone grid (geo.get_zone_index) and only changes are kept: entering a zone,
+# still being in it after DWELL_SECONDS, and leaving it. A tourist enters a
+# zone at its radius but only leaves beyond radius + EXIT_MARGIN_M, so GPS
+# jitter along the edge does not flap in and out. The current state lives in
+# the cache, backed by one GeofenceState row per tourist; a cached or unlocked
+# copy is a hint only and is re-read from the row, under lock, before a
+# transition is written. The state also carries the time of the newest fix
+# applied, and fixes no newer than that are skipped, so a late batch cannot
+# replay an old position over a newer one. Fixes that change nothing cost no
+# queries once the state is cached.
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .geo import get_zone_index
+from .models import GeofenceEvent, GeofenceState
+from .realtime import publish_geofence
+
+EXIT_MARGIN_M = getattr(settings, 'GEOFENCE_EXIT_MARGIN_M', 50)
+DWELL = timedelta(seconds=getattr(settings, 'GEOFENCE_DWELL_SECONDS', 600))
+CACHE_TIMEOUT = getattr(settings, 'GEOFENCE_STATE_CACHE_TIMEOUT', 3600)
+
+# (zone_id, zone_name, entered_at, dwelled); entered_at is None outside any zone
+OUTSIDE = (None, '', None, False)
+# what is stored: the above plus last_at, the timestamp of the newest fix applied
+FIELDS = ('zone_id', 'zone_name', 'entered_at', 'dwelled', 'last_at')
+UNSEEN = OUTSIDE + (None,)
+
+ALERTS = {
+    GeofenceEvent.ENTER: "You are entering danger zone: {}",
+    GeofenceEvent.DWELL: "You are still in danger zone: {}",
+    GeofenceEvent.EXIT: "You have left danger zone: {}",
+}
+
+
+def _key(tourist_id):
+    return f'accounts:geofence:{tourist_id}'
+
+
+def _load(tourist_id):
+    row = GeofenceState.objects.filter(pk=tourist_id).values_list(*FIELDS).first()
+    return tuple(row) if row else UNSEEN
+
+
+def _lock(tourist_id, missing=False):
+    # must run inside a transaction; a tourist without a row gets an empty one
+    # first, so two workers seeing their first transition still serialise
+    rows = GeofenceState.objects.filter(pk=tourist_id).select_for_update().values_list(*FIELDS)
+    row = None if missing else rows.first()
+    if row is None:
+        GeofenceState.objects.bulk_create([GeofenceState(tourist_id=tourist_id)], ignore_conflicts=True)
+        row = rows.first()
+    return tuple(row)
+
+
+def _newest(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+def forget(tourist_id):
+    # drop the cached state; the next fix reads the row again
+    cache.delete(_key(tourist_id))
+
+
+def step(state, lat, lon, ts, index):
+    """One fix through the state machine -> (new state, [(kind, zone_id, zone_name)])."""
+    zone_id, zone_name, entered_at, dwelled = state
+    transitions = []
+    # entered_at marks being inside; zone_id is nulled if the zone is deleted
+    if entered_at is not None:
+        shape = index.shapes.get(zone_id)
+        if shape is not None and index.is_active(zone_id, ts) and shape.distance_m(lat, lon) <= EXIT_MARGIN_M:
+            if not dwelled and ts - entered_at >= DWELL:
+                transitions.append((GeofenceEvent.DWELL, zone_id, zone_name))
+                dwelled = True
+            return (zone_id, zone_name, entered_at, dwelled), transitions
+        # left it (or it was deleted, or its schedule ended)
+        transitions.append((GeofenceEvent.EXIT, zone_id, zone_name))
+        state = OUTSIDE
+    zone = index.find(lat, lon, at=ts)
+    if zone is not None:
+        transitions.append((GeofenceEvent.ENTER, zone.pk, zone.name))
+        state = (zone.pk, zone.name, ts, False)
+    return state, transitions
+
+
+def _run(state, points, index):
+    *zone, last_at = state
+    zone = tuple(zone)
+    events = []
+    for _, lat, lon, _, ts in points:
+        if last_at is not None and ts <= last_at:
+            continue
+        zone, transitions = step(zone, lat, lon, ts, index)
+        last_at = ts
+        events.extend((kind, zone_id, zone_name, lat, lon, ts) for kind, zone_id, zone_name in transitions)
+    return zone + (last_at,), events
+
+
+def observe(tourist_id, points):
+    """
+    Feed a tourist's (index, lat, lon, accuracy, timestamp) points through
+    the state machine, oldest first. Transitions are written and published;
+    -> the GeofenceEvents created (usually none).
+    """
+    points = sorted(points, key=lambda p: p[4])
+    index = get_zone_index()
+    key = _key(tourist_id)
+    state = cache.get(key)
+    cached = state is not None
+    if not cached:
+        state = _load(tourist_id)
+    new_state, events = _run(state, points, index)
+    if not events:
+        if new_state != state or not cached:
+            cache.set(key, new_state, CACHE_TIMEOUT)
+        return []
+    with transaction.atomic(savepoint=False):
+        # another worker may have moved this tourist on since the state was read;
+        # the row only records last_at on transitions, so keep the newer of the two
+        current = _lock(tourist_id, missing=not cached and state == UNSEEN)
+        current = current[:4] + (_newest(current[4], state[4]),)
+        if current != state:
+            new_state, events = _run(current, points, index)
+        if events:
+            _save(tourist_id, new_state)
+            created = GeofenceEvent.objects.bulk_create([
+                GeofenceEvent(tourist_id=tourist_id, zone_id=zone_id if zone_id in index.by_id else None,
+                              zone_name=zone_name, kind=kind, lat=lat, lon=lon, at=ts)
+                for kind, zone_id, zone_name, lat, lon, ts in events])
+        else:
+            created = []
+        transaction.on_commit(lambda: cache.set(key, new_state, CACHE_TIMEOUT))
+    for event in created:
+        transaction.on_commit(lambda e=event: publish_geofence(
+            f'geofence.{e.kind}', e.tourist_id, e.zone_id, zone_name=e.zone_name))
+    return created
+
+
+def _save(tourist_id, state):
+    zone_id, zone_name, entered_at, dwelled, last_at = state
+    # one upsert
+    GeofenceState.objects.bulk_create(
+        [GeofenceState(tourist_id=tourist_id, zone_id=zone_id, zone_name=zone_name, entered_at=entered_at,
+                       dwelled=dwelled, last_at=last_at)],
+        update_conflicts=True, unique_fields=['tourist'],
+        update_fields=['zone', 'zone_name', 'entered_at', 'dwelled', 'last_at', 'updated_at'])
+
+
+def alert(events):
+    """Message for the tourist about the latest transition, or None."""
+    if not events:
+        return None
+    return ALERTS[events[-1].kind].format(events[-1].zone_name)
@@ -0,0 +1,142 @@
+# accounts/ingest.py
+import json
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import LastKnownPosition, Location
+from .proximity import position_changed
+
+# hard cap on points per batch request (clients buffer ~30s of fixes)
+MAX_BATCH_POINTS = getattr(settings, 'LOCATION_BATCH_MAX_POINTS', 1000)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/ndjson')
+
+
+class PointError(ValueError):
+    pass
+
+
+def parse_timestamp(ts, default):
+    if not ts:
+        return default
+    # expect ISO format
+    timestamp = timezone.datetime.fromisoformat(ts)
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.get_current_timezone())
+    return timestamp
+
+
+def parse_point(data, default_ts):
+    """Validate one raw point dict -> (lat, lon, accuracy, timestamp)."""
+    if not isinstance(data, dict):
+        raise PointError("point must be an object")
+    try:
+        lat = float(data['latitude'])
+        lon = float(data['longitude'])
+    except KeyError as e:
+        raise PointError(f"missing {e.args[0]}")
+    except (TypeError, ValueError):
+        raise PointError("latitude/longitude must be numbers")
+    if not (math.isfinite(lat) and -90 <= lat <= 90):
+        raise PointError("latitude out of range")
+    if not (math.isfinite(lon) and -180 <= lon <= 180):
+        raise PointError("longitude out of range")
+    accuracy = data.get('accuracy')
+    if accuracy is not None:
+        try:
+            accuracy = float(accuracy)
+        except (TypeError, ValueError):
+            raise PointError("accuracy must be a number")
+    try:
+        timestamp = parse_timestamp(data.get('timestamp'), default_ts)
+    except (TypeError, ValueError):
+        raise PointError("timestamp must be ISO 8601")
+    return lat, lon, accuracy, timestamp
+
+
+def parse_points(items, default_ts=None):
+    """
+    Validate a batch in one pass. `items` is a list of (index, raw) pairs.
+    Returns (points, rejected) where points are (index, lat, lon, accuracy, ts)
+    and rejected is a list of {'index', 'error'} dicts.
+    """
+    default_ts = default_ts or timezone.now()
+    points, rejected = [], []
+    for index, raw in items:
+        try:
+            points.append((index,) + parse_point(raw, default_ts))
+        except PointError as e:
+            rejected.append({'index': index, 'error': str(e)})
+    return points, rejected
+
+
+def decode_batch(request):
+    """
+    Decode a location POST body -> (items, rejected, is_batch).
+    Batches are either a JSON array, a JSON object with a "points" array, or an
+    NDJSON stream (one point per line). Anything else is the legacy single
+    point body, returned as a one-item list.
+    """
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        return _decode_ndjson(request) + (True,)
+    data = json.loads(request.body)
+    if isinstance(data, dict) and isinstance(data.get('points'), list):
+        data = data['points']
+    if not isinstance(data, list):
+        return [(0, data)], [], False
+    items = list(enumerate(data[:MAX_BATCH_POINTS]))
+    rejected = [_too_large()] if len(data) > MAX_BATCH_POINTS else []
+    return items, rejected, True
+
+
+def _decode_ndjson(request):
+    # iterate the request stream line by line instead of loading request.body
+    items, rejected = [], []
+    index = 0
+    for line in request:
+        line = line.strip()
+        if not line:
+            continue
+        if index >= MAX_BATCH_POINTS:
+            rejected.append(_too_large())
+            break
+        try:
+            items.append((index, json.loads(line)))
+        except ValueError as e:
+            rejected.append({'index': index, 'error': f"bad json: {e}"})
+        index += 1
+    return items, rejected
+
+
+def _too_large():
+    return {'index': MAX_BATCH_POINTS, 'error': f"batch too large; points from this index on were ignored (max {MAX_BATCH_POINTS})"}
+
+
+def build_locations(user, points):
+    return [
+        Location(tourist=user, latitude=lat, longitude=lon, accuracy=accuracy, timestamp=ts)
+        for _, lat, lon, accuracy, ts in points
+    ]
+
+
+def record_last_position(user, points):
+    """
+    Move the tourist's LastKnownPosition to the newest of `points`. Late
+    (older) fixes never move it backwards.
+    """
+    if not points:
+        return
+    # reversed so that on equal timestamps the last point sent wins
+    _, lat, lon, accuracy, ts = max(reversed(points), key=lambda p: p[4])
+    fields = dict(latitude=lat, longitude=lon, accuracy=accuracy, timestamp=ts)
+    position_changed(user.pk, lat, lon, ts)
+    if LastKnownPosition.objects.filter(tourist_id=user.pk, timestamp__lte=ts).update(updated_at=timezone.now(), **fields):
+        return
+    try:
+        with transaction.atomic():
+            LastKnownPosition.objects.create(tourist_id=user.pk, **fields)
+    except IntegrityError:
+        pass  # a newer fix is already recorded
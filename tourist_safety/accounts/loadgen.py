@@ -0,0 +1,112 @@
+# accounts/loadgen.py
+# Synthetic dataset for load tests and benchmarks: tourists with profiles,
+# emergency contacts and random-walk location histories, police officers,
+# danger zones and SOS events with audio. Everything is bulk-inserted and
+# derived from one RNG seed, so two runs with the same arguments produce
+# the same data. Usernames carry a prefix so a seeded set can be found again.
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .geo import M_PER_DEG_LAT, bump_zone_set_version
+from .models import (CustomUser, DangerZone, EmergencyContact, LastKnownPosition, Location, PoliceProfile,
+                     SOSAudio, SOSEvent, TouristProfile)
+
+PREFIX = 'load'
+PASSWORD = 'load-pass'
+# tourists wander around this point
+CENTER = (12.9716, 77.5946)
+SPREAD_DEG = 0.2
+FIX_INTERVAL = timedelta(seconds=30)
+BATCH = 2000
+# smallest valid WebM header, enough for the audio URL to resolve
+AUDIO_BYTES = bytes.fromhex('1a45dfa3') + b'\x00' * 60
+
+
+def seed(tourists=100, police=5, locations=200, zones=50, sos=20, audio=True, rng_seed=0, prefix=PREFIX, now=None):
+    """Insert a synthetic dataset. -> counts per model."""
+    rng = random.Random(rng_seed)
+    now = now or timezone.now()
+    password = make_password(PASSWORD)
+    with transaction.atomic():
+        tourist_users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'{prefix}_tourist_{i}', password=password, role='tourist') for i in range(tourists)])
+        police_users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'{prefix}_police_{i}', password=password, role='police') for i in range(police)])
+        # bulk_create only returns primary keys on some backends
+        tourist_users = list(CustomUser.objects.filter(username__startswith=f'{prefix}_tourist_').order_by('pk'))
+        police_users = list(CustomUser.objects.filter(username__startswith=f'{prefix}_police_').order_by('pk'))
+
+        profiles = TouristProfile.objects.bulk_create([
+            TouristProfile(user=u, full_name=f'Load Tourist {i}', age=rng.randint(18, 80),
+                           phone_number=f'9{i:09d}', aadhaar_number=f'{rng.randrange(10 ** 12):012d}',
+                           entry_date=date.today() - timedelta(days=3), leave_date=date.today() + timedelta(days=7))
+            for i, u in enumerate(tourist_users)])
+        profiles = list(TouristProfile.objects.filter(user__in=tourist_users).order_by('pk'))
+        EmergencyContact.objects.bulk_create([
+            EmergencyContact(tourist=p, name=f'Contact {j} of {p.full_name}', phone=f'8{rng.randrange(10 ** 9):09d}')
+            for p in profiles for j in range(rng.randint(1, 3))])
+        PoliceProfile.objects.bulk_create([
+            PoliceProfile(user=u, station_name=f'Station {i % 10}', is_verified=True) for i, u in enumerate(police_users)])
+
+        DangerZone.objects.bulk_create([
+            DangerZone(name=f'{prefix} zone {i}', center_lat=CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+                       center_lon=CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG), radius_m=rng.uniform(100, 1500))
+            for i in range(zones)])
+
+        n_locations = 0
+        last = []
+        rows = []
+        for user in tourist_users:
+            lat = CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+            lon = CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+            ts = now - FIX_INTERVAL * locations
+            for _ in range(locations):
+                # ~1.5 m/s walk with GPS jitter
+                lat += rng.gauss(0, 45 / M_PER_DEG_LAT)
+                lon += rng.gauss(0, 45 / M_PER_DEG_LAT)
+                ts += FIX_INTERVAL
+                rows.append(Location(tourist=user, latitude=lat, longitude=lon, accuracy=rng.uniform(3, 30), timestamp=ts))
+            if locations:
+                last.append(LastKnownPosition(tourist=user, latitude=lat, longitude=lon, accuracy=rows[-1].accuracy, timestamp=ts))
+            if len(rows) >= BATCH:
+                Location.objects.bulk_create(rows)
+                n_locations += len(rows)
+                rows = []
+        Location.objects.bulk_create(rows)
+        n_locations += len(rows)
+        LastKnownPosition.objects.bulk_create(last)
+
+        events = []
+        for i in range(sos if tourist_users else 0):
+            position = last[i % len(last)] if last else None
+            events.append(SOSEvent.objects.create(
+                tourist=tourist_users[i % len(tourist_users)], description=f'{prefix} sos {i}',
+                lat=position.latitude if position else None, lon=position.longitude if position else None,
+                is_active=rng.random() < 0.8))
+        n_audio = 0
+        if audio:
+            for event in events:
+                name = default_storage.save(f'sos_audio/{prefix}_sos_{event.pk}.webm', ContentFile(AUDIO_BYTES))
+                SOSAudio.objects.create(sos_event=event, file=name)
+                n_audio += 1
+    # bulk_create skips the post_save hook that normally does this
+    bump_zone_set_version()
+    return {
+        'tourists': len(tourist_users),
+        'police': len(police_users),
+        'emergency_contacts': EmergencyContact.objects.filter(tourist__in=profiles).count(),
+        'locations': n_locations,
+        'zones': zones,
+        'sos_events': len(events),
+        'audio': n_audio,
+    }
+
+
+def seeded_users(role, prefix=PREFIX):
+    return list(CustomUser.objects.filter(username__startswith=f'{prefix}_{role}_', role=role).order_by('pk'))
@@ -0,0 +1,26 @@
+# accounts/management/commands/archive_locations.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from accounts import archive
+
+
+class Command(BaseCommand):
+    help = ("Move whole UTC days of Location history older than the archive horizon into memory-mappable "
+            "per-tourist files. Incremental: resumes from its checkpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-days', type=int, default=7, help="archive at most this many days per run")
+        parser.add_argument('--time-budget', type=float, default=None, help="stop after this many seconds")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        stats = archive.run(max_days=opts['max_days'], time_budget=opts['time_budget'])
+        if opts['json']:
+            self.stdout.write(json.dumps(stats, indent=2, default=str))
+            return
+        self.stdout.write(
+            f"{stats['days']} days, {stats['archived']} rows archived in {stats['seconds']:.2f}s "
+            f"({stats['rows_per_second']:.0f} rows/s); cursor {stats['cursor'].isoformat()}"
+            f"{' (caught up)' if stats['done'] else ''}")
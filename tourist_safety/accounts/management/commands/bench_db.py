@@ -0,0 +1,160 @@
+# accounts/management/commands/bench_db.py
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from accounts import views
+from accounts.benchmarks import summarize, threaded_database
+from accounts.models import CustomUser, DangerZone, Location, SOSEvent
+
+PROFILES = ('sqlite-basic', 'sqlite', 'postgres')
+
+
+class Command(BaseCommand):
+    help = ("Run a mixed workload (tourists posting location batches while police consoles poll the SOS "
+            "feed) against a throwaway database and report throughput, latency and lock errors. "
+            "--compare repeats it once per DB_PROFILE in a subprocess.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--writers', type=int, default=4, help="concurrent ingest threads")
+        parser.add_argument('--readers', type=int, default=4, help="concurrent dashboard threads")
+        parser.add_argument('--batch', type=int, default=20, help="points per location POST")
+        parser.add_argument('--active-sos', type=int, default=20)
+        parser.add_argument('--compare', action='append', choices=PROFILES, default=[],
+                            help="profile to run in a subprocess (repeatable); default: the configured one, in-process")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        if opts['compare']:
+            results = [self.run_profile(profile, opts) for profile in opts['compare']]
+        else:
+            results = [self.run_here(opts)]
+        if opts['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for r in results:
+            if 'error' in r:
+                self.stdout.write(f"{r['profile']:>12}: failed: {r['error']}")
+                continue
+            ingest, dash = r['ingest'], r['dashboard']
+            self.stdout.write(
+                f"{r['profile']:>12}: ingest {ingest['points_per_second']:.0f} pts/s p99={ingest['latency']['p99_ms']}ms "
+                f"errors={ingest['errors']} | dashboard {dash['ops_per_second']:.0f} req/s "
+                f"p99={dash['latency']['p99_ms']}ms errors={dash['errors']}")
+
+    def run_profile(self, profile, opts):
+        cmd = [sys.executable, '-m', 'django', 'bench_db', '--json',
+               '--seconds', str(opts['seconds']), '--writers', str(opts['writers']), '--readers', str(opts['readers']),
+               '--batch', str(opts['batch']), '--active-sos', str(opts['active_sos'])]
+        env = dict(os.environ, DB_PROFILE=profile)
+        proc = subprocess.run(cmd, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            return {'profile': profile, 'error': lines[-1] if lines else f"exit status {proc.returncode}"}
+        return json.loads(proc.stdout)[0]
+
+    def run_here(self, opts):
+        with threaded_database():
+            return self.run(opts)
+
+    def run(self, opts):
+        tourists = [CustomUser.objects.create_user(username=f'bench_tourist_{i}', password='x', role='tourist')
+                    for i in range(max(opts['writers'], 1))]
+        police = CustomUser.objects.create_user(username='bench_police', password='x', role='police')
+        DangerZone.objects.bulk_create([DangerZone(name=f'zone {i}', center_lat=12 + i / 100, center_lon=77.5, radius_m=300)
+                                        for i in range(20)])
+        for i in range(opts['active_sos']):
+            SOSEvent.objects.create(tourist=tourists[i % len(tourists)], description='bench', lat=12.9, lon=77.5)
+        factory = RequestFactory()
+        deadline = time.perf_counter() + opts['seconds']
+        ingest, dashboard = Workload(), Workload()
+
+        def writer(user):
+            n = 0
+            while time.perf_counter() < deadline:
+                start = timezone.now() - timedelta(seconds=opts['batch'])
+                points = [{'latitude': 12.9 + (n + i) * 1e-5, 'longitude': 77.5, 'accuracy': 5,
+                           'timestamp': (start + timedelta(seconds=i)).isoformat()} for i in range(opts['batch'])]
+                request = factory.post('/api/location/', json.dumps(points), content_type='application/json')
+                request.user = user
+                ingest.call(views.api_location, request, opts['batch'])
+                n += opts['batch']
+
+        def reader():
+            while time.perf_counter() < deadline:
+                request = factory.get('/police/api/active_sos/')
+                request.user = police
+                dashboard.call(views.api_active_sos, request, 1)
+
+        threads = ([threading.Thread(target=_closing(writer), args=(u,)) for u in tourists[:opts['writers']]]
+                   + [threading.Thread(target=_closing(reader)) for _ in range(opts['readers'])])
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        with connection.cursor() as cursor:
+            journal_mode = None
+            if connection.vendor == 'sqlite':
+                cursor.execute("PRAGMA journal_mode")
+                journal_mode = cursor.fetchone()[0]
+        return {
+            'profile': settings.DB_PROFILE,
+            'vendor': connection.vendor,
+            'journal_mode': journal_mode,
+            'seconds': round(elapsed, 3),
+            'writers': opts['writers'],
+            'readers': opts['readers'],
+            'rows_written': Location.objects.count(),
+            'ingest': dict(ingest.report(elapsed), points_per_second=round(ingest.units / elapsed, 1)),
+            'dashboard': dashboard.report(elapsed),
+        }
+
+
+class Workload:
+    def __init__(self):
+        self.samples = []
+        self.units = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, view, request, units):
+        start = time.perf_counter()
+        try:
+            ok = view(request).status_code < 500
+        except Exception:
+            # "database is locked" and friends
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self.samples.append(elapsed)
+            if ok:
+                self.units += units
+            else:
+                self.errors += 1
+
+    def report(self, elapsed):
+        return {'ops': len(self.samples), 'ops_per_second': round(len(self.samples) / elapsed, 1),
+                'errors': self.errors, 'latency': summarize(self.samples)}
+
+
+def _closing(fn):
+    # worker threads get their own connection; close it before the test database goes away
+    def run(*args):
+        try:
+            fn(*args)
+        finally:
+            connection.close()
+    return run
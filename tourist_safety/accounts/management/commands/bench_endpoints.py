@@ -0,0 +1,193 @@
+# accounts/management/commands/bench_endpoints.py
+import itertools
+import json
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import device_auth, fir, loadgen
+from accounts.benchmarks import git_revision, summarize, threaded_database
+from accounts.models import SOSEvent
+
+ENDPOINTS = ('api_location', 'update_location', 'api_sos', 'api_active_sos', 'get_zones', 'generate_fir_pdf')
+
+
+def _points(i, n):
+    start = timezone.now() - timedelta(seconds=n)
+    return [{'latitude': 12.97 + (i + k) * 1e-5, 'longitude': 77.59, 'accuracy': 8,
+             'timestamp': (start + timedelta(seconds=k)).isoformat()} for k in range(n)]
+
+
+class Scenario:
+    """One request per endpoint; `roles` says who the client is logged in as (None: anonymous)."""
+
+    def __init__(self, sos_ids):
+        self.sos_ids = sos_ids
+
+    def api_location(self, client, i):
+        return client.post(reverse('api_location'), json.dumps(_points(i, 10)), content_type='application/json')
+
+    def update_location(self, client, i):
+        return client.post(reverse('update_location'), {'lat': 12.97 + i * 1e-5, 'lon': 77.59})
+
+    def api_sos(self, client, i):
+        body = {'description': 'bench', 'locations': _points(i, 20)}
+        return client.post(reverse('api_sos'), json.dumps(body), content_type='application/json')
+
+    def api_active_sos(self, client, i):
+        return client.get(reverse('api_active_sos'))
+
+    def get_zones(self, client, i):
+        return client.get(reverse('get_zones'))
+
+    def generate_fir_pdf(self, client, i):
+        return client.get(reverse('generate_fir_pdf', args=[self.sos_ids[i % len(self.sos_ids)]]),
+                          HTTP_ACCEPT='application/json')
+
+    roles = {
+        'api_location': 'tourist', 'update_location': 'tourist', 'api_sos': 'tourist',
+        'api_active_sos': 'police', 'get_zones': None, 'generate_fir_pdf': 'police',
+    }
+
+
+class Command(BaseCommand):
+    help = ("Drive the main endpoints through the Django test client at a given concurrency and report "
+            "throughput, latency percentiles, status codes and SQL queries per request, as JSON that can be "
+            "compared across commits. With --auth token the device endpoints are also driven with bearer "
+            "tokens (the middleware fast path) instead of sessions; concurrency 1 gives requests per second "
+            "per worker.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, default=[],
+                            help="endpoint to drive (repeatable; default all)")
+        parser.add_argument('--concurrency', type=int, action='append', default=[],
+                            help="client threads (repeatable; default 1 and 8)")
+        parser.add_argument('--requests', type=int, default=200, help="requests per endpoint and concurrency level")
+        parser.add_argument('--auth', action='append', choices=('session', 'token'), default=[],
+                            help="how clients authenticate (repeatable; default session). token applies to the "
+                                 "device endpoints only")
+        parser.add_argument('--in-place', action='store_true',
+                            help="use the configured database and accounts made by seed_load instead of a throwaway seed")
+        parser.add_argument('--prefix', default=loadgen.PREFIX, help="username prefix of the seeded accounts")
+        parser.add_argument('--tourists', type=int, default=100)
+        parser.add_argument('--locations', type=int, default=200)
+        parser.add_argument('--zones', type=int, default=50)
+        parser.add_argument('--sos', type=int, default=20)
+        parser.add_argument('--output', help="also write the JSON report to this file")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        if opts['in_place']:
+            report = self.run(None, opts)
+        else:
+            with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp), threaded_database():
+                dataset = loadgen.seed(tourists=opts['tourists'], locations=opts['locations'], zones=opts['zones'],
+                                       sos=opts['sos'], prefix=opts['prefix'])
+                report = self.run(dataset, opts)
+        if opts['output']:
+            with open(opts['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if opts['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for r in report['results']:
+            lat = r['latency']
+            self.stdout.write(
+                f"{r['endpoint']:>16} {r['auth']:<7} c={r['concurrency']:<3} {r['throughput_rps']:8.1f} req/s "
+                f"p50={lat['p50_ms']}ms p95={lat['p95_ms']}ms p99={lat['p99_ms']}ms "
+                f"queries={r['queries']['mean']} errors={r['errors']} {dict(r['statuses'])}")
+
+    def run(self, dataset, opts):
+        tourists = loadgen.seeded_users('tourist', opts['prefix'])
+        police = loadgen.seeded_users('police', opts['prefix'])
+        if not tourists or not police:
+            raise CommandError(f"no seeded accounts with prefix {opts['prefix']!r}; run seed_load first")
+        sos_ids = list(SOSEvent.objects.filter(tourist__in=tourists).order_by('pk').values_list('pk', flat=True)[:50])
+        scenario = Scenario(sos_ids)
+        users = {'tourist': tourists, 'police': police, None: [None]}
+        results = []
+        # the test client's Host header
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+        with tempfile.TemporaryDirectory() as artifacts, hosts:
+            fir.ARTIFACT_DIR, previous_dir = artifacts, fir.ARTIFACT_DIR
+            try:
+                for endpoint in opts['endpoint'] or ENDPOINTS:
+                    if endpoint == 'generate_fir_pdf' and not sos_ids:
+                        continue
+                    for auth in opts['auth'] or ['session']:
+                        if auth == 'token' and endpoint not in device_auth.VIEWS:
+                            continue
+                        for concurrency in opts['concurrency'] or [1, 8]:
+                            results.append(self.drive(scenario, endpoint, users[Scenario.roles[endpoint]],
+                                                      concurrency, opts['requests'], auth))
+            finally:
+                fir.ARTIFACT_DIR = previous_dir
+        return {
+            'revision': git_revision(),
+            'db_profile': getattr(settings, 'DB_PROFILE', None),
+            'vendor': connection.vendor,
+            'dataset': dataset,
+            'results': results,
+        }
+
+    def drive(self, scenario, endpoint, users, concurrency, n_requests, auth='session'):
+        call = getattr(scenario, endpoint)
+        counter = itertools.count()
+        samples, queries, statuses = [], [], Counter()
+        lock = threading.Lock()
+
+        def worker(k):
+            try:
+                user = users[k % len(users)]
+                if user is not None and auth == 'token':
+                    client = Client(headers={'Authorization': f'Bearer {device_auth.issue(user)[0]}'})
+                else:
+                    client = Client()
+                    if user is not None:
+                        client.force_login(user)
+                while (i := next(counter)) < n_requests:
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        try:
+                            status = call(client, i).status_code
+                        except Exception as e:
+                            status = type(e).__name__
+                        elapsed = (time.perf_counter() - start) * 1000.0
+                    with lock:
+                        samples.append(elapsed)
+                        queries.append(len(ctx.captured_queries))
+                        statuses[status] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(k,)) for k in range(concurrency)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        seconds = time.perf_counter() - started
+        errors = sum(n for status, n in statuses.items() if not isinstance(status, int) or status >= 500)
+        return {
+            'endpoint': endpoint,
+            'auth': auth,
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'seconds': round(seconds, 3),
+            'throughput_rps': round(len(samples) / seconds, 1) if seconds else None,
+            'errors': errors,
+            'statuses': {str(status): n for status, n in sorted(statuses.items(), key=str)},
+            'latency': summarize(samples),
+            'queries': {'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                        'max': max(queries) if queries else None},
+        }
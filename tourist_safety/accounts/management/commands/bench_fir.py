@@ -0,0 +1,72 @@
+# accounts/management/commands/bench_fir.py
+import json
+import math
+import random
+
+from django.core.management.base import BaseCommand
+
+from accounts import fir
+from accounts.benchmarks import summarize, timed
+from accounts.trajectory import simplify
+
+
+def synthetic_track(n, seed=0):
+    # 1 Hz walk with GPS jitter, a few turns and a stop: (epoch, lat, lon)
+    rng = random.Random(seed)
+    t, lat, lon, heading = 1_758_000_000.0, 25.31, 83.01, 0.0
+    out = []
+    for i in range(n):
+        if i % 120 == 0:
+            heading = rng.uniform(0, 2 * math.pi)
+        speed = 0.0 if (i // 300) % 4 == 3 else 1.4  # m/s, stops now and then
+        lat += speed * math.cos(heading) / 111320.0
+        lon += speed * math.sin(heading) / (111320.0 * math.cos(math.radians(lat)))
+        out.append((t + i, lat + rng.gauss(0, 2e-5), lon + rng.gauss(0, 2e-5)))
+    return out
+
+
+def fir_inputs(track, keep):
+    return {
+        'render_version': fir.RENDER_VERSION, 'sos_id': 1, 'officer': 'bench', 'station': 'bench',
+        'created_at': '2025-09-21 10:00:00 UTC', 'lat': track[-1][1], 'lon': track[-1][2],
+        'description': 'bench', 'username': 'bench_tourist', 'profile': None,
+        'raw_location_count': len(track),
+        'locations': [[f'2025-09-21T10:00:00+00:00#{i}', track[i][1], track[i][2], 5.0] for i in keep],
+    }
+
+
+class Command(BaseCommand):
+    help = "FIR render time and PDF size against raw trail length, raw table vs simplified track."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, action='append', default=[],
+                            help="raw trail length (repeatable; default 50, 200, 1000, 5000)")
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--max-points', type=int, default=fir.TRACK_MAX_POINTS)
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        results = [self.run(n, opts['iterations'], opts['max_points']) for n in opts['points'] or [50, 200, 1000, 5000]]
+        if opts['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for r in results:
+            raw, simple = r['raw'], r['simplified']
+            self.stdout.write(
+                f"{r['points']:>6} pts: raw {raw['rows']} rows p50={raw['render']['p50_ms']}ms {raw['bytes']}B | "
+                f"simplified {simple['rows']} rows p50={simple['render']['p50_ms']}ms {simple['bytes']}B "
+                f"(simplify p50={r['simplify']['p50_ms']}ms)")
+
+    def run(self, n, iterations, max_points):
+        track = synthetic_track(n)
+        times, lats, lons = zip(*track)
+        simplify_ms, keep = zip(*(timed(simplify, times, lats, lons, max_points=max_points) for _ in range(iterations)))
+        out = {'points': n, 'simplify': summarize(list(simplify_ms))}
+        for name, rows in (('raw', range(n)), ('simplified', keep[0])):
+            inputs = fir_inputs(track, rows)
+            samples, pdf = [], b''
+            for _ in range(iterations):
+                elapsed, pdf = timed(fir.render_pdf, inputs)
+                samples.append(elapsed)
+            out[name] = {'rows': len(inputs['locations']), 'bytes': len(pdf), 'render': summarize(samples)}
+        return out
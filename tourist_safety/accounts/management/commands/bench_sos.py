@@ -0,0 +1,75 @@
+# accounts/management/commands/bench_sos.py
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+
+from accounts import views
+from accounts.benchmarks import isolated_database, summarize, timed
+from accounts.models import CustomUser, Location, SOSEvent
+
+
+def legacy_api_sos(request):
+    # the pre-bulk write path (one INSERT per trail point), kept for comparison
+    data = json.loads(request.body)
+    locations = data.get('locations', [])
+    latest = locations[-1]
+    sos = SOSEvent.objects.create(tourist=request.user, description=data.get('description', ''),
+                                  lat=float(latest['latitude']), lon=float(latest['longitude']))
+    for loc in locations:
+        try:
+            timestamp = timezone.datetime.fromisoformat(loc['timestamp'])
+            Location.objects.create(
+                tourist=request.user,
+                latitude=float(loc['latitude']),
+                longitude=float(loc['longitude']),
+                accuracy=float(loc.get('accuracy')) if loc.get('accuracy') else None,
+                timestamp=timestamp,
+            )
+        except Exception:
+            continue
+    return sos
+
+
+class Command(BaseCommand):
+    help = "Measure api_sos latency for a large buffered trail (per-row vs bulk write path)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=500)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        with isolated_database():
+            results = self.run(opts['points'], opts['iterations'])
+        if opts['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, stats in results['strategies'].items():
+            self.stdout.write(f"{name:>8}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms (n={stats['n']})")
+
+    def run(self, n_points, iterations):
+        user = CustomUser.objects.create_user(username='bench_tourist', password='x', role='tourist')
+        start = timezone.now() - timedelta(minutes=10)
+        payload = json.dumps({
+            'description': 'bench',
+            'locations': [
+                {'latitude': 12.9 + i * 1e-5, 'longitude': 77.5 + i * 1e-5, 'accuracy': 5.0,
+                 'timestamp': (start + timedelta(seconds=i)).isoformat()}
+                for i in range(n_points)
+            ],
+        })
+        factory = RequestFactory()
+        strategies = {'per_row': legacy_api_sos, 'bulk': views.api_sos}
+        results = {'points': n_points, 'iterations': iterations, 'strategies': {}}
+        for name, view in strategies.items():
+            samples = []
+            for _ in range(iterations):
+                request = factory.post('/api/sos/', payload, content_type='application/json')
+                request.user = user
+                elapsed, _ = timed(view, request)
+                samples.append(elapsed)
+            results['strategies'][name] = summarize(samples)
+        return results
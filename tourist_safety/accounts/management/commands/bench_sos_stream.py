@@ -0,0 +1,74 @@
+# accounts/management/commands/bench_sos_stream.py
+import asyncio
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.benchmarks import summarize
+from accounts.realtime import Broker, LocalBackend, get_broker
+
+
+class Command(BaseCommand):
+    help = "Measure SOS stream fan-out: delivery latency for N concurrent subscribers in one worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, action='append', default=[],
+                            help="concurrent subscribers per run (repeatable; default 10, 100, 1000)")
+        parser.add_argument('--events', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=0.01, help="seconds between published events")
+        parser.add_argument('--configured', action='store_true',
+                            help="use the configured SOS_BROKER_BACKEND instead of the in-process one")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        results = []
+        for n in opts['subscribers'] or [10, 100, 1000]:
+            broker = Broker(get_broker().backend if opts['configured'] else LocalBackend())
+            results.append(asyncio.run(self.run(broker, n, opts['events'], opts['interval'])))
+        if opts['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for r in results:
+            lat = r['latency']
+            self.stdout.write(f"{r['subscribers']:>6} subs: delivered {r['delivered']}/{r['expected']} "
+                              f"p50={lat['p50_ms']}ms p99={lat['p99_ms']}ms max={lat['max_ms']}ms")
+
+    async def run(self, broker, n_subscribers, n_events, interval):
+        ready = asyncio.Event()
+        joined = 0
+        samples = []
+
+        async def subscriber():
+            nonlocal joined
+            async with broker.listen() as listener:
+                joined += 1
+                if joined == n_subscribers:
+                    ready.set()
+                for _ in range(n_events):
+                    event = await listener.get(timeout=10)
+                    if event is None:
+                        return
+                    samples.append((time.time() - event['sent_at']) * 1000.0)
+
+        def publisher():
+            # publish from a plain thread, as request handlers do after commit
+            for i in range(n_events):
+                broker.publish('sos.created', sos_id=i)
+                time.sleep(interval)
+
+        tasks = [asyncio.create_task(subscriber()) for _ in range(n_subscribers)]
+        await ready.wait()
+        thread = threading.Thread(target=publisher)
+        thread.start()
+        await asyncio.gather(*tasks)
+        thread.join()
+        return {
+            'backend': type(broker.backend).__name__,
+            'subscribers': n_subscribers,
+            'peak_subscribers': broker.peak_subscribers,
+            'expected': n_subscribers * n_events,
+            'delivered': len(samples),
+            'latency': summarize(samples),
+        }
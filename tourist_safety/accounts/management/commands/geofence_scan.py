@@ -0,0 +1,74 @@
+# accounts/management/commands/geofence_scan.py
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from accounts.archive import iter_archive_arrays
+from accounts.batch_geofence import DEFAULT_FETCH_SIZE, MAX_MATRIX_CELLS, scan_locations
+from accounts.models import Location
+
+
+def parse_bound(value):
+    # accepts an ISO datetime or a plain date (midnight in the current timezone)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Bad date/time: {value!r}")
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Report which tourists had stored locations inside a danger zone over a time window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="ISO date/datetime (inclusive)")
+        parser.add_argument('--until', help="ISO date/datetime (exclusive)")
+        parser.add_argument('--yesterday', action='store_true', help="shortcut for the previous calendar day")
+        parser.add_argument('--tourist', action='append', type=int, default=[], help="restrict to this user id (repeatable)")
+        parser.add_argument('--fetch-size', type=int, default=DEFAULT_FETCH_SIZE)
+        parser.add_argument('--max-cells', type=int, default=MAX_MATRIX_CELLS)
+        parser.add_argument('--no-archive', action='store_true', help="skip archived (cold) history")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        queryset = Location.objects.all()
+        since = parse_bound(opts['since']) if opts['since'] else None
+        until = parse_bound(opts['until']) if opts['until'] else None
+        if opts['yesterday']:
+            until = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+            since = until - timedelta(days=1)
+        if since:
+            queryset = queryset.filter(timestamp__gte=since)
+        if until:
+            queryset = queryset.filter(timestamp__lt=until)
+        if opts['tourist']:
+            queryset = queryset.filter(tourist_id__in=opts['tourist'])
+
+        start = time.perf_counter()
+        archived = () if opts['no_archive'] else iter_archive_arrays(since, until, opts['tourist'])
+        processed, hits = scan_locations(queryset, fetch_size=opts['fetch_size'], max_cells=opts['max_cells'],
+                                         extra_chunks=archived)
+        elapsed = time.perf_counter() - start
+        for hit in hits:
+            hit['first_seen'] = self.iso(hit.pop('first_epoch'))
+            hit['last_seen'] = self.iso(hit.pop('last_epoch'))
+
+        if opts['json']:
+            self.stdout.write(json.dumps({'processed': processed, 'seconds': round(elapsed, 3), 'hits': hits}, indent=2))
+            return
+        for hit in hits:
+            self.stdout.write(f"tourist={hit['tourist_id']} zone={hit['zone_name']!r} points={hit['points']} "
+                              f"first={hit['first_seen']} last={hit['last_seen']}")
+        self.stdout.write(f"{processed} locations scanned in {elapsed:.2f}s, {len(hits)} tourist/zone hits")
+
+    @staticmethod
+    def iso(epoch):
+        return timezone.localtime(datetime.fromtimestamp(epoch, tz=dt_timezone.utc)).isoformat()
@@ -0,0 +1,23 @@
+# accounts/management/commands/replay_location_journal.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from accounts import writebehind
+
+
+class Command(BaseCommand):
+    help = ("Insert location pings left in the write-behind journal by a crashed worker. "
+            "Segments still held by a running worker are skipped. Point --journal at its "
+            "dead-letter/ subdirectory to retry batches that kept failing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal', default=None, help="journal directory (default LOCATION_WRITE_BEHIND_JOURNAL)")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        segments, rows = writebehind.replay(opts['journal'])
+        if opts['json']:
+            self.stdout.write(json.dumps({'segments': segments, 'rows': rows}))
+            return
+        self.stdout.write(f"replayed {segments} journal segments, {rows} locations inserted")
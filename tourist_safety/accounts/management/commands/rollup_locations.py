@@ -0,0 +1,30 @@
+# accounts/management/commands/rollup_locations.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from accounts import retention
+
+
+class Command(BaseCommand):
+    help = ("Thin Location rows older than the raw retention window to one fix per tourist per bucket. "
+            "Incremental: resumes from its checkpoint and stops after a bounded amount of work.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-rows', type=int, default=100_000, help="stop after scanning about this many rows")
+        parser.add_argument('--time-budget', type=float, default=None, help="stop after this many seconds")
+        parser.add_argument('--bucket-seconds', type=int, default=retention.BUCKET_SECONDS)
+        parser.add_argument('--min-distance-m', type=float, default=retention.MIN_DISTANCE_M,
+                            help="also drop bucket representatives closer than this to the previous kept fix")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        stats = retention.run(max_rows=opts['max_rows'], time_budget=opts['time_budget'],
+                              bucket_seconds=opts['bucket_seconds'], min_distance_m=opts['min_distance_m'])
+        if opts['json']:
+            self.stdout.write(json.dumps(stats, indent=2, default=str))
+            return
+        self.stdout.write(
+            f"{stats['slices']} slices, {stats['scanned']} rows scanned, {stats['deleted']} deleted "
+            f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s); "
+            f"cursor {stats['cursor'].isoformat()}{' (caught up)' if stats['done'] else ''}")
@@ -0,0 +1,35 @@
+# accounts/management/commands/seed_load.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import loadgen
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ("Seed the configured database with a synthetic dataset (tourists, profiles, contacts, location "
+            "history, police, danger zones, SOS events with audio) for load testing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tourists', type=int, default=100)
+        parser.add_argument('--police', type=int, default=5)
+        parser.add_argument('--locations', type=int, default=200, help="history fixes per tourist")
+        parser.add_argument('--zones', type=int, default=50)
+        parser.add_argument('--sos', type=int, default=20)
+        parser.add_argument('--no-audio', action='store_true')
+        parser.add_argument('--seed', type=int, default=0, help="RNG seed")
+        parser.add_argument('--prefix', default=loadgen.PREFIX, help="username prefix of the seeded accounts")
+        parser.add_argument('--json', action='store_true', help="print machine-readable JSON only")
+
+    def handle(self, *args, **opts):
+        if CustomUser.objects.filter(username__startswith=f"{opts['prefix']}_").exists():
+            raise CommandError(f"accounts with prefix {opts['prefix']!r} already exist; pick another --prefix")
+        counts = loadgen.seed(tourists=opts['tourists'], police=opts['police'], locations=opts['locations'],
+                              zones=opts['zones'], sos=opts['sos'], audio=not opts['no_audio'],
+                              rng_seed=opts['seed'], prefix=opts['prefix'])
+        if opts['json']:
+            self.stdout.write(json.dumps(counts, indent=2))
+            return
+        self.stdout.write(", ".join(f"{n} {name}" for name, n in counts.items()))
+        self.stdout.write(f"log in as {opts['prefix']}_tourist_0 / {opts['prefix']}_police_0 with password {loadgen.PASSWORD!r}")
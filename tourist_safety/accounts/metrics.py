@@ -0,0 +1,220 @@
+# accounts/metrics.py
+# Per-view request metrics for this worker: latency histogram, SQL query
+# count and time, response bytes, status classes and exceptions, rendered
+# in the Prometheus text format by views.metrics. SQL is measured with a
+# connection execute_wrapper, so it works without DEBUG: every connection
+# gets `track_sql` when it is opened (signals.install_sql_tracking), which
+# hands queries to the current request's SqlTracker from a contextvar. The
+# contextvar follows the request into the threads where sync views run
+# under ASGI, so those queries are counted too. Optionally, a
+# sample of requests also keeps their SQL and is logged to
+# `accounts.slow_requests` when slower than SLOW_REQUEST_MS.
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+slow_logger = logging.getLogger('accounts.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_MS = getattr(settings, 'SLOW_REQUEST_MS', None)
+SLOW_REQUEST_SAMPLE = getattr(settings, 'SLOW_REQUEST_SAMPLE', 1.0)
+SLOW_LOG_MAX_QUERIES = 50
+SLOW_LOG_MAX_SQL = 500
+
+
+class ViewStats:
+    __slots__ = ('buckets', 'count', 'seconds', 'queries', 'sql_seconds', 'response_bytes', 'exceptions', 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+        self.exceptions = 0
+        self.statuses = defaultdict(int)
+
+
+class Registry:
+    def __init__(self):
+        self._views = defaultdict(ViewStats)
+        self._lock = threading.Lock()
+
+    def observe(self, view, seconds, status, size=0, queries=0, sql_seconds=0.0, exception=False):
+        with self._lock:
+            stats = self._views[view]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.count += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.response_bytes += size
+            stats.exceptions += exception
+            stats.statuses[f'{status // 100}xx'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {view: (list(s.buckets), s.count, s.seconds, s.queries, s.sql_seconds, s.response_bytes,
+                           s.exceptions, dict(s.statuses)) for view, s in self._views.items()}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = Registry()
+
+
+class SqlTracker:
+    """execute_wrapper counting queries and their time; keeps the statements when `capture` is set."""
+
+    def __init__(self, capture=False):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = [] if capture else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.seconds += elapsed
+            if self.statements is not None and len(self.statements) < SLOW_LOG_MAX_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+_tracker = contextvars.ContextVar('accounts_sql_tracker', default=None)
+
+
+def track_sql(execute, sql, params, many, context):
+    tracker = _tracker.get()
+    if tracker is None:
+        return execute(sql, params, many, context)
+    return tracker(execute, sql, params, many, context)
+
+
+def install(connection):
+    if track_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_sql)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+def note_exception(request):
+    # counted when the request is recorded; for views not called by the handler too
+    request._metrics_exception = True
+
+
+class MetricsMiddleware:
+    """Put first in MIDDLEWARE so the latency covers the rest of the stack."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        sampled = SLOW_REQUEST_MS is not None and random.random() < SLOW_REQUEST_SAMPLE
+        tracker = SqlTracker(capture=sampled)
+        token = _tracker.set(tracker)
+        try:
+            response = self.get_response(request)
+        finally:
+            _tracker.reset(token)
+        self.record(request, response, time.perf_counter() - started, tracker)
+        return response
+
+    async def __acall__(self, request):
+        # sync views run in a worker thread with a copy of this context, so
+        # their queries reach the tracker; a stream's body is not covered
+        started = time.perf_counter()
+        sampled = SLOW_REQUEST_MS is not None and random.random() < SLOW_REQUEST_SAMPLE
+        tracker = SqlTracker(capture=sampled)
+        token = _tracker.set(tracker)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _tracker.reset(token)
+        self.record(request, response, time.perf_counter() - started, tracker)
+        return response
+
+    def process_exception(self, request, exception):
+        note_exception(request)
+
+    def record(self, request, response, seconds, tracker):
+        view = view_label(request)
+        # streamed bodies count when their length is known up front (FileResponse)
+        size = int(response.get('Content-Length') or 0) if response.streaming else len(response.content)
+        registry.observe(view, seconds, response.status_code, size,
+                         tracker.queries, tracker.seconds, getattr(request, '_metrics_exception', False))
+        if tracker.statements is not None and seconds * 1000 >= SLOW_REQUEST_MS:
+            slow_logger.warning(
+                "slow request %s %s (%s) %.1fms, %d queries in %.1fms\n%s",
+                request.method, request.path, view, seconds * 1000, tracker.queries, tracker.seconds * 1000,
+                "\n".join(f"  {elapsed * 1000:.2f}ms {sql[:SLOW_LOG_MAX_SQL]}" for elapsed, sql in tracker.statements))
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _family(lines, name, kind, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def render(extra_gauges=None):
+    """Prometheus text exposition (version 0.0.4) of the registry and `extra_gauges` {name: (value, help)}."""
+    snapshot = sorted(registry.snapshot().items())
+    lines = []
+    _family(lines, 'http_view_latency_seconds', 'histogram', 'Request latency by view.')
+    for view, (buckets, count, seconds, *_rest) in snapshot:
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'http_view_latency_seconds_bucket{_labels(view=view, le=bound)} {cumulative}')
+        lines.append(f'http_view_latency_seconds_bucket{_labels(view=view, le="+Inf")} {count}')
+        lines.append(f'http_view_latency_seconds_sum{_labels(view=view)} {seconds}')
+        lines.append(f'http_view_latency_seconds_count{_labels(view=view)} {count}')
+    counters = (
+        ('http_view_sql_queries_total', 3, 'SQL statements executed by view.'),
+        ('http_view_sql_seconds_total', 4, 'Time spent in SQL by view.'),
+        ('http_view_response_bytes_total', 5, 'Response body bytes by view (streams of unknown length excluded).'),
+        ('http_view_exceptions_total', 6, 'Unhandled exceptions by view.'),
+    )
+    for name, field, help_text in counters:
+        _family(lines, name, 'counter', help_text)
+        for view, values in snapshot:
+            lines.append(f'{name}{_labels(view=view)} {values[field]}')
+    _family(lines, 'http_view_responses_total', 'counter', 'Responses by view and status class.')
+    for view, values in snapshot:
+        for status, n in sorted(values[7].items()):
+            lines.append(f'http_view_responses_total{_labels(view=view, status=status)} {n}')
+    for name, (value, help_text) in sorted((extra_gauges or {}).items()):
+        _family(lines, name, 'gauge', help_text)
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
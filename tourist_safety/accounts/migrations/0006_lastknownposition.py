@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    Location = apps.get_model('accounts', 'Location')
+    LastKnownPosition = apps.get_model('accounts', 'LastKnownPosition')
+    latest = (Location.objects.order_by('tourist_id', '-timestamp', '-pk')
+              .values_list('tourist_id', 'latitude', 'longitude', 'accuracy', 'timestamp'))
+    rows, seen = [], set()
+    for tourist_id, lat, lon, accuracy, ts in latest.iterator(chunk_size=5000):
+        if tourist_id in seen:
+            continue
+        seen.add(tourist_id)
+        rows.append(LastKnownPosition(tourist_id=tourist_id, latitude=lat, longitude=lon, accuracy=accuracy, timestamp=ts))
+    LastKnownPosition.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_zonesetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LastKnownPosition',
+            fields=[
+                ('tourist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='last_position', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('accuracy', models.FloatField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_lastknownposition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['tourist', '-timestamp'], name='location_tourist_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sosevent',
+            index=models.Index(fields=['-created_at'], name='sos_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sosevent',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='sos_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_sosevent_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosaudio',
+            name='finalized_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosaudio',
+            name='is_recording',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='sosaudio',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sosaudio',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='sosaudio',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_recording', True)), fields=('sos_event',), name='one_recording_per_sos'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_location_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('rows', models.PositiveIntegerField()),
+                ('first_at', models.DateTimeField()),
+                ('last_at', models.DateTimeField()),
+                ('tourist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_days', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tourist', 'day'), name='archived_day_per_tourist')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_archivedday'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lastknownposition',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
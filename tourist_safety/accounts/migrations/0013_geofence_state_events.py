@@ -0,0 +1,43 @@
+# Generated by Django 5.0.14 on 2026-10-17 18:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_lastknownposition_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeofenceState',
+            fields=[
+                ('tourist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='geofence_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('zone_name', models.CharField(blank=True, max_length=255)),
+                ('entered_at', models.DateTimeField(blank=True, null=True)),
+                ('dwelled', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.dangerzone')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GeofenceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zone_name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('enter', 'Entered'), ('dwell', 'Dwelling'), ('exit', 'Left')], max_length=5)),
+                ('lat', models.FloatField()),
+                ('lon', models.FloatField()),
+                ('at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('tourist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofence_events', to=settings.AUTH_USER_MODEL)),
+                ('zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='geofence_events', to='accounts.dangerzone')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tourist', 'at'], name='geofence_event_tourist_at')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_geofence_state_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dangerzone',
+            name='geometry',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dangerzone',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dangerzone',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dangerzone',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dangerzone',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_dangerzone_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dangerzone',
+            name='schedule',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
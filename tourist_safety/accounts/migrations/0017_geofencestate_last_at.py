@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_devicetokenrevocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geofencestate',
+            name='last_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
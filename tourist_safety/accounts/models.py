@@ -3,6 +3,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 
+from .schedule import describe_schedule, normalize_schedule
+
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (('tourist', 'Tourist'), ('police', 'Police'))
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
@@ -59,6 +61,13 @@ class Location(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # per-tourist history, newest first (dashboard, FIR trail); also
+            # serves ascending range scans by walking the index backwards
+            models.Index(fields=['tourist', '-timestamp'], name='location_tourist_ts_idx'),
+            # time-sliced scans across all tourists (retention, bulk geofence)
+            models.Index(fields=['timestamp'], name='location_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.tourist.username} @ {self.latitude},{self.longitude} at {self.timestamp}"
@@ -72,6 +81,15 @@ class SOSEvent(models.Model):
     # optionally store the summary lat/lon at creation
     lat = models.FloatField(null=True, blank=True)
     lon = models.FloatField(null=True, blank=True)
+    # bumped on every save and when audio is attached; drives the dashboard delta feed
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='sos_created_idx'),
+            # the police feed only ever lists active events
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='sos_active_created_idx'),
+        ]
 
     def __str__(self):
         return f"SOS: {self.tourist.username} at {self.created_at} (active={self.is_active})"
@@ -82,6 +100,17 @@ class SOSAudio(models.Model):
     sos_event = models.ForeignKey(SOSEvent, on_delete=models.CASCADE, related_name="audios")
     file = models.FileField(upload_to="sos_audio/")
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # chunked uploads (accounts/recording.py) append to one recording per SOS;
+    # size is the committed length, bytes past it are not served
+    is_recording = models.BooleanField(default=False)
+    size = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    finalized_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sos_event'], condition=models.Q(is_recording=True), name='one_recording_per_sos'),
+        ]
 
     def __str__(self):
         return f"Audio for SOS {self.sos_event.id} at {self.uploaded_at}"
@@ -91,10 +120,143 @@ from django.db import models
 
 class DangerZone(models.Model):
     name = models.CharField(max_length=255)
+    # a circle, or for polygon zones the circle around the polygon (derived on save)
     center_lat = models.FloatField()
     center_lon = models.FloatField()
     radius_m = models.FloatField(help_text="Radius in meters")
+    # GeoJSON MultiPolygon ([lon, lat] rings) for polygon zones, null for circles
+    geometry = models.JSONField(null=True, blank=True)
+    # polygon bounding box, derived on save
+    min_lat = models.FloatField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    # weekly and one-off activation windows (accounts/schedule.py); null: always active
+    schedule = models.JSONField(null=True, blank=True)
 
     def __str__(self):
         return self.name
 
+    @property
+    def is_polygon(self):
+        return bool(self.geometry)
+
+    @property
+    def schedule_display(self):
+        return describe_schedule(self.schedule)
+
+    def save(self, *args, **kwargs):
+        if self.geometry:
+            from .geo import normalize_geometry, polygon_bounds  # geo imports this module
+            self.geometry = normalize_geometry(self.geometry)
+            (self.min_lat, self.min_lon, self.max_lat, self.max_lon), (self.center_lat, self.center_lon, self.radius_m) = \
+                polygon_bounds(self.geometry)
+        else:
+            self.geometry = self.min_lat = self.min_lon = self.max_lat = self.max_lon = None
+        self.schedule = normalize_schedule(self.schedule)
+        super().save(*args, **kwargs)
+
+
+
+class ZoneSetVersion(models.Model):
+    # single row bumped on every DangerZone write so that each worker process
+    # can tell when its in-memory zone index is stale
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Zone set v{self.version} ({self.updated_at})"
+
+
+class LastKnownPosition(models.Model):
+    # one row per tourist, kept current by every location ingest path so the
+    # police dashboard can read the latest fix with a join instead of a
+    # per-event query against Location
+    tourist = models.OneToOneField('CustomUser', on_delete=models.CASCADE, primary_key=True, related_name='last_position')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    accuracy = models.FloatField(null=True, blank=True)
+    timestamp = models.DateTimeField()
+    # indexed: proximity search (accounts/proximity.py) syncs by delta on it
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.tourist.username} last @ {self.latitude},{self.longitude} at {self.timestamp}"
+
+
+class RetentionCheckpoint(models.Model):
+    # resume point of an incremental maintenance job (see accounts/retention.py):
+    # everything before `cursor` has been processed
+    name = models.CharField(max_length=50, unique=True)
+    cursor = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.cursor}"
+
+
+class ArchivedDay(models.Model):
+    # one columnar file of a tourist's fixes for one UTC day (accounts/archive.py)
+    tourist = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='archived_days')
+    day = models.DateField()
+    path = models.CharField(max_length=255)  # relative to LOCATION_ARCHIVE_DIR
+    rows = models.PositiveIntegerField()
+    first_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tourist', 'day'], name='archived_day_per_tourist'),
+        ]
+
+    def __str__(self):
+        return f"{self.tourist_id} {self.day} ({self.rows} fixes)"
+
+
+class GeofenceState(models.Model):
+    # the zone a tourist is currently in (accounts/geofence.py); written only
+    # on transitions, read when the cached copy is missing or about to change
+    tourist = models.OneToOneField('CustomUser', on_delete=models.CASCADE, primary_key=True, related_name='geofence_state')
+    zone = models.ForeignKey(DangerZone, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    zone_name = models.CharField(max_length=255, blank=True)
+    entered_at = models.DateTimeField(null=True, blank=True)
+    dwelled = models.BooleanField(default=False)
+    # timestamp of the newest fix applied; older fixes arriving late are skipped
+    last_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.tourist_id} in {self.zone_name or '-'}"
+
+
+class GeofenceEvent(models.Model):
+    ENTER, DWELL, EXIT = 'enter', 'dwell', 'exit'
+    KIND_CHOICES = ((ENTER, 'Entered'), (DWELL, 'Dwelling'), (EXIT, 'Left'))
+
+    tourist = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='geofence_events')
+    zone = models.ForeignKey(DangerZone, on_delete=models.SET_NULL, null=True, blank=True, related_name='geofence_events')
+    # kept so the history still reads after the zone is deleted
+    zone_name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    lat = models.FloatField()
+    lon = models.FloatField()
+    at = models.DateTimeField()  # time of the fix that caused it
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['tourist', 'at'], name='geofence_event_tourist_at')]
+
+    def __str__(self):
+        return f"{self.tourist_id} {self.kind} {self.zone_name} at {self.at}"
+
+
+class DeviceTokenRevocation(models.Model):
+    """A revoked device token, or with a blank jti every token of the user issued before revoked_at."""
+    user = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='+')
+    jti = models.CharField(max_length=32, blank=True)
+    revoked_at = models.DateTimeField()
+    # every token it covers has expired by then; the row can go
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.jti or 'all'} revoked at {self.revoked_at}"
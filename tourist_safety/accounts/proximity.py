@@ -0,0 +1,262 @@
+# accounts/proximity.py
+# In-memory grid over tourists' last known positions for "who is near this
+# SOS" queries: radius and k-nearest answered from a few grid cells instead
+# of scanning Location. Pings handled by this worker move their tourist at
+# once (after commit); pings handled by other workers are picked up by a
+# delta read of LastKnownPosition.updated_at at most every SYNC_INTERVAL.
+# The same updates keep the police map's per-cell counts (accounts/tiles.py).
+import heapq
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .geo import EARTH_RADIUS_M, bbox_for_radius, haversine
+from .models import LastKnownPosition
+from .tiles import TileCounts
+
+# ~1.1 km cells: a typical 0.5-2 km search touches 4-16 of them
+CELL_DEG = getattr(settings, 'PROXIMITY_CELL_DEG', 0.01)
+SYNC_INTERVAL = getattr(settings, 'PROXIMITY_SYNC_SECONDS', 2)
+# writes that commit late are still seen by the next delta read
+SYNC_OVERLAP = timedelta(seconds=getattr(settings, 'PROXIMITY_SYNC_OVERLAP_SECONDS', 5))
+# tourists not heard from for this long drop out of the live index
+LIVE_WINDOW = timedelta(hours=getattr(settings, 'LIVE_POSITION_WINDOW_HOURS', 24))
+PRUNE_INTERVAL = 60
+
+
+class PositionIndex:
+    """Uniform lat/lon grid of tourist_id -> (lat, lon, timestamp); moves are mirrored into `tiles` if given."""
+
+    def __init__(self, cell_deg=CELL_DEG, tiles=None):
+        self.cell_deg = cell_deg
+        self.n_cols = int(math.ceil(360.0 / cell_deg))
+        self.cells = {}
+        self.positions = {}
+        self.tiles = tiles
+        self._lock = threading.Lock()
+
+    def _row(self, lat):
+        return int(math.floor((lat + 90.0) / self.cell_deg))
+
+    def _col(self, lon):
+        # unwrapped; callers take it modulo n_cols
+        return int(math.floor((lon + 180.0) / self.cell_deg))
+
+    def _cell(self, lat, lon):
+        return self._row(lat), self._col(lon) % self.n_cols
+
+    def __len__(self):
+        return len(self.positions)
+
+    def update(self, tourist_id, lat, lon, timestamp):
+        """Move a tourist; older fixes than the one held are ignored."""
+        cell = self._cell(lat, lon)
+        with self._lock:
+            current = self.positions.get(tourist_id)
+            if current is not None:
+                if current[2] > timestamp:
+                    return
+                old = self._cell(current[0], current[1])
+                if old != cell:
+                    bucket = self.cells[old]
+                    bucket.discard(tourist_id)
+                    if not bucket:
+                        del self.cells[old]
+                if self.tiles is not None:
+                    self.tiles.add(current[0], current[1], -1)
+            self.cells.setdefault(cell, set()).add(tourist_id)
+            self.positions[tourist_id] = (lat, lon, timestamp)
+            if self.tiles is not None:
+                self.tiles.add(lat, lon)
+
+    def remove(self, tourist_id):
+        with self._lock:
+            self._discard(tourist_id)
+
+    def prune(self, before):
+        """Drop tourists whose last fix is older than `before`."""
+        with self._lock:
+            stale = [tourist_id for tourist_id, (_, _, ts) in self.positions.items() if ts < before]
+            for tourist_id in stale:
+                self._discard(tourist_id)
+        return len(stale)
+
+    def _discard(self, tourist_id):
+        current = self.positions.pop(tourist_id, None)
+        if current is not None:
+            cell = self._cell(current[0], current[1])
+            self.cells[cell].discard(tourist_id)
+            if not self.cells[cell]:
+                del self.cells[cell]
+            if self.tiles is not None:
+                self.tiles.add(current[0], current[1], -1)
+
+    def _ring(self, row, col, r):
+        # cells at Chebyshev distance r from (row, col)
+        if r == 0:
+            yield row, col
+            return
+        for c in range(col - r, col + r + 1):
+            yield row - r, c % self.n_cols
+            yield row + r, c % self.n_cols
+        for rr in range(row - r + 1, row + r):
+            yield rr, (col - r) % self.n_cols
+            yield rr, (col + r) % self.n_cols
+
+    def _ring_bounds(self, lat, r):
+        # lower bounds (metres, in haversine terms) on the distance to a point
+        # outside rings 0..r-1: one whose row is r or more away, and one in
+        # those rows whose column is r or more away. The latter uses the
+        # narrowest cells those rows reach, i.e. the latitude furthest from
+        # the equator: hav(d) >= cos(lat1) cos(lat2) hav(dlon) >= cos^2(max_lat) hav(dlon)
+        if r == 0:
+            return 0.0, 0.0
+        span = math.radians((r - 1) * self.cell_deg)
+        max_lat = math.radians(min(abs(lat) + r * self.cell_deg, 90.0))
+        lon_bound = 2 * math.asin(min(math.cos(max_lat) * math.sin(min(span, math.pi) / 2), 1.0))
+        return EARTH_RADIUS_M * span, EARTH_RADIUS_M * lon_bound
+
+    def _ring_distance(self, cell, row, col):
+        d_col = abs(cell[1] - col) % self.n_cols
+        return max(abs(cell[0] - row), min(d_col, self.n_cols - d_col))
+
+    def _visit(self, ids, lat, lon, since, exclude):
+        for tourist_id in ids:
+            if tourist_id in exclude:
+                continue
+            t_lat, t_lon, ts = self.positions[tourist_id]
+            if since is not None and ts < since:
+                continue
+            yield haversine(lat, lon, t_lat, t_lon), tourist_id, t_lat, t_lon, ts
+
+    def within(self, lat, lon, radius_m, since=None, exclude=()):
+        """[(distance_m, tourist_id, lat, lon, timestamp)] within radius_m, nearest first."""
+        min_lat, min_lon, max_lat, max_lon = bbox_for_radius(lat, lon, radius_m)
+        rows = range(self._row(max(min_lat, -90.0)), self._row(min(max_lat, 90.0)) + 1)
+        c_lo, c_hi = self._col(min_lon), self._col(max_lon)
+        cols = range(self.n_cols) if c_hi - c_lo + 1 >= self.n_cols else range(c_lo, c_hi + 1)
+        found = []
+        with self._lock:
+            for row in rows:
+                for col in cols:
+                    ids = self.cells.get((row, col % self.n_cols))
+                    if ids:
+                        found.extend(hit for hit in self._visit(ids, lat, lon, since, exclude) if hit[0] <= radius_m)
+        found.sort()
+        return found
+
+    def nearest(self, lat, lon, k, max_radius_m=None, since=None, exclude=()):
+        """The k nearest (distance_m, tourist_id, lat, lon, timestamp), optionally capped at max_radius_m."""
+        row, col = self._cell(lat, lon)
+        heap = []  # max-heap on distance via negation
+
+        def offer(ids):
+            for hit in self._visit(ids, lat, lon, since, exclude):
+                if max_radius_m is not None and hit[0] > max_radius_m:
+                    continue
+                item = (-hit[0],) + hit[1:]
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        def settled(bound):
+            # nothing at least `bound` away can still make the result
+            return (len(heap) == k and -heap[0][0] <= bound) or (max_radius_m is not None and bound > max_radius_m)
+
+        with self._lock:
+            r = 0
+            while True:
+                lat_bound, lon_bound = self._ring_bounds(lat, r)
+                if settled(min(lat_bound, lon_bound)):
+                    break
+                if settled(lat_bound) or 8 * r > len(self.cells) or 2 * r + 1 >= self.n_cols:
+                    # rings stop paying off near a pole (cells shrink to nothing
+                    # in longitude), on a sparse grid, or once they wrap around:
+                    # visit the occupied cells not covered yet directly
+                    for cell, ids in self.cells.items():
+                        if self._ring_distance(cell, row, col) >= r:
+                            offer(ids)
+                    break
+                for cell in self._ring(row, col, r):
+                    ids = self.cells.get(cell)
+                    if ids:
+                        offer(ids)
+                r += 1
+        return sorted((-item[0],) + item[1:] for item in heap)
+
+
+class LivePositions:
+    """PositionIndex (and map tile counts) kept in step with the recent rows of LastKnownPosition."""
+
+    def __init__(self, cell_deg=CELL_DEG):
+        self.tiles = TileCounts()
+        self.index = PositionIndex(cell_deg, tiles=self.tiles)
+        self.synced_at = None
+        self._checked = 0.0
+        self._pruned = 0.0
+        self._sync_lock = threading.Lock()
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < SYNC_INTERVAL:
+            return
+        with self._sync_lock:
+            if not force and now - self._checked < SYNC_INTERVAL:
+                return
+            started = timezone.now()
+            rows = LastKnownPosition.objects.all()
+            if self.synced_at is not None:
+                rows = rows.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+            else:
+                rows = rows.filter(timestamp__gte=started - LIVE_WINDOW)
+            for tourist_id, lat, lon, ts in rows.values_list('tourist_id', 'latitude', 'longitude', 'timestamp').iterator():
+                self.index.update(tourist_id, lat, lon, ts)
+            self.synced_at = started
+            self._checked = time.monotonic()
+            if self._checked - self._pruned >= PRUNE_INTERVAL:
+                self.index.prune(started - LIVE_WINDOW)
+                self._pruned = self._checked
+
+    def within(self, *args, **kwargs):
+        self.sync()
+        return self.index.within(*args, **kwargs)
+
+    def nearest(self, *args, **kwargs):
+        self.sync()
+        return self.index.nearest(*args, **kwargs)
+
+    def clusters(self, *args, **kwargs):
+        self.sync()
+        return self.tiles.clusters(*args, **kwargs)
+
+
+_live = None
+_live_lock = threading.Lock()
+
+
+def get_live_positions():
+    global _live
+    if _live is None:
+        with _live_lock:
+            if _live is None:
+                _live = LivePositions()
+    return _live
+
+
+def reset_live_positions():
+    # drop the process index (tests); the next query rebuilds it from the table
+    global _live
+    with _live_lock:
+        _live = None
+
+
+def position_changed(tourist_id, lat, lon, timestamp):
+    # called by ingest.record_last_position; only once the row is committed
+    if _live is not None:
+        transaction.on_commit(lambda: _live.index.update(tourist_id, lat, lon, timestamp))
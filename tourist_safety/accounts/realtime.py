@@ -0,0 +1,223 @@
+# accounts/realtime.py
+# In-process pub/sub for SOS lifecycle events, consumed by the SSE stream in
+# views.sos_stream. The transport is a pluggable backend: LocalBackend fans
+# out inside one process (dev, tests, single-worker deploys); RedisBackend
+# fans out across workers through Redis PUBLISH/SUBSCRIBE.
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SOS_CHANNEL = 'sos'
+# per-subscriber buffer; a console that stops reading loses the oldest events
+# (it resyncs through the delta feed anyway)
+QUEUE_SIZE = getattr(settings, 'SOS_STREAM_QUEUE_SIZE', 100)
+LATENCY_SAMPLES = 1000
+
+
+class LocalSubscription:
+    def __init__(self, backend, channel):
+        self.backend = backend
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, message):
+        # called from whichever thread published; hand over to our loop
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.backend.unsubscribe(self)
+
+
+class LocalBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for sub in subscribers:
+            try:
+                sub.deliver(message)
+            except RuntimeError:
+                # the subscriber's event loop is gone
+                self.unsubscribe(sub)
+
+    async def subscribe(self, channel):
+        sub = LocalSubscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.get(sub.channel, set()).discard(sub)
+
+
+class RedisSubscription:
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                data = message['data']
+                return data.decode() if isinstance(data, bytes) else data
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+class RedisBackend:
+    def __init__(self, url=None):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured("RedisBackend requires the 'redis' package")
+        self.redis = redis
+        self.url = url or getattr(settings, 'SOS_BROKER_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(self.url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    async def subscribe(self, channel):
+        client = self.redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        return RedisSubscription(client, pubsub)
+
+
+class Broker:
+    """JSON envelope, per-worker counters and delivery latency on top of a backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.subscribers = 0
+        self.peak_subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.latencies_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, channel=SOS_CHANNEL, **data):
+        message = json.dumps(dict(data, type=event_type, sent_at=time.time()))
+        self.backend.publish(channel, message)
+        self.published += 1
+
+    def listen(self, channel=SOS_CHANNEL):
+        return Listener(self, channel)
+
+    def _joined(self, delta):
+        with self._lock:
+            self.subscribers += delta
+            self.peak_subscribers = max(self.peak_subscribers, self.subscribers)
+
+    def _received(self, event):
+        self.delivered += 1
+        self.latencies_ms.append((time.time() - event['sent_at']) * 1000.0)
+
+    def stats(self):
+        from .benchmarks import summarize
+        return {
+            'backend': type(self.backend).__name__,
+            'subscribers': self.subscribers,
+            'peak_subscribers': self.peak_subscribers,
+            'published': self.published,
+            'delivered': self.delivered,
+            'latency': summarize(list(self.latencies_ms)),
+        }
+
+
+class Listener:
+    """async context manager; `await listener.get(timeout)` -> event dict or None on timeout."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.subscription = None
+
+    async def __aenter__(self):
+        self.subscription = await self.broker.backend.subscribe(self.channel)
+        self.broker._joined(1)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.broker._joined(-1)
+        await self.subscription.close()
+
+    async def get(self, timeout=None):
+        message = await self.subscription.get(timeout)
+        if message is None:
+            return None
+        event = json.loads(message)
+        self.broker._received(event)
+        return event
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = import_string(getattr(settings, 'SOS_BROKER_BACKEND', 'accounts.realtime.LocalBackend'))
+                _broker = Broker(backend())
+    return _broker
+
+
+def set_broker(broker):
+    # swap the process broker (tests / benchmarks); returns the previous one
+    global _broker
+    with _broker_lock:
+        previous, _broker = _broker, broker
+    return previous
+
+
+def publish_sos(event_type, sos_id, **data):
+    # runs after commit: a broker outage must not turn a saved SOS into a 500;
+    # consoles still converge through the delta feed
+    try:
+        get_broker().publish(event_type, sos_id=sos_id, **data)
+    except Exception:
+        logger.exception("failed to publish %s for SOS %s", event_type, sos_id)
+
+
+def publish_geofence(event_type, tourist_id, zone_id, **data):
+    # geofence transitions share the SOS channel so the dashboard needs one stream
+    try:
+        get_broker().publish(event_type, tourist_id=tourist_id, zone_id=zone_id, **data)
+    except Exception:
+        logger.exception("failed to publish %s for tourist %s", event_type, tourist_id)
@@ -0,0 +1,201 @@
+# accounts/recording.py
+# Resumable SOS audio: every SOS gets one recording file that the tourist
+# app appends to chunk by chunk (tus-style Upload-Offset / Upload-Checksum
+# headers), and police can play back with Range requests while it grows.
+# A chunk is read from the network and verified in a spool file first; the
+# row lock is only held to check the offset, copy the spooled chunk on
+# local disk and save the new size, so a slow client never holds the
+# (on SQLite, database-wide) write lock.
+import base64
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import SOSAudio
+
+MAX_CHUNK_BYTES = getattr(settings, 'SOS_AUDIO_MAX_CHUNK_BYTES', 8 * 1024 * 1024)
+MAX_RECORDING_BYTES = getattr(settings, 'SOS_AUDIO_MAX_RECORDING_BYTES', 200 * 1024 * 1024)
+IO_BLOCK = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# serialise appends to one recording inside this process (a fixed stripe of
+# locks, so memory does not grow with the number of recordings); across
+# processes the row lock in append_chunk does it (no-op on SQLite, whose
+# single writer already serialises the transactions)
+_append_locks = [threading.Lock() for _ in range(64)]
+
+
+def _append_lock(audio_id):
+    return _append_locks[audio_id % len(_append_locks)]
+
+
+class UploadError(ValueError):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def recording_name(sos_id):
+    return f"sos_audio/sos_{sos_id}_recording.webm"
+
+
+def recording_path(audio):
+    return os.path.join(settings.MEDIA_ROOT, audio.file.name)
+
+
+def get_recording(sos, create=False):
+    audio = SOSAudio.objects.filter(sos_event=sos, is_recording=True).first()
+    if audio is None and create:
+        name = recording_name(sos.pk)
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'ab').close()
+        try:
+            with transaction.atomic():
+                audio = SOSAudio.objects.create(sos_event=sos, file=name, is_recording=True)
+        except IntegrityError:
+            # a concurrent first chunk created it
+            audio = SOSAudio.objects.get(sos_event=sos, is_recording=True)
+    return audio
+
+
+def parse_checksum(header):
+    # "sha256 <base64 digest>"
+    if not header:
+        return None
+    algo, _, value = header.partition(' ')
+    if algo.lower() != 'sha256':
+        raise UploadError("unsupported checksum algorithm", status=400)
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise UploadError("bad checksum encoding", status=400)
+
+
+def _check_append(audio, offset, length):
+    if audio.finalized_at is not None:
+        raise UploadError("recording already finalized", status=409, offset=audio.size)
+    if offset != audio.size:
+        raise UploadError("offset mismatch", status=409, offset=audio.size)
+    if audio.size + length > MAX_RECORDING_BYTES:
+        raise UploadError("recording too large", status=413, offset=audio.size)
+
+
+def _spool(stream, length, checksum, offset, directory):
+    # -> temporary file holding the verified chunk, positioned at its start
+    spool = tempfile.TemporaryFile(dir=directory)
+    try:
+        digest = hashlib.sha256()
+        written = 0
+        while written < length:
+            block = stream.read(min(IO_BLOCK, length - written))
+            if not block:
+                break
+            spool.write(block)
+            digest.update(block)
+            written += len(block)
+        if written != length:
+            raise UploadError("chunk shorter than Content-Length", status=400, offset=offset)
+        if checksum is not None and digest.digest() != checksum:
+            raise UploadError("checksum mismatch", status=460, offset=offset)
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
+
+def append_chunk(sos, offset, stream, length, checksum=None):
+    """
+    Append `length` bytes read from `stream` at `offset`, which must equal
+    the committed size. The chunk is read and hashed into a spool file
+    without any lock held, then copied into the recording under the row
+    lock; a short body or checksum mismatch never touches it. -> new offset.
+    """
+    if length is None:
+        raise UploadError("Content-Length required", status=411)
+    if length > MAX_CHUNK_BYTES:
+        raise UploadError(f"chunk too large (max {MAX_CHUNK_BYTES} bytes)", status=413)
+    audio = get_recording(sos, create=True)
+    # fail fast on a stale offset before reading the body; checked again under the lock
+    _check_append(audio, offset, length)
+    path = recording_path(audio)
+    with _spool(stream, length, checksum, offset, os.path.dirname(path)) as spool:
+        with _append_lock(audio.pk), transaction.atomic():
+            audio = SOSAudio.objects.select_for_update().get(pk=audio.pk)
+            _check_append(audio, offset, length)
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                try:
+                    shutil.copyfileobj(spool, f, IO_BLOCK)
+                    f.truncate(offset + length)
+                except BaseException:
+                    # drop whatever part of this chunk reached the recording
+                    f.truncate(offset)
+                    raise
+            audio.size = offset + length
+            audio.save(update_fields=['size'])
+    return audio.size
+
+
+def finalize(sos, size, sha256_hex):
+    """Close the recording once its total size and whole-file sha256 match."""
+    audio = get_recording(sos)
+    if audio is None:
+        raise UploadError("no recording", status=404)
+    with _append_lock(audio.pk), transaction.atomic():
+        audio = SOSAudio.objects.select_for_update().get(pk=audio.pk)
+        if audio.finalized_at is not None:
+            return audio
+        if size != audio.size:
+            raise UploadError("size mismatch", status=409, offset=audio.size)
+        digest = hashlib.sha256()
+        with open(recording_path(audio), 'rb') as f:
+            for block in iter(lambda: f.read(IO_BLOCK), b''):
+                digest.update(block)
+        if sha256_hex and digest.hexdigest() != sha256_hex.lower():
+            raise UploadError("checksum mismatch", status=460, offset=audio.size)
+        audio.sha256 = digest.hexdigest()
+        audio.finalized_at = timezone.now()
+        audio.save(update_fields=['sha256', 'finalized_at'])
+    return audio
+
+
+def parse_range(header, size):
+    """-> (start, end) inclusive within `size` bytes, or None for the whole body."""
+    if not header:
+        return None
+    m = RANGE_RE.match(header.strip())
+    if not m or m.groups() == ('', ''):
+        raise UploadError("bad range", status=416)
+    first, last = m.groups()
+    if first == '':
+        # suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise UploadError("range not satisfiable", status=416)
+    return start, end
+
+
+def iter_file_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(IO_BLOCK, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
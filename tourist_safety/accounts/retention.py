@@ -0,0 +1,141 @@
+# accounts/retention.py
+# Location retention: fixes older than the raw window are thinned in place
+# to one representative per tourist per time bucket (optionally also
+# dropping fixes within a few metres of the previous kept one). Work is done
+# in aligned time slices, each committed together with its checkpoint, so a
+# run can stop anywhere and the next one picks up where it left off.
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .geo import haversine
+from .models import Location, RetentionCheckpoint, SOSEvent
+
+RAW_RETENTION = timedelta(days=getattr(settings, 'LOCATION_RAW_RETENTION_DAYS', 7))
+BUCKET_SECONDS = getattr(settings, 'LOCATION_ROLLUP_BUCKET_SECONDS', 60)
+MIN_DISTANCE_M = getattr(settings, 'LOCATION_ROLLUP_MIN_DISTANCE_M', 0)
+SLICE = timedelta(hours=1)
+DELETE_BATCH = 1000
+# trail kept around an SOS: the FIR window before it, and this long after it
+# was last touched (active events are protected indefinitely)
+SOS_PROTECT_BEFORE = timedelta(minutes=10)
+SOS_PROTECT_AFTER = timedelta(hours=getattr(settings, 'LOCATION_SOS_PROTECT_HOURS', 24))
+CHECKPOINT = 'location_rollup'
+
+
+def _floor(ts, step):
+    epoch = timezone.datetime(1970, 1, 1, tzinfo=ts.tzinfo)
+    seconds = (ts - epoch).total_seconds()
+    return epoch + timedelta(seconds=seconds - seconds % step.total_seconds())
+
+
+def protected_windows(start, end):
+    """{tourist_id: [(from, to), ...]} of SOS trails overlapping [start, end)."""
+    events = (SOSEvent.objects
+              .filter(created_at__lt=end + SOS_PROTECT_BEFORE)
+              .filter(Q(is_active=True) | Q(updated_at__gte=start - SOS_PROTECT_AFTER))
+              .values_list('tourist_id', 'created_at', 'updated_at', 'is_active'))
+    windows = {}
+    for tourist_id, created_at, updated_at, is_active in events:
+        upper = None if is_active else max(created_at, updated_at) + SOS_PROTECT_AFTER
+        windows.setdefault(tourist_id, []).append((created_at - SOS_PROTECT_BEFORE, upper))
+    return windows
+
+
+def _protected(ts, windows):
+    return any(lo <= ts and (hi is None or ts <= hi) for lo, hi in windows)
+
+
+def select_deletions(rows, windows, bucket_seconds=BUCKET_SECONDS, min_distance_m=MIN_DISTANCE_M):
+    """
+    rows: (pk, tourist_id, timestamp, lat, lon) ordered by tourist, timestamp, pk.
+    Keeps the last fix of every bucket per tourist (and, with min_distance_m,
+    only when it moved that far from the previous kept fix). -> pks to delete.
+    """
+    doomed = []
+    prev_tourist = prev_bucket = None
+    last_kept = None
+    candidate = None  # (pk, lat, lon) of the latest fix seen in the current bucket
+
+    def close_bucket():
+        nonlocal last_kept
+        if candidate is None:
+            return
+        pk, lat, lon = candidate
+        if (min_distance_m and last_kept is not None
+                and haversine(last_kept[0], last_kept[1], lat, lon) < min_distance_m):
+            doomed.append(pk)
+        else:
+            last_kept = (lat, lon)
+
+    for pk, tourist_id, ts, lat, lon in rows:
+        tourist_windows = windows.get(tourist_id, ())
+        if tourist_id != prev_tourist:
+            close_bucket()
+            prev_tourist, prev_bucket, last_kept, candidate = tourist_id, None, None, None
+        if tourist_windows and _protected(ts, tourist_windows):
+            # never touched, but it still anchors the distance filter
+            close_bucket()
+            candidate, prev_bucket, last_kept = None, None, (lat, lon)
+            continue
+        bucket = int(ts.timestamp() // bucket_seconds)
+        if bucket != prev_bucket:
+            close_bucket()
+            prev_bucket, candidate = bucket, None
+        if candidate is not None:
+            doomed.append(candidate[0])
+        candidate = (pk, lat, lon)
+    close_bucket()
+    return doomed
+
+
+def process_slice(start, end, bucket_seconds=BUCKET_SECONDS, min_distance_m=MIN_DISTANCE_M):
+    """Thin one time slice and advance the checkpoint past it, atomically. -> (scanned, deleted)."""
+    rows = list(Location.objects.filter(timestamp__gte=start, timestamp__lt=end)
+                .order_by('tourist_id', 'timestamp', 'pk')
+                .values_list('pk', 'tourist_id', 'timestamp', 'latitude', 'longitude'))
+    doomed = select_deletions(rows, protected_windows(start, end), bucket_seconds, min_distance_m) if rows else []
+    with transaction.atomic():
+        for i in range(0, len(doomed), DELETE_BATCH):
+            Location.objects.filter(pk__in=doomed[i:i + DELETE_BATCH]).delete()
+        RetentionCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'cursor': end})
+    return len(rows), len(doomed)
+
+
+def run(max_rows=100_000, time_budget=None, now=None, **options):
+    """
+    Process slices from the checkpoint up to the retention horizon until
+    `max_rows` rows were scanned or `time_budget` seconds passed.
+    """
+    now = now or timezone.now()
+    horizon = _floor(now - RAW_RETENTION, SLICE)
+    checkpoint = RetentionCheckpoint.objects.filter(name=CHECKPOINT).values_list('cursor', flat=True).first()
+    if checkpoint is None:
+        first = Location.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        checkpoint = _floor(first, SLICE) if first else horizon
+    started = time.perf_counter()
+    stats = {'slices': 0, 'scanned': 0, 'deleted': 0, 'cursor': checkpoint, 'horizon': horizon, 'done': False}
+    cursor = checkpoint
+    while cursor < horizon:
+        if stats['scanned'] >= max_rows or (time_budget and time.perf_counter() - started >= time_budget):
+            break
+        if not Location.objects.filter(timestamp__gte=cursor, timestamp__lt=cursor + SLICE).exists():
+            # skip empty stretches in one step
+            nxt = Location.objects.filter(timestamp__gte=cursor).order_by('timestamp').values_list('timestamp', flat=True).first()
+            cursor = min(_floor(nxt, SLICE), horizon) if nxt else horizon
+            RetentionCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'cursor': cursor})
+            continue
+        scanned, deleted = process_slice(cursor, cursor + SLICE, **options)
+        cursor += SLICE
+        stats['slices'] += 1
+        stats['scanned'] += scanned
+        stats['deleted'] += deleted
+    stats['cursor'] = cursor
+    stats['done'] = cursor >= horizon
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_second'] = stats['scanned'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
@@ -0,0 +1,178 @@
+# accounts/schedule.py
+# Activation schedules for danger zones. A zone without a schedule is always
+# active; otherwise it is active during any of its weekly windows (wall-clock
+# times in DANGER_ZONE_SCHEDULE_TZ, e.g. every night 20:00-06:00) or one-off
+# windows (absolute start/end, e.g. a festival). ZoneTimeline sweeps every
+# zone's windows once, per zone-set version, into sorted boundaries with the
+# set of active zones between them, so "which zones are active at T" is a
+# binary search and needs no query. Weekly windows live on a one-week circle
+# and one-off windows on the absolute timeline; a zone is active if either
+# says so.
+import bisect
+import zoneinfo
+from collections import defaultdict
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+SCHEDULE_TZ = getattr(settings, 'DANGER_ZONE_SCHEDULE_TZ', settings.TIME_ZONE)
+MAX_WINDOWS = getattr(settings, 'DANGER_ZONE_MAX_WINDOWS', 500)
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; seconds into a Monday-based week = (local epoch + EPOCH_WEEKDAY * DAY) % WEEK
+EPOCH_WEEKDAY = 3
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def schedule_tz():
+    return zoneinfo.ZoneInfo(SCHEDULE_TZ)
+
+
+def _clock(value):
+    if isinstance(value, time):
+        return value.replace(second=0, microsecond=0)
+    return time.fromisoformat(value).replace(second=0, microsecond=0)
+
+
+def _instant(value, tz):
+    at = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if timezone.is_naive(at):
+        at = at.replace(tzinfo=tz)
+    return at.astimezone(dt_timezone.utc)
+
+
+def normalize_schedule(schedule):
+    """
+    {'weekly': [{'days': [0..6], 'start': 'HH:MM', 'end': 'HH:MM'}], 'once': [[start, end]]}
+    with days Monday=0 and one-off times as UTC ISO strings; a weekly window whose end is not
+    after its start runs into the next day. Empty -> None (always active); ValueError if invalid.
+    """
+    if not schedule:
+        return None
+    if not isinstance(schedule, dict) or set(schedule) - {'weekly', 'once'}:
+        raise ValueError("A schedule has 'weekly' and/or 'once' windows.")
+    tz = schedule_tz()
+    weekly, once = [], []
+    try:
+        for window in schedule.get('weekly') or ():
+            days = sorted({int(day) for day in window['days']})
+            if not days or days[0] < 0 or days[-1] > 6:
+                raise ValueError("Weekly windows need days between 0 (Monday) and 6 (Sunday).")
+            start, end = _clock(window['start']), _clock(window['end'])
+            weekly.append({'days': days, 'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')})
+        for start, end in schedule.get('once') or ():
+            start, end = _instant(start, tz), _instant(end, tz)
+            if end <= start:
+                raise ValueError("A one-off window must end after it starts.")
+            once.append([start.isoformat(), end.isoformat()])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Malformed schedule window: {e}")
+    if len(weekly) + len(once) > MAX_WINDOWS:
+        raise ValueError(f"A zone can have at most {MAX_WINDOWS} schedule windows.")
+    if not weekly and not once:
+        return None
+    return {'weekly': weekly, 'once': sorted(once)}
+
+
+def describe_schedule(schedule):
+    """Short human-readable summary, e.g. 'Mon-Fri 20:00-06:00; 2026-11-01 18:00 - 2026-11-02 02:00'."""
+    if not schedule:
+        return 'Always'
+    tz = schedule_tz()
+    parts = []
+    for window in schedule.get('weekly', ()):
+        days = window['days']
+        if days == list(range(7)):
+            label = 'Daily'
+        elif days == list(range(days[0], days[-1] + 1)) and len(days) > 2:
+            label = f'{DAY_NAMES[days[0]]}-{DAY_NAMES[days[-1]]}'
+        else:
+            label = ','.join(DAY_NAMES[d] for d in days)
+        parts.append(f"{label} {window['start']}-{window['end']}")
+    for start, end in schedule.get('once', ()):
+        start, end = (datetime.fromisoformat(v).astimezone(tz).strftime('%Y-%m-%d %H:%M') for v in (start, end))
+        parts.append(f'{start} - {end}')
+    return '; '.join(parts)
+
+
+def _weekly_intervals(window):
+    # [start, end) seconds into the week, split where a window wraps past Sunday midnight
+    start, end = _clock(window['start']), _clock(window['end'])
+    start_s = start.hour * 3600 + start.minute * 60
+    end_s = end.hour * 3600 + end.minute * 60
+    length = end_s - start_s if end_s > start_s else end_s - start_s + DAY
+    for day in window['days']:
+        lo = day * DAY + start_s
+        hi = lo + length
+        if hi <= WEEK:
+            yield lo, hi
+        else:
+            yield lo, WEEK
+            yield 0, hi - WEEK
+
+
+def _sweep(intervals):
+    # [(start, end, zone_id)] -> (sorted boundaries, active frozenset from each boundary to the next)
+    changes = defaultdict(list)
+    for start, end, zone_id in intervals:
+        changes[start].append((zone_id, 1))
+        changes[end].append((zone_id, -1))
+    bounds, sets = [], []
+    depth = defaultdict(int)
+    for at in sorted(changes):
+        for zone_id, delta in changes[at]:
+            depth[zone_id] += delta
+            if not depth[zone_id]:
+                del depth[zone_id]
+        bounds.append(at)
+        sets.append(frozenset(depth))
+    return bounds, sets
+
+
+class ZoneTimeline:
+    """Precomputed activation of scheduled zones, from [(zone_id, normalised schedule)]."""
+
+    def __init__(self, schedules=()):
+        self.scheduled = set()
+        weekly, once = [], []
+        for zone_id, schedule in schedules:
+            if not schedule:
+                continue
+            self.scheduled.add(zone_id)
+            for window in schedule.get('weekly', ()):
+                weekly.extend((lo, hi, zone_id) for lo, hi in _weekly_intervals(window))
+            for start, end in schedule.get('once', ()):
+                once.append((datetime.fromisoformat(start).timestamp(), datetime.fromisoformat(end).timestamp(), zone_id))
+        self.tz = schedule_tz()
+        self.week_bounds, self.week_sets = _sweep(weekly)
+        self.once_bounds, self.once_sets = _sweep(once)
+
+    def __bool__(self):
+        return bool(self.scheduled)
+
+    def week_seconds(self, at):
+        local = at.astimezone(self.tz)
+        return local.weekday() * DAY + local.hour * 3600 + local.minute * 60 + local.second
+
+    def utc_offset(self, epoch):
+        return datetime.fromtimestamp(epoch, self.tz).utcoffset().total_seconds()
+
+    def active(self, at=None):
+        """Scheduled zone ids active at `at` (default now); zones without a schedule are not listed."""
+        if not self.scheduled:
+            return frozenset()
+        at = at or timezone.now()
+        found = frozenset()
+        i = bisect.bisect_right(self.week_bounds, self.week_seconds(at)) - 1
+        if i >= 0:
+            found = self.week_sets[i]
+        i = bisect.bisect_right(self.once_bounds, at.timestamp()) - 1
+        if i >= 0 and self.once_sets[i]:
+            found = found | self.once_sets[i]
+        return found
+
+    def is_active(self, zone_id, at=None, active=None):
+        if zone_id not in self.scheduled:
+            return True
+        return zone_id in (self.active(at) if active is None else active)
@@ -0,0 +1,64 @@
+# accounts/signals.py
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+from .models import CustomUser, DangerZone, SOSAudio, SOSEvent
+from .device_auth import revoke_user
+from .geo import bump_zone_set_version
+from .realtime import publish_sos
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # DB_PROFILE=sqlite: WAL and friends are per connection (journal_mode sticks to the file)
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(connection_created)
+def install_sql_tracking(sender, connection, **kwargs):
+    metrics.install(connection)
+
+
+@receiver([post_save, post_delete], sender=DangerZone)
+def danger_zone_changed(sender, **kwargs):
+    bump_zone_set_version()
+
+
+@receiver(post_save, sender=SOSAudio)
+def sos_audio_added(sender, instance, created, **kwargs):
+    # new evidence has to show up in the dashboard's delta feed
+    if created:
+        SOSEvent.objects.filter(pk=instance.sos_event_id).update(updated_at=timezone.now())
+        transaction.on_commit(lambda: publish_sos('sos.audio', instance.sos_event_id))
+
+
+@receiver(post_save, sender=SOSEvent)
+def sos_event_changed(sender, instance, created, **kwargs):
+    if created:
+        event_type = 'sos.created'
+    elif not instance.is_active:
+        event_type = 'sos.deactivated'
+    else:
+        event_type = 'sos.updated'
+    transaction.on_commit(lambda: publish_sos(event_type, instance.pk))
+
+
+@receiver(pre_save, sender=CustomUser)
+def revoke_device_tokens(sender, instance, update_fields=None, **kwargs):
+    # device tokens are checked without reading the user, so a new password
+    # or a deactivated account has to revoke the ones already issued
+    if instance.pk is None or (update_fields is not None and not {'password', 'is_active'} & set(update_fields)):
+        return
+    current = CustomUser.objects.filter(pk=instance.pk).values_list('password', 'is_active').first()
+    if current and (current[0] != instance.password or (current[1] and not instance.is_active)):
+        revoke_user(instance.pk)
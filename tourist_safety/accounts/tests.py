@@ -1,3 +1,2004 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import random
+import tempfile
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+
+from django.db import connection, DatabaseError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, AsyncRequestFactory, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.html import escapejs
+from django.utils.timezone import now as timezone_now
+
+from .batch_geofence import ZoneSet, evaluate, scan_locations
+from .geo import (M_PER_DEG_LAT, PreparedPolygon, ZoneIndex, get_zone_index, haversine, invalidate_zone_index,
+                  normalize_geometry)
+from .realtime import Broker, LocalBackend, set_broker
+from .trajectory import simplify
+from .models import CustomUser, TouristProfile, PoliceProfile, EmergencyContact, Location, SOSEvent, DangerZone, LastKnownPosition, SOSAudio, RetentionCheckpoint, ArchivedDay, GeofenceState, GeofenceEvent
+from . import archive, device_auth, fir, geofence, loadgen, metrics, proximity, recording, retention, tiles, views, writebehind
+from .schedule import ZoneTimeline, normalize_schedule
+from .views import is_in_danger
+
+
+def make_tourist(username='tourist'):
+    user = CustomUser.objects.create_user(username=username, password='pw', role='tourist')
+    TouristProfile.objects.create(
+        user=user, full_name=username.title(), age=30, phone_number='000',
+        aadhaar_number='0000', entry_date=date(2025, 1, 1), leave_date=date(2025, 1, 31),
+    )
+    return user
+
+
+def make_police(username='officer'):
+    user = CustomUser.objects.create_user(username=username, password='pw', role='police')
+    PoliceProfile.objects.create(user=user, station_name='Central', is_verified=True)
+    return user
+
+
+class ApiLocationBatchTests(TestCase):
+    def setUp(self):
+        self.user = make_tourist()
+        self.client.force_login(self.user)
+        self.url = reverse('api_location')
+
+    def point(self, lat=12.0, lon=77.0, **extra):
+        return dict(latitude=lat, longitude=lon, **extra)
+
+    def test_single_point_still_supported(self):
+        resp = self.client.post(self.url, json.dumps(self.point()), content_type='application/json')
+        self.assertEqual(resp.json(), {'ok': True})
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_json_array_is_bulk_inserted_in_one_query(self):
+        points = [self.point(12 + i / 1000, timestamp=f'2025-09-21T10:00:{i:02d}+00:00') for i in range(30)]
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(self.url, json.dumps(points), content_type='application/json')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "accounts_location"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(resp.json(), {'ok': True, 'accepted': 30, 'rejected': []})
+        self.assertEqual(Location.objects.filter(tourist=self.user).count(), 30)
+
+    def test_rejected_points_are_reported(self):
+        points = [self.point(), self.point(lat=123), {'latitude': 1}, self.point(timestamp='yesterday')]
+        resp = self.client.post(self.url, json.dumps({'points': points}), content_type='application/json')
+        body = resp.json()
+        self.assertEqual(body['accepted'], 1)
+        self.assertEqual([r['index'] for r in body['rejected']], [1, 2, 3])
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_ndjson_stream(self):
+        lines = [json.dumps(self.point()), '{not json', json.dumps(self.point(lon=78))]
+        resp = self.client.post(self.url, '\n'.join(lines), content_type='application/x-ndjson')
+        body = resp.json()
+        self.assertEqual(body['accepted'], 2)
+        self.assertEqual(body['rejected'][0]['index'], 1)
+
+    def test_all_rejected_is_bad_request(self):
+        resp = self.client.post(self.url, json.dumps([self.point(lat='x')]), content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Location.objects.exists())
+
+
+class ApiSosTests(TestCase):
+    def setUp(self):
+        self.user = make_tourist()
+        self.client.force_login(self.user)
+        self.url = reverse('api_sos')
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_trail_written_with_single_insert_and_skips_counted(self):
+        locations = [{'latitude': 12 + i / 1000, 'longitude': 77, 'timestamp': f'2025-09-21T10:{i:02d}:00'} for i in range(40)]
+        locations.insert(5, {'latitude': 'nope', 'longitude': 77})
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.post({'locations': locations, 'description': 'help'})
+        body = resp.json()
+        self.assertEqual((body['locations_saved'], body['locations_skipped']), (40, 1))
+        location_inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "accounts_location"')]
+        self.assertEqual(len(location_inserts), 1)
+        sos = SOSEvent.objects.get(pk=body['sos_id'])
+        self.assertAlmostEqual(sos.lat, 12.039)
+
+    def test_event_and_trail_are_atomic(self):
+        with mock.patch.object(Location.objects, 'bulk_create', side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                self.post({'locations': [{'latitude': 1, 'longitude': 2}]})
+        self.assertFalse(SOSEvent.objects.exists())
+
+    def test_sos_without_locations(self):
+        body = self.post({}).json()
+        self.assertEqual((body['locations_saved'], body['locations_skipped']), (0, 0))
+        self.assertIsNone(SOSEvent.objects.get().lat)
+
+
+class LastKnownPositionTests(TestCase):
+    def setUp(self):
+        self.user = make_tourist()
+        self.client.force_login(self.user)
+
+    def post_points(self, points):
+        return self.client.post(reverse('api_location'), json.dumps(points), content_type='application/json')
+
+    def test_batch_records_newest_point_and_ignores_late_fixes(self):
+        self.post_points([
+            {'latitude': 12.2, 'longitude': 77.2, 'timestamp': '2025-09-21T10:02:00+00:00'},
+            {'latitude': 12.1, 'longitude': 77.1, 'timestamp': '2025-09-21T10:01:00+00:00'},
+        ])
+        self.post_points([{'latitude': 11.0, 'longitude': 76.0, 'timestamp': '2025-09-21T09:00:00+00:00'}])
+        last = LastKnownPosition.objects.get(tourist=self.user)
+        self.assertEqual((last.latitude, last.longitude), (12.2, 77.2))
+
+    def test_single_point_sos_and_update_location_paths(self):
+        self.client.post(reverse('api_location'), json.dumps({'latitude': 1, 'longitude': 2}), content_type='application/json')
+        self.assertEqual(self.user.last_position.latitude, 1)
+        self.client.post(reverse('api_sos'), json.dumps({'locations': [{'latitude': 3, 'longitude': 4}]}), content_type='application/json')
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.user).latitude, 3)
+        self.client.post(reverse('update_location'), {'lat': 5, 'lon': 6})
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.user).latitude, 5)
+
+
+class ApiActiveSosTests(TestCase):
+    def setUp(self):
+        self.client.force_login(make_police())
+
+    def add_event(self, n):
+        user = make_tourist(f'tourist{n}')
+        LastKnownPosition.objects.create(tourist=user, latitude=n, longitude=n, timestamp=datetime(2025, 9, 21, tzinfo=dt_timezone.utc))
+        sos = SOSEvent.objects.create(tourist=user)
+        SOSAudio.objects.create(sos_event=sos, file=f'sos_audio/{n}.webm')
+        return sos
+
+    def test_query_count_is_constant(self):
+        self.add_event(1)
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('api_active_sos'))
+        for n in range(2, 12):
+            self.add_event(n)
+        with CaptureQueriesContext(connection) as many:
+            body = self.client.get(reverse('api_active_sos')).json()
+        self.assertEqual(len(many), len(one))
+        self.assertEqual(len(body['events']), 11)
+        self.assertEqual({e['lat'] for e in body['events']}, set(range(1, 12)))
+
+
+@mock.patch.object(views, 'SOS_FEED_OVERLAP', timedelta(0))
+class SosDeltaFeedTests(TestCase):
+    def setUp(self):
+        self.client.force_login(make_police())
+        self.tourist = make_tourist()
+        self.url = reverse('api_active_sos')
+        self.first = SOSEvent.objects.create(tourist=self.tourist, lat=1, lon=1)
+        self.second = SOSEvent.objects.create(tourist=self.tourist, lat=2, lon=2)
+
+    def test_unchanged_state_is_not_modified(self):
+        resp = self.client.get(self.url)
+        body = resp.json()
+        self.assertTrue(body['full'])
+        self.assertEqual(len(body['events']), 2)
+        resp = self.client.get(self.url, {'since': body['cursor']}, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_delta_only_contains_changes(self):
+        cursor = self.client.get(self.url).json()['cursor']
+        third = SOSEvent.objects.create(tourist=self.tourist, lat=3, lon=3)
+        self.second.is_active = False
+        self.second.save()
+        body = self.client.get(self.url, {'since': cursor}).json()
+        self.assertFalse(body['full'])
+        self.assertEqual([e['sos_id'] for e in body['events']], [third.pk])
+        self.assertEqual(sorted(body['active_ids']), [self.first.pk, third.pk])
+        self.assertNotEqual(body['cursor'], cursor)
+
+    def test_new_audio_marks_event_changed(self):
+        cursor = self.client.get(self.url).json()['cursor']
+        SOSAudio.objects.create(sos_event=self.first, file='sos_audio/x.webm')
+        body = self.client.get(self.url, {'since': cursor}).json()
+        self.assertEqual([e['sos_id'] for e in body['events']], [self.first.pk])
+        self.assertEqual(len(body['events'][0]['audio_files']), 1)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': '1.x'}).status_code, 400)
+
+    def test_long_delta_is_paged_without_losing_events(self):
+        cursor = self.client.get(self.url).json()['cursor']
+        changed = [SOSEvent.objects.create(tourist=self.tourist, lat=i, lon=i).pk for i in range(5)]
+        # a burst of updates sharing one timestamp
+        SOSEvent.objects.filter(pk__in=changed[2:]).update(updated_at=timezone_now())
+        seen, pages = [], 0
+        with mock.patch.object(views, 'SOS_FEED_LIMIT', 2):
+            while True:
+                resp = self.client.get(self.url, {'since': cursor})
+                body = resp.json()
+                seen += [e['sos_id'] for e in body['events']]
+                cursor = body['cursor']
+                pages += 1
+                if not body.get('more'):
+                    break
+                self.assertFalse(resp.has_header('ETag'))
+                self.assertLess(pages, 5)
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, changed)
+        self.assertTrue(resp.has_header('ETag'))
+        self.assertEqual(self.client.get(self.url, {'since': cursor}, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 304)
+
+
+class RecordingBackend(LocalBackend):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def publish(self, channel, message):
+        self.sent.append(json.loads(message))
+        super().publish(channel, message)
+
+
+class SosStreamTests(TestCase):
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.broker = Broker(self.backend)
+        previous = set_broker(self.broker)
+        self.addCleanup(set_broker, previous)
+        self.police = make_police()
+
+    def test_lifecycle_events_published_after_commit(self):
+        tourist = make_tourist()
+        self.client.force_login(tourist)
+        with self.captureOnCommitCallbacks(execute=True):
+            sos_id = self.client.post(reverse('api_sos'), '{}', content_type='application/json').json()['sos_id']
+        self.assertEqual([(e['type'], e['sos_id']) for e in self.backend.sent], [('sos.created', sos_id)])
+        sos = SOSEvent.objects.get(pk=sos_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            SOSAudio.objects.create(sos_event=sos, file='sos_audio/x.webm')
+            sos.is_active = False
+            sos.save()
+        self.assertEqual([e['type'] for e in self.backend.sent[1:]], ['sos.audio', 'sos.deactivated'])
+
+    def test_stream_requires_police(self):
+        self.client.force_login(make_tourist())
+        self.assertEqual(self.client.get(reverse('sos_stream')).status_code, 403)
+
+    def test_stream_is_not_served_under_wsgi(self):
+        # WSGI would buffer the endless stream; EventSource stops on a 204
+        self.client.force_login(self.police)
+        self.assertEqual(self.client.get(reverse('sos_stream')).status_code, 204)
+
+    async def test_stream_delivers_published_event(self):
+        request = AsyncRequestFactory().get(reverse('sos_stream'))
+
+        async def auser():
+            return self.police
+        request.auser = auser
+        response = await views.sos_stream(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.is_async)
+
+        stream = views._sos_event_stream(self.broker)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        self.assertEqual(self.broker.subscribers, 1)
+        self.broker.publish('sos.created', sos_id=7)
+        chunk = await anext(stream)
+        self.assertTrue(chunk.startswith('event: sos.created\n'))
+        self.assertEqual(json.loads(chunk.split('data: ', 1)[1])['sos_id'], 7)
+        await stream.aclose()
+        self.assertEqual(self.broker.subscribers, 0)
+        self.assertEqual(self.broker.stats()['delivered'], 1)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN each hot query and fail if it falls back to a full table scan or a sort."""
+
+    def setUp(self):
+        self.user = make_tourist()
+        sos = [SOSEvent(tourist=self.user, is_active=i % 3 == 0) for i in range(30)]
+        SOSEvent.objects.bulk_create(sos)
+        base = datetime(2025, 9, 21, tzinfo=dt_timezone.utc)
+        Location.objects.bulk_create([
+            Location(tourist=self.user, latitude=12, longitude=77, timestamp=base + timedelta(seconds=i)) for i in range(200)
+        ])
+        if connection.vendor == 'postgresql':
+            # tiny test tables would always be seq-scanned; ask whether an index path exists at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            bad = [line for line in plan.splitlines()
+                   if re.search(r'SCAN \w+$', line.strip()) or 'TEMP B-TREE' in line]
+        elif connection.vendor == 'postgresql':
+            bad = [line for line in plan.splitlines() if 'Seq Scan' in line or re.match(r'\s*(->\s*)?Sort\b', line)]
+        else:
+            self.skipTest(f"no plan checks for {connection.vendor}")
+        self.assertFalse(bad, f"full scan or sort in plan:\n{plan}")
+
+    def test_location_latest_for_tourist(self):
+        self.assertUsesIndex(Location.objects.filter(tourist=self.user).order_by('-timestamp')[:1])
+
+    def test_location_fir_window(self):
+        since = datetime(2025, 9, 21, 0, 1, tzinfo=dt_timezone.utc)
+        self.assertUsesIndex(Location.objects.filter(tourist=self.user, timestamp__gte=since).order_by('timestamp')[:200])
+
+    def test_active_sos_feed(self):
+        self.assertUsesIndex(SOSEvent.objects.filter(is_active=True).order_by('-created_at')[:200])
+
+    def test_retention_slice(self):
+        start = datetime(2025, 9, 21, tzinfo=dt_timezone.utc)
+        self.assertUsesIndex(Location.objects.filter(timestamp__gte=start, timestamp__lt=start + timedelta(hours=1)))
+
+    def test_recent_sos_list(self):
+        self.assertUsesIndex(SOSEvent.objects.order_by('-created_at')[:50])
+
+
+class ZoneIndexTests(TestCase):
+    def setUp(self):
+        invalidate_zone_index()
+        self.near = DangerZone.objects.create(name='Ghat', center_lat=25.31, center_lon=83.01, radius_m=500)
+        for i in range(50):
+            DangerZone.objects.create(name=f'far {i}', center_lat=10 + i * 0.5, center_lon=70, radius_m=200)
+
+    def test_lookup_only_tests_nearby_candidates(self):
+        index = get_zone_index()
+        self.assertEqual(index.candidates(25.311, 83.011), [self.near])
+        self.assertEqual(index.find(25.311, 83.011), self.near)
+        self.assertIsNone(index.find(25.4, 83.01))
+
+    def test_lookup_does_not_query_zone_table_once_built(self):
+        is_in_danger(25.311, 83.011)
+        with CaptureQueriesContext(connection) as ctx:
+            is_in_danger(25.311, 83.011)
+        self.assertFalse([q for q in ctx.captured_queries if 'accounts_dangerzone' in q['sql']])
+
+    def test_save_and_delete_invalidate_index(self):
+        self.assertIsNone(is_in_danger(0.0, 0.0))
+        zone = DangerZone.objects.create(name='Equator', center_lat=0, center_lon=0, radius_m=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            zone.save()
+        self.assertEqual(is_in_danger(0.0, 0.0), zone)
+        with self.captureOnCommitCallbacks(execute=True):
+            zone.delete()
+        self.assertIsNone(is_in_danger(0.0, 0.0))
+
+    def test_zone_across_antimeridian(self):
+        zone = DangerZone(pk=999, name='Date line', center_lat=0, center_lon=179.999, radius_m=5000)
+        index = ZoneIndex([zone])
+        self.assertEqual(index.find(0.0, -179.99), zone)
+
+
+class BatchGeofenceTests(TestCase):
+    def setUp(self):
+        self.ghat = DangerZone.objects.create(name='Ghat', center_lat=25.31, center_lon=83.01, radius_m=500)
+        self.fort = DangerZone.objects.create(name='Fort', center_lat=26.9, center_lon=75.8, radius_m=1000)
+
+    def test_evaluate_matches_scalar_haversine(self):
+        zones = ZoneSet.from_zones()
+        lat = np.array([25.311, 25.4, 26.905, 0.0])
+        lon = np.array([83.011, 83.01, 75.8, 0.0])
+        # a tiny matrix budget forces one point per chunk
+        result = evaluate(lat, lon, zones, max_cells=1)
+        self.assertEqual(result.zone_index.tolist(), [0, -1, 1, -1])
+        for i in range(len(lat)):
+            zi = result.nearest_index[i]
+            expected = min(haversine(lat[i], lon[i], z.center_lat, z.center_lon) - z.radius_m
+                           for z in (self.ghat, self.fort))
+            self.assertAlmostEqual(result.distance_m[i], expected, delta=0.01)
+            self.assertIn(zones.ids[zi], (self.ghat.pk, self.fort.pk))
+
+    def test_evaluate_with_no_zones(self):
+        result = evaluate([1.0], [2.0], ZoneSet.from_zones([]))
+        self.assertFalse(result.inside.any())
+        self.assertTrue(np.isinf(result.distance_m[0]))
+
+    def test_scan_groups_hits_per_tourist_and_zone(self):
+        alice, bob = make_tourist('alice'), make_tourist('bob')
+        ts = lambda minute: datetime(2025, 9, 21, 10, minute, tzinfo=dt_timezone.utc)
+        Location.objects.bulk_create([
+            Location(tourist=alice, latitude=25.311, longitude=83.011, timestamp=ts(1)),
+            Location(tourist=alice, latitude=25.312, longitude=83.01, timestamp=ts(5)),
+            Location(tourist=alice, latitude=12.0, longitude=77.0, timestamp=ts(6)),
+            Location(tourist=bob, latitude=26.9, longitude=75.801, timestamp=ts(2)),
+        ])
+        processed, hits = scan_locations(fetch_size=2)
+        self.assertEqual(processed, 4)
+        self.assertEqual([(h['tourist_id'], h['zone_name'], h['points']) for h in hits],
+                         [(alice.pk, 'Ghat', 2), (bob.pk, 'Fort', 1)])
+        self.assertEqual(hits[0]['first_epoch'], ts(1).timestamp())
+        self.assertEqual(hits[0]['last_epoch'], ts(5).timestamp())
+
+    def test_management_command_filters_window(self):
+        alice = make_tourist('alice')
+        Location.objects.create(tourist=alice, latitude=25.311, longitude=83.011,
+                                timestamp=datetime(2025, 9, 21, 10, 0, tzinfo=dt_timezone.utc))
+        Location.objects.create(tourist=alice, latitude=26.9, longitude=75.8,
+                                timestamp=datetime(2025, 9, 22, 10, 0, tzinfo=dt_timezone.utc))
+        out = StringIO()
+        call_command('geofence_scan', '--since', '2025-09-21', '--until', '2025-09-22', '--json', stdout=out)
+        body = json.loads(out.getvalue())
+        self.assertEqual(body['processed'], 1)
+        self.assertEqual([h['zone_name'] for h in body['hits']], ['Ghat'])
+        self.assertTrue(body['hits'][0]['first_seen'].startswith('2025-09-21T10:00:00'))
+
+
+class ZoneListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('get_zones')
+        with self.captureOnCommitCallbacks(execute=True):
+            DangerZone.objects.create(name='Ghat', center_lat=25.31, center_lon=83.01, radius_m=500)
+
+    def test_body_cached_per_version(self):
+        first = self.client.get(self.url)
+        self.assertEqual([z['name'] for z in first.json()['zones']], ['Ghat'])
+        self.assertIn('must-revalidate', first['Cache-Control'])
+        self.assertTrue(first.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(self.url)
+        self.assertEqual(len(ctx), 0)
+        self.assertEqual(second.content, first.content)
+
+    def test_revalidation_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(len(ctx), 0)
+
+    def test_zone_write_changes_version(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            DangerZone.objects.create(name='Fort', center_lat=26.9, center_lon=75.8, radius_m=1000)
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual([z['name'] for z in resp.json()['zones']], ['Ghat', 'Fort'])
+
+
+class FirPdfTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for patcher in (mock.patch.object(fir, 'ARTIFACT_DIR', self.dir),
+                        mock.patch.object(fir, '_runner', fir.JobRunner(mode='inline'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(make_police())
+        self.tourist = make_tourist()
+        self.sos = SOSEvent.objects.create(tourist=self.tourist, lat=12, lon=77)
+        self.url = reverse('generate_fir_pdf', args=[self.sos.pk])
+
+    def test_rendered_once_then_served_from_cache(self):
+        with mock.patch.object(fir, 'render_pdf', wraps=fir.render_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(second.streaming_content).startswith(b'%PDF'))
+        status = self.client.get(reverse('fir_pdf_status', args=[self.sos.pk])).json()
+        self.assertEqual(status['status'], fir.READY)
+
+    def test_changed_inputs_get_a_new_artifact(self):
+        self.client.get(self.url)
+        Location.objects.create(tourist=self.tourist, latitude=12, longitude=77)
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+    def test_late_fix_inside_the_window_gets_a_new_artifact(self):
+        self.client.get(self.url)
+        # a batch uploaded after the first download, timestamped before the SOS
+        Location.objects.create(tourist=self.tourist, latitude=12.5, longitude=77,
+                                timestamp=self.sos.created_at - timedelta(minutes=3))
+        status = self.client.get(reverse('fir_pdf_status', args=[self.sos.pk])).json()
+        self.assertEqual(status['status'], 'missing')
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+    def test_profile_and_officer_edits_get_a_new_artifact(self):
+        self.client.get(self.url)
+        profile = self.tourist.tourist_profile
+        profile.phone_number = '+91 99999 00000'
+        profile.save()
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+        police = CustomUser.objects.get(username='officer')
+        police.first_name = 'Asha'
+        police.save()
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.dir)), 3)
+
+    def test_later_pings_reuse_the_artifact_without_collecting(self):
+        self.client.get(self.url)
+        Location.objects.create(tourist=self.tourist, latitude=12, longitude=77,
+                                timestamp=self.sos.created_at + timedelta(minutes=5))
+        with mock.patch.object(fir, 'collect_inputs', wraps=fir.collect_inputs) as collect:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            status = self.client.get(reverse('fir_pdf_status', args=[self.sos.pk])).json()
+        collect.assert_not_called()
+        self.assertEqual(status['status'], fir.READY)
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+    def test_status_of_an_unrequested_fir_is_missing(self):
+        status = self.client.get(reverse('fir_pdf_status', args=[self.sos.pk])).json()
+        self.assertEqual(status['status'], 'missing')
+
+    def test_pending_render_answers_202(self):
+        pending = mock.Mock(done=mock.Mock(return_value=False))
+        with mock.patch.object(fir.JobRunner, 'submit', return_value=pending):
+            resp = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json()['status_url'], reverse('fir_pdf_status', args=[self.sos.pk]))
+
+    def test_trail_table_is_bounded(self):
+        created = self.sos.created_at
+        Location.objects.bulk_create([
+            Location(tourist=self.tourist, latitude=12 + (i % 7) * 1e-3, longitude=77 + i * 1e-4,
+                     timestamp=created - timedelta(seconds=i))
+            for i in range(500)
+        ])
+        sos, inputs, _ = views._fir_job(mock.Mock(user=make_police('other')), self.sos.pk)
+        self.assertEqual(inputs['raw_location_count'], 500)
+        self.assertLessEqual(len(inputs['locations']), fir.TRACK_MAX_POINTS)
+        self.assertEqual([inputs['locations'][0][0], inputs['locations'][-1][0]],
+                         [(created - timedelta(seconds=499)).astimezone().isoformat(), created.astimezone().isoformat()])
+
+    def test_trail_is_the_window_before_the_sos(self):
+        created = self.sos.created_at
+        Location.objects.bulk_create([
+            Location(tourist=self.tourist, latitude=12, longitude=77, timestamp=created + offset)
+            for offset in (-fir.TRACK_BEFORE - timedelta(seconds=1), -fir.TRACK_BEFORE, timedelta(minutes=-1),
+                           fir.TRACK_AFTER + timedelta(seconds=1), timedelta(minutes=30))
+        ])
+        _, inputs, _ = views._fir_job(mock.Mock(user=make_police('other')), self.sos.pk)
+        self.assertEqual([row[0] for row in inputs['locations']],
+                         [(created - fir.TRACK_BEFORE).astimezone().isoformat(),
+                          (created - timedelta(minutes=1)).astimezone().isoformat()])
+        # a capped trail keeps the start of the window
+        with mock.patch.object(fir, 'TRACK_MAX_RAW', 1):
+            _, inputs, _ = views._fir_job(mock.Mock(user=make_police('third')), self.sos.pk)
+        self.assertEqual(inputs['raw_location_count'], 1)
+        self.assertEqual(inputs['locations'][0][0], (created - fir.TRACK_BEFORE).astimezone().isoformat())
+
+    def test_process_pool_render(self):
+        runner = fir.JobRunner(mode='process', workers=1)
+        self.addCleanup(runner.shutdown)
+        sos, inputs, digest = views._fir_job(mock.Mock(user=make_police('other')), self.sos.pk)
+        runner.submit(inputs, digest).result(timeout=60)
+        self.assertEqual(runner.status(sos.pk, digest), (fir.READY, None))
+
+    def test_eviction_by_age_then_size(self):
+        now = 1_000_000
+        for name, age, size in [('old', 10, 1), ('a', 3, 4), ('b', 2, 4), ('c', 1, 4)]:
+            path = os.path.join(self.dir, f'{name}.pdf')
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+            os.utime(path, (now - age, now - age))
+        self.assertEqual(fir.evict_artifacts(max_age=5, max_bytes=8, now=now), 2)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['b.pdf', 'c.pdf'])
+
+
+class TrajectoryTests(TestCase):
+    def test_straight_steady_track_reduces_to_endpoints(self):
+        times = list(range(100))
+        lats = [12 + i * 1e-5 for i in times]
+        self.assertEqual(simplify(times, lats, [77.0] * 100), [0, 99])
+
+    def test_turn_and_stop_are_kept(self):
+        # east for 50s, then north for 50s, then 50s standing still
+        lats = [12.0] * 50 + [12 + i * 1e-5 for i in range(1, 51)] + [12 + 50e-5] * 50
+        lons = [77 + i * 1e-5 for i in range(50)] + [77 + 49e-5] * 100
+        keep = simplify(list(range(150)), lats, lons, tolerance_m=1)
+        self.assertIn(49, keep)
+        # a stop is invisible to plain Douglas-Peucker; the time-aware distance keeps it
+        self.assertTrue(any(98 <= k <= 101 for k in keep), keep)
+
+    def test_max_points_keeps_most_significant(self):
+        lats = [12 + (0.01 if i == 30 else 0) + (0.001 if i == 60 else 0) for i in range(100)]
+        keep = simplify(list(range(100)), lats, [77 + i * 1e-4 for i in range(100)], tolerance_m=0, max_points=3)
+        self.assertEqual(keep, [0, 30, 99])
+
+
+class SosRecordingTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(MEDIA_ROOT=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.tourist = make_tourist()
+        self.sos = SOSEvent.objects.create(tourist=self.tourist)
+        self.url = reverse('sos_recording', args=[self.sos.pk])
+        self.client.force_login(self.tourist)
+
+    def patch(self, data, offset, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum is not False:
+            digest = hashlib.sha256(data if checksum is None else checksum).digest()
+            headers['HTTP_UPLOAD_CHECKSUM'] = 'sha256 ' + base64.b64encode(digest).decode()
+        return self.client.generic('PATCH', self.url, data, content_type='application/offset+octet-stream', **headers)
+
+    def test_chunks_append_to_one_recording_and_resume(self):
+        self.assertEqual(self.patch(b'abc', 0)['Upload-Offset'], '3')
+        # a retried chunk at a stale offset is refused with the real offset
+        stale = self.patch(b'abc', 0)
+        self.assertEqual((stale.status_code, stale['Upload-Offset']), (409, '3'))
+        self.assertEqual(self.patch(b'defg', 3).status_code, 204)
+        self.assertEqual(self.client.head(self.url)['Upload-Offset'], '7')
+        audio = SOSAudio.objects.get(sos_event=self.sos)
+        self.assertTrue(audio.is_recording)
+        with open(os.path.join(settings.MEDIA_ROOT, audio.file.name), 'rb') as f:
+            self.assertEqual(f.read(), b'abcdefg')
+
+    def test_bad_checksum_is_rolled_back(self):
+        self.patch(b'abc', 0)
+        resp = self.patch(b'xyz', 3, checksum=b'other')
+        self.assertEqual(resp.status_code, 460)
+        self.assertEqual(self.client.get(self.url).json()['offset'], 3)
+        self.assertEqual(os.path.getsize(os.path.join(settings.MEDIA_ROOT, SOSAudio.objects.get().file.name)), 3)
+
+    def test_finalize_checks_size_and_hash(self):
+        self.patch(b'hello', 0, checksum=False)
+        finalize = reverse('sos_recording_finalize', args=[self.sos.pk])
+        post = lambda body: self.client.post(finalize, json.dumps(body), content_type='application/json')
+        self.assertEqual(post({'size': 4}).status_code, 409)
+        self.assertEqual(post({'size': 5, 'sha256': '0' * 64}).status_code, 460)
+        self.assertEqual(post({'size': 5, 'sha256': hashlib.sha256(b'hello').hexdigest()}).status_code, 200)
+        self.assertEqual(self.patch(b'!', 5).status_code, 409)
+
+    def test_chunk_is_read_before_the_row_lock(self):
+        self.patch(b'abc', 0)
+        events = []
+        atomic = recording.transaction.atomic
+
+        class Body:
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, n):
+                events.append('read')
+                block, self.data = self.data[:n], self.data[n:]
+                return block
+
+        def locked(*args, **kwargs):
+            events.append('lock')
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(recording.transaction, 'atomic', locked):
+            self.assertEqual(recording.append_chunk(self.sos, 3, Body(b'x' * 100_000), 100_000), 100_003)
+            # the whole body is read before the lock is taken
+            self.assertEqual(events[-1], 'lock')
+            self.assertEqual(events.count('lock'), 1)
+            events.clear()
+            # a short body is refused without taking the lock at all
+            with self.assertRaises(recording.UploadError):
+                recording.append_chunk(self.sos, 100_003, Body(b'short'), 10)
+        self.assertNotIn('lock', events)
+        self.assertEqual(os.path.getsize(os.path.join(settings.MEDIA_ROOT, SOSAudio.objects.get().file.name)), 100_003)
+
+    def test_police_range_playback(self):
+        self.patch(b'0123456789', 0)
+        self.client.force_login(make_police())
+        url = reverse('sos_recording_playback', args=[self.sos.pk])
+        resp = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(b''.join(resp.streaming_content), b'2345')
+        self.assertEqual(resp['Content-Range'], 'bytes 2-5/*')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=-3').getvalue(), b'789')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=20-').status_code, 416)
+        self.assertEqual(self.client.get(url).getvalue(), b'0123456789')
+        feed = self.client.get(reverse('api_active_sos')).json()
+        self.assertEqual(feed['events'][0]['audio_files'], [url])
+
+
+class LocationRetentionTests(TestCase):
+    def setUp(self):
+        self.tourist = make_tourist()
+        self.now = datetime(2025, 9, 30, tzinfo=dt_timezone.utc)
+        self.old = datetime(2025, 9, 1, 10, 0, tzinfo=dt_timezone.utc)
+        # one fix every 10s for 10 minutes, 30 days back, and a recent hour
+        Location.objects.bulk_create(
+            [Location(tourist=self.tourist, latitude=12 + i * 1e-4, longitude=77, timestamp=self.old + timedelta(seconds=10 * i))
+             for i in range(60)]
+            + [Location(tourist=self.tourist, latitude=12, longitude=77, timestamp=self.now - timedelta(seconds=10 * i))
+               for i in range(1, 30)]
+        )
+
+    def test_old_fixes_thinned_to_one_per_minute(self):
+        stats = retention.run(now=self.now)
+        self.assertTrue(stats['done'])
+        self.assertEqual(stats['deleted'], 50)
+        old = Location.objects.filter(timestamp__lt=self.old + timedelta(hours=1))
+        # the last fix of each minute survives
+        self.assertEqual(sorted(ts.second for ts in old.values_list('timestamp', flat=True)), [50] * 10)
+        self.assertEqual(Location.objects.filter(timestamp__gt=self.now - timedelta(days=1)).count(), 29)
+        # a second run has nothing left to do
+        self.assertEqual(retention.run(now=self.now)['scanned'], 0)
+
+    def test_sos_window_is_never_touched(self):
+        sos = SOSEvent.objects.create(tourist=self.tourist, is_active=False)
+        SOSEvent.objects.filter(pk=sos.pk).update(created_at=self.old + timedelta(minutes=5), updated_at=self.old + timedelta(minutes=5))
+        retention.run(now=self.now)
+        self.assertEqual(Location.objects.filter(timestamp__lt=self.old + timedelta(hours=1)).count(), 60)
+
+    def test_bounded_runs_resume_from_checkpoint(self):
+        later = self.old + timedelta(days=2)
+        Location.objects.bulk_create([Location(tourist=self.tourist, latitude=12, longitude=77, timestamp=later + timedelta(seconds=i))
+                                      for i in range(10)])
+        first = retention.run(now=self.now, max_rows=1)
+        self.assertEqual((first['slices'], first['done']), (1, False))
+        self.assertEqual(RetentionCheckpoint.objects.get().cursor, self.old + timedelta(hours=1))
+        second = retention.run(now=self.now)
+        self.assertTrue(second['done'])
+        self.assertEqual(second['deleted'], 9)
+
+    def test_management_command_reports_throughput(self):
+        out = StringIO()
+        call_command('rollup_locations', '--max-rows', '1000', stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+
+    def test_distance_filter_drops_stationary_minutes(self):
+        rows = [(i, 1, self.old + timedelta(minutes=i), 12.0, 77.0) for i in range(5)]
+        self.assertEqual(retention.select_deletions(rows, {}, 60, min_distance_m=5), [1, 2, 3, 4])
+
+
+class LocationArchiveTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(archive, 'ARCHIVE_DIR', self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tourist = make_tourist()
+        self.now = datetime(2025, 9, 30, tzinfo=dt_timezone.utc)
+        self.day = datetime(2025, 8, 1, 10, 0, tzinfo=dt_timezone.utc)
+        Location.objects.bulk_create(
+            [Location(tourist=self.tourist, latitude=12 + i * 1e-4, longitude=77.5, accuracy=5,
+                      timestamp=self.day + timedelta(seconds=10 * i)) for i in range(30)]
+            + [Location(tourist=self.tourist, latitude=12.5, longitude=77.5, timestamp=self.now - timedelta(minutes=1))]
+        )
+
+    def test_old_days_move_to_archive_files(self):
+        stats = archive.run(now=self.now)
+        self.assertTrue(stats['done'])
+        self.assertEqual(stats['archived'], 30)
+        self.assertEqual(Location.objects.count(), 1)
+        entry = ArchivedDay.objects.get()
+        self.assertEqual((entry.day, entry.rows, entry.first_at), (date(2025, 8, 1), 30, self.day))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, entry.path)))
+        self.assertEqual(archive.run(now=self.now)['archived'], 0)
+
+    def test_sos_trail_stays_live(self):
+        sos = SOSEvent.objects.create(tourist=self.tourist, is_active=False)
+        SOSEvent.objects.filter(pk=sos.pk).update(created_at=self.day + timedelta(minutes=2), updated_at=self.day + timedelta(minutes=2))
+        archive.run(now=self.now)
+        self.assertEqual(Location.objects.filter(timestamp__lt=self.now - timedelta(days=1)).count(), 30)
+
+    def test_load_track_merges_archive_and_live(self):
+        archive.run(now=self.now)
+        track = archive.load_track(self.tourist.pk, None, self.now)
+        self.assertEqual(len(track['epoch']), 31)
+        self.assertTrue(np.all(np.diff(track['epoch']) > 0))
+        self.assertAlmostEqual(track['epoch'][0], self.day.timestamp())
+        self.assertAlmostEqual(track['lat'][29], 12 + 29e-4, places=6)
+        self.assertEqual(track['accuracy'][0], 5)
+        self.assertTrue(np.isnan(track['accuracy'][-1]))
+        window = archive.load_track(self.tourist.pk, self.day + timedelta(seconds=100), self.day + timedelta(seconds=200))
+        self.assertEqual(len(window['epoch']), 10)
+
+    def test_late_rows_merge_into_existing_file(self):
+        archive.run(now=self.now)
+        old_path = ArchivedDay.objects.get().path
+        # a delayed upload for an archived day, plus a duplicate of an archived fix
+        Location.objects.bulk_create([
+            Location(tourist=self.tourist, latitude=13, longitude=77.5, timestamp=self.day + timedelta(hours=5)),
+            Location(tourist=self.tourist, latitude=12, longitude=77.5, accuracy=5, timestamp=self.day),
+        ])
+        self.assertEqual(archive.archive_day(self.day.date()), 2)
+        entry = ArchivedDay.objects.get()
+        self.assertEqual(entry.rows, 31)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, old_path)))
+        self.assertEqual(len(archive.load_track(self.tourist.pk, None, self.now - timedelta(days=1))['epoch']), 31)
+
+    def test_rearchiving_keeps_one_copy_of_fixes_without_accuracy(self):
+        Location.objects.create(tourist=self.tourist, latitude=12.2, longitude=77.5, timestamp=self.day + timedelta(hours=1))
+        archive.run(now=self.now)
+        # the same fix arrives again after its day was archived
+        Location.objects.create(tourist=self.tourist, latitude=12.2, longitude=77.5, timestamp=self.day + timedelta(hours=1))
+        archive.archive_day(self.day.date())
+        self.assertEqual(ArchivedDay.objects.get().rows, 31)
+
+    def test_fixes_without_finite_coordinates_are_not_packed(self):
+        ts = [self.day, self.day + timedelta(seconds=1), self.day + timedelta(seconds=2)]
+        records = archive.pack(self.day.date(), ts, [12, float('nan'), 12.1], [77, 77, float('inf')], [5, None, None])
+        self.assertEqual(list(records['t']), [10 * 3600 * 1000])
+        self.assertEqual(len(archive.dedupe(np.concatenate([records, records]))), 1)
+
+    def test_load_track_needs_an_end(self):
+        with self.assertRaises(ValueError):
+            archive.load_track(self.tourist.pk, None, None)
+
+    def test_geofence_scan_includes_archived_points(self):
+        DangerZone.objects.create(name="Cliff", center_lat=12.001, center_lon=77.5, radius_m=500)
+        archive.run(now=self.now)
+        out = StringIO()
+        call_command('geofence_scan', '--json', stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['processed'], 31)
+        self.assertEqual(result['hits'][0]['points'], 30)
+        out = StringIO()
+        call_command('geofence_scan', '--json', '--no-archive', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['hits'], [])
+
+    def test_management_command_reports_throughput(self):
+        out = StringIO()
+        call_command('archive_locations', stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+
+
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.user = make_tourist()
+        self.client.force_login(self.user)
+        self.queue = self.make_queue()
+        previous = writebehind.set_queue(self.queue)
+        self.addCleanup(writebehind.set_queue, previous)
+
+    def make_queue(self, **kwargs):
+        # no flusher thread: the test drives flush() itself
+        queue = writebehind.WriteBehindQueue(journal_dir=self.tmp.name, start=False, enqueue_timeout=0, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def post(self, body):
+        return self.client.post(reverse('api_location'), json.dumps(body), content_type='application/json')
+
+    def test_pings_are_queued_then_bulk_inserted(self):
+        points = [{'latitude': 12 + i / 1000, 'longitude': 77, 'timestamp': f'2025-09-21T10:00:{i:02d}+00:00'} for i in range(5)]
+        resp = self.post(points)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json()['accepted'], 5)
+        self.assertEqual(self.post({'latitude': 13, 'longitude': 77}).status_code, 202)
+        self.assertEqual(Location.objects.count(), 0)
+        self.assertEqual(writebehind.stats()['depth'], 6)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.queue.flush(), 6)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "accounts_location"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Location.objects.count(), 6)
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.user).latitude, 13)
+        stats = writebehind.stats()
+        self.assertEqual((stats['depth'], stats['flushes'], stats['last_flush_rows']), (0, 1, 6))
+        # only the (empty) active segment is left in the journal
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+
+    def test_update_location_only_moves_last_position(self):
+        self.client.post(reverse('update_location'), {'lat': 12.5, 'lon': 77.5})
+        self.queue.flush()
+        self.assertEqual(Location.objects.count(), 0)
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.user).latitude, 12.5)
+
+    def test_full_queue_applies_backpressure(self):
+        self.queue = self.make_queue(max_queue=2)
+        writebehind.set_queue(self.queue)
+        self.assertEqual(self.post([{'latitude': 12, 'longitude': 77}] * 2).status_code, 202)
+        resp = self.post({'latitude': 12, 'longitude': 77})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp['Retry-After'], '1')
+        self.assertEqual(writebehind.stats()['rejected'], 1)
+
+    def test_failed_flush_is_retried_and_holds_capacity(self):
+        self.post({'latitude': 12, 'longitude': 77})
+        with mock.patch.object(writebehind, 'write_entries', side_effect=DatabaseError("locked")), \
+                self.assertLogs('accounts.writebehind', 'ERROR'):
+            self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(writebehind.stats()['depth'], 1)
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_failing_batch_is_dead_lettered_and_does_not_block_the_next(self):
+        self.queue = self.make_queue(max_attempts=2)
+        writebehind.set_queue(self.queue)
+        write_entries = writebehind.write_entries
+
+        def reject_bad(entries):
+            if any(lat == 45 for _, lat, *_ in entries):
+                raise DatabaseError("constraint failed")
+            return write_entries(entries)
+
+        self.post({'latitude': 45, 'longitude': 77})
+        with mock.patch.object(writebehind, 'write_entries', side_effect=reject_bad), \
+                self.assertLogs('accounts.writebehind', 'ERROR') as logs:
+            self.assertEqual(self.queue.flush(), 0)
+            self.post({'latitude': 12, 'longitude': 77})
+            self.assertEqual(self.queue.flush(), 1)
+        self.assertIn('moved to', logs.output[-1])
+        self.assertEqual(list(Location.objects.values_list('latitude', flat=True)), [12])
+        stats = writebehind.stats()
+        self.assertEqual((stats['depth'], stats['dead_lettered']), (0, 1))
+        dead = os.path.join(self.tmp.name, writebehind.DEAD_LETTER_DIR)
+        [name] = os.listdir(dead)
+        with open(os.path.join(dead, name)) as f:
+            self.assertEqual(json.loads(f.readline())[1], 45)
+        # replaying the dead letters later inserts them once the cause is fixed
+        self.assertEqual(writebehind.replay(dead), (1, 1))
+
+    def test_journal_is_replayed_without_duplicates(self):
+        crashed = writebehind.WriteBehindQueue(journal_dir=self.tmp.name, start=False)
+        crashed.submit(self.user.pk, [(0, 12, 77, None, datetime(2025, 9, 21, 4, 30, tzinfo=dt_timezone.utc)),
+                                      (1, 12.1, 77, 5.0, datetime(2025, 9, 21, 4, 30, 5, tzinfo=dt_timezone.utc))])
+        # the worker dies after the first point had been committed
+        Location.objects.create(tourist=self.user, latitude=12, longitude=77,
+                                timestamp=datetime(2025, 9, 21, 4, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(writebehind.replay(self.tmp.name), (0, 0))  # still locked by the live worker
+        crashed._journal.close()
+        out = StringIO()
+        call_command('replay_location_journal', '--journal', self.tmp.name, '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), {'segments': 1, 'rows': 1})
+        self.assertEqual(Location.objects.count(), 2)
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.user).latitude, 12.1)
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_pragmas_applied_per_connection(self):
+        if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_PRAGMAS', None):
+            self.skipTest("DB_PROFILE is not the tuned SQLite profile")
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], int(settings.DATABASES['default']['OPTIONS']['timeout'] * 1000))
+
+
+class LoadGenTests(TestCase):
+    def test_seed_builds_a_usable_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp), \
+                self.captureOnCommitCallbacks(execute=True):
+            counts = loadgen.seed(tourists=4, police=2, locations=10, zones=3, sos=5)
+            self.assertEqual(len(os.listdir(os.path.join(tmp, 'sos_audio'))), 5)
+        self.assertEqual({k: counts[k] for k in ('tourists', 'police', 'locations', 'zones', 'sos_events', 'audio')},
+                         {'tourists': 4, 'police': 2, 'locations': 40, 'zones': 3, 'sos_events': 5, 'audio': 5})
+        self.assertEqual(EmergencyContact.objects.count(), counts['emergency_contacts'])
+        self.assertEqual(LastKnownPosition.objects.count(), 4)
+        self.assertEqual(get_zone_index().size, 3)  # version bumped despite bulk_create
+        self.client.force_login(loadgen.seeded_users('police')[0])
+        events = self.client.get(reverse('api_active_sos')).json()['events']
+        self.assertEqual(len(events), SOSEvent.objects.filter(is_active=True).count())
+        self.assertTrue(all(e['tourist_full_name'] and e['audio_files'] for e in events))
+
+    def test_same_seed_same_data(self):
+        loadgen.seed(tourists=2, locations=5, zones=2, sos=0, audio=False, prefix='a')
+        loadgen.seed(tourists=2, locations=5, zones=2, sos=0, audio=False, prefix='b')
+        a, b = (list(Location.objects.filter(tourist__username__startswith=p).order_by('pk')
+                     .values_list('latitude', 'longitude')) for p in ('a_', 'b_'))
+        self.assertEqual(a, b)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.police = make_police()
+
+    def scrape(self, client=None, **headers):
+        return (client or self.client).get(reverse('metrics'), **headers)
+
+    def test_views_are_recorded_in_prometheus_format(self):
+        self.client.force_login(self.police)
+        self.client.get(reverse('api_active_sos'))
+        self.client.get(reverse('get_zones'))
+        resp = self.scrape()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = resp.content.decode()
+        self.assertIn('# TYPE http_view_latency_seconds histogram', body)
+        self.assertIn('http_view_latency_seconds_count{view="get_zones"} 1', body)
+        self.assertIn('http_view_latency_seconds_bucket{view="api_active_sos",le="+Inf"} 1', body)
+        self.assertIn('http_view_responses_total{view="api_active_sos",status="2xx"} 1', body)
+        queries = re.search(r'^http_view_sql_queries_total\{view="api_active_sos"\} (\d+)$', body, re.M)
+        self.assertGreater(int(queries.group(1)), 0)
+        size = re.search(r'^http_view_response_bytes_total\{view="get_zones"\} (\d+)$', body, re.M)
+        self.assertGreater(int(size.group(1)), 0)
+
+    def test_exceptions_are_counted(self):
+        client = Client(raise_request_exception=False)
+        client.force_login(make_tourist())
+        self.assertEqual(client.post(reverse('update_location'), {}).status_code, 500)
+        self.client.force_login(self.police)
+        self.assertIn('http_view_exceptions_total{view="update_location"} 1', self.scrape().content.decode())
+
+    def test_access_is_restricted(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.client.force_login(make_tourist())
+        self.assertEqual(self.scrape().status_code, 403)
+        with mock.patch.object(views, 'METRICS_TOKEN', 's3cret'):
+            self.assertEqual(self.scrape(Client(), HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+            self.assertEqual(self.scrape(Client(), HTTP_AUTHORIZATION='Bearer nope').status_code, 403)
+
+    def sql_queries(self, view):
+        self.client.force_login(self.police)
+        body = self.scrape().content.decode()
+        return int(re.search(rf'^http_view_sql_queries_total\{{view="{view}"\}} (\d+)$', body, re.M).group(1))
+
+    def test_sql_is_counted_under_asgi(self):
+        client = AsyncClient()
+        client.force_login(self.police)
+        async_to_sync(client.get)(reverse('api_active_sos'))
+        asgi_queries = self.sql_queries('api_active_sos')
+        metrics.registry.reset()
+        self.client.get(reverse('api_active_sos'))
+        self.assertEqual(asgi_queries, 4)
+        self.assertEqual(self.sql_queries('api_active_sos'), asgi_queries)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        self.client.force_login(self.police)
+        with mock.patch.object(metrics, 'SLOW_REQUEST_MS', 0), self.assertLogs('accounts.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('api_active_sos'))
+        self.assertIn('api_active_sos', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ProximityTests(TestCase):
+    def setUp(self):
+        proximity.reset_live_positions()
+        self.addCleanup(proximity.reset_live_positions)
+        self.police = make_police()
+
+    def brute_force(self, points, lat, lon):
+        return sorted((haversine(lat, lon, p_lat, p_lon), i) for i, (p_lat, p_lon) in points.items())
+
+    def test_radius_and_nearest_match_brute_force(self):
+        rng = random.Random(7)
+        points = {i: (12.9 + rng.uniform(-0.1, 0.1), 77.5 + rng.uniform(-0.1, 0.1)) for i in range(500)}
+        index = proximity.PositionIndex()
+        ts = timezone_now()
+        for i, (lat, lon) in points.items():
+            index.update(i, lat, lon, ts)
+        for _ in range(20):
+            lat, lon = 12.9 + rng.uniform(-0.1, 0.1), 77.5 + rng.uniform(-0.1, 0.1)
+            expected = self.brute_force(points, lat, lon)
+            radius = rng.uniform(100, 5000)
+            self.assertEqual([i for _, i, *_ in index.within(lat, lon, radius)],
+                             [i for d, i in expected if d <= radius])
+            self.assertEqual([i for _, i, *_ in index.nearest(lat, lon, 7)], [i for _, i in expected[:7]])
+            self.assertEqual([i for _, i, *_ in index.nearest(lat, lon, 7, max_radius_m=radius)],
+                             [i for d, i in expected[:7] if d <= radius])
+
+    def test_nearest_matches_brute_force_at_high_latitude(self):
+        rng = random.Random(80)
+        ts = timezone_now()
+        for cell_deg in (0.1, 0.01):
+            points = {i: (80 + rng.uniform(-1, 1), rng.uniform(-3, 3)) for i in range(300)}
+            # one tourist past the old ring limit, where the grid's cells are narrowest
+            points[300] = (80.3, 53.5)
+            index = proximity.PositionIndex(cell_deg=cell_deg)
+            for i, (lat, lon) in points.items():
+                index.update(i, lat, lon, ts)
+            for _ in range(20):
+                lat, lon = 80 + rng.uniform(-1, 1), rng.uniform(-3, 3)
+                expected = self.brute_force(points, lat, lon)
+                radius = rng.uniform(1000, 50_000)
+                self.assertEqual([i for _, i, *_ in index.nearest(lat, lon, 5)], [i for _, i in expected[:5]])
+                self.assertEqual([i for _, i, *_ in index.nearest(lat, lon, 5, max_radius_m=radius)],
+                                 [i for d, i in expected[:5] if d <= radius])
+            far = self.brute_force({300: points[300]}, 80.0, 0.05)[0][0]
+            self.assertLess(far, 1_000_000)
+            hits = index.nearest(80.0, 0.05, 1, max_radius_m=1_000_000, exclude=set(range(300)))
+            self.assertEqual([hit[1] for hit in hits], [300])
+
+    def test_nearest_across_the_pole(self):
+        index = proximity.PositionIndex()
+        ts = timezone_now()
+        index.update(1, 89.5, 180.0, ts)
+        index.update(2, 88.0, 0.0, ts)
+        # the tourist on the far side of the pole is ~167 km away, within the radius
+        hits = index.nearest(89.0, 0.0, 2, max_radius_m=200_000)
+        self.assertEqual([hit[1] for hit in hits], [2, 1])
+        self.assertAlmostEqual(hits[1][0], haversine(89.0, 0.0, 89.5, 180.0))
+
+    def test_search_across_antimeridian_and_filters(self):
+        index = proximity.PositionIndex()
+        now = timezone_now()
+        index.update(1, 0.0, 179.999, now)
+        index.update(2, 0.0, -179.999, now - timedelta(hours=2))
+        index.update(3, 0.0, 179.99, now)
+        self.assertEqual([hit[1] for hit in index.within(0.0, -179.9995, 2000)], [2, 1, 3])
+        self.assertEqual([hit[1] for hit in index.nearest(0.0, -179.9995, 2)], [2, 1])
+        self.assertEqual([hit[1] for hit in index.within(0.0, -179.9995, 2000, since=now - timedelta(hours=1),
+                                                         exclude={3})], [1])
+        # an older fix does not move a tourist back
+        index.update(1, 10.0, 10.0, now - timedelta(minutes=1))
+        self.assertEqual(index.positions[1][:2], (0.0, 179.999))
+        index.remove(1)
+        self.assertEqual(len(index), 2)
+
+    def test_pings_move_tourists_after_commit(self):
+        tourist = make_tourist()
+        live = proximity.get_live_positions()
+        live.sync(force=True)
+        self.client.force_login(tourist)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api_location'), json.dumps({'latitude': 12.9, 'longitude': 77.5}),
+                             content_type='application/json')
+        self.assertEqual(live.index.within(12.9, 77.5, 10)[0][1], tourist.pk)
+
+    def test_delta_sync_picks_up_other_writers(self):
+        live = proximity.get_live_positions()
+        live.sync(force=True)
+        tourist = make_tourist()
+        # written behind the index's back, as another worker would
+        LastKnownPosition.objects.create(tourist=tourist, latitude=12.9, longitude=77.5, timestamp=timezone_now())
+        self.assertEqual(live.index.within(12.9, 77.5, 10), [])
+        live.sync(force=True)
+        self.assertEqual(live.index.within(12.9, 77.5, 10)[0][1], tourist.pk)
+
+    def test_api_lists_other_tourists_near_sos(self):
+        victim, near, far, stale = (make_tourist(name) for name in ('victim', 'near', 'far', 'stale'))
+        now = timezone_now()
+        for user, lat, ts in ((victim, 12.9, now), (near, 12.905, now), (far, 13.5, now),
+                              (stale, 12.9001, now - timedelta(hours=2))):
+            LastKnownPosition.objects.create(tourist=user, latitude=lat, longitude=77.5, timestamp=ts)
+        sos = SOSEvent.objects.create(tourist=victim)
+        url = reverse('api_sos_nearby', args=[sos.pk])
+
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(victim)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.police)
+        body = self.client.get(url).json()
+        self.assertEqual(body['center'], {'lat': 12.9, 'lon': 77.5})
+        self.assertEqual([t['tourist_username'] for t in body['tourists']], ['near'])
+        self.assertAlmostEqual(body['tourists'][0]['distance_m'], 556, delta=2)
+        body = self.client.get(url, {'radius_m': 50_000, 'k': 1, 'max_age_minutes': 180}).json()
+        self.assertEqual([t['tourist_username'] for t in body['tourists']], ['stale'])
+        self.assertEqual(self.client.get(url, {'radius_m': 10 ** 6}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'k': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_sos_nearby', args=[sos.pk + 1])).status_code, 404)
+
+
+class MapClusterTests(TestCase):
+    def setUp(self):
+        proximity.reset_live_positions()
+        tiles.reset_sos_tiles()
+        self.addCleanup(proximity.reset_live_positions)
+        self.addCleanup(tiles.reset_sos_tiles)
+        self.police = make_police()
+
+    def test_geohash_cells(self):
+        self.assertEqual(tiles.geohash(*tiles.cell_of(57.64911, 10.40744, 8), 8), 'u4pruydq')
+        self.assertEqual(tiles.geohash(*tiles.cell_of(-25.382708, -49.265506, 5), 5), '6gkzw')
+
+    def test_counts_match_brute_force_and_follow_moves(self):
+        rng = random.Random(3)
+        points = [(12.9 + rng.uniform(-0.3, 0.3), 77.5 + rng.uniform(-0.3, 0.3)) for _ in range(300)]
+        counts = tiles.TileCounts()
+        for lat, lon in points:
+            counts.add(lat, lon)
+        counts.add(*points[0], -1)
+        points = points[1:]
+        for precision in (3, 5, 6):
+            expected = Counter(tiles.geohash(*tiles.cell_of(lat, lon, precision), precision) for lat, lon in points)
+            found = counts.clusters(precision, 12.5, 77.1, 13.3, 77.9)
+            self.assertEqual({c['geohash']: c['count'] for c in found}, dict(expected))
+        # a viewport only gets its own cells
+        west = counts.clusters(6, 12.5, 77.1, 13.3, 77.3)
+        last_col = tiles.cell_of(13.3, 77.3, 6)[1]
+        self.assertEqual(sum(c['count'] for c in west),
+                         sum(1 for lat, lon in points if tiles.cell_of(lat, lon, 6)[1] <= last_col))
+
+    def test_viewport_across_antimeridian(self):
+        counts = tiles.TileCounts()
+        counts.add(0.0, 179.99)
+        counts.add(0.0, -179.99)
+        counts.add(0.0, 0.0)
+        self.assertEqual(sum(c['count'] for c in counts.clusters(4, -1, 179, 1, -179)), 2)
+
+    def test_precision_follows_zoom_and_viewport(self):
+        self.assertLess(tiles.precision_for(5, 5, 65, 30, 95), tiles.precision_for(15, 12.9, 77.5, 12.91, 77.51))
+        precision = tiles.precision_for(22, -90, -180, 90, 180)
+        self.assertLessEqual(tiles._viewport_cells(precision, -90, -180, 90, 180), tiles.MAX_VIEWPORT_CELLS)
+
+    def test_api_returns_tourist_and_sos_clusters(self):
+        now = timezone_now()
+        users = [make_tourist(f't{i}') for i in range(3)]
+        for i, user in enumerate(users):
+            LastKnownPosition.objects.create(tourist=user, latitude=12.9 + i * 1e-4, longitude=77.5, timestamp=now)
+        SOSEvent.objects.create(tourist=users[0])
+        SOSEvent.objects.create(tourist=users[1], lat=13.4, lon=77.5, is_active=False)
+        url = reverse('api_map_clusters')
+        params = {'bbox': '77.4,12.8,77.6,13.0', 'zoom': 10}
+
+        self.client.force_login(users[0])
+        self.assertEqual(self.client.get(url, params).status_code, 403)
+        self.client.force_login(self.police)
+        self.assertEqual(self.client.get(url, {'zoom': 3}).status_code, 400)
+        body = self.client.get(url, params).json()
+        self.assertEqual([c['count'] for c in body['tourists']], [3])
+        self.assertEqual([c['count'] for c in body['sos']], [1])
+        self.assertEqual(len(body['tourists'][0]['geohash']), body['precision'])
+
+        # a ping moves its tourist out of the viewport once committed
+        self.client.force_login(users[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api_location'), json.dumps({'latitude': 14.5, 'longitude': 77.5}),
+                             content_type='application/json')
+        self.client.force_login(self.police)
+        self.assertEqual([c['count'] for c in self.client.get(url, params).json()['tourists']], [2])
+
+
+def ray_cast(rings, lat, lon):
+    # plain even-odd test over every edge
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+            if (y0 <= lat < y1 or y1 <= lat < y0) and x0 + (lat - y0) * (x1 - x0) / (y1 - y0) < lon:
+                inside = not inside
+    return inside
+
+
+def star(lat, lon, n, rng, r_min=0.2, r_max=1.0):
+    # closed [lon, lat] ring of a random star-shaped polygon with n corners
+    ring = []
+    for i in range(n):
+        angle = 2 * math.pi * i / n
+        r = rng.uniform(r_min, r_max)
+        ring.append([lon + r * math.cos(angle), lat + r * math.sin(angle)])
+    return ring + ring[:1]
+
+
+class PolygonZoneTests(TestCase):
+    def setUp(self):
+        invalidate_zone_index()
+        cache.clear()
+        # an L: the notch at the top right is outside
+        self.l_shape = {'type': 'Polygon', 'coordinates': [[
+            [77.0, 12.0], [77.2, 12.0], [77.2, 12.1], [77.1, 12.1], [77.1, 12.2], [77.0, 12.2], [77.0, 12.0]]]}
+
+    def test_matches_ray_casting(self):
+        rng = random.Random(5)
+        outer = star(12.5, 77.5, 1000, rng)
+        hole = star(12.5, 77.5, 50, rng, 0.05, 0.1)
+        other = star(14.0, 79.0, 100, rng)
+        geometry = {'type': 'MultiPolygon', 'coordinates': [[outer, hole], [other]]}
+        polygon = PreparedPolygon(geometry)
+        self.assertIsNone(polygon.bands)
+        for _ in range(2000):
+            lat, lon = rng.uniform(11.3, 15.2), rng.uniform(76.3, 80.2)
+            self.assertEqual(polygon.contains(lat, lon), ray_cast([outer, hole, other], lat, lon), (lat, lon))
+
+    def test_band_fallback_agrees(self):
+        rng = random.Random(6)
+        ring = star(0.0, 0.0, 300, rng)
+        with mock.patch('accounts.geo.MAX_SLAB_ENTRIES', 10):
+            polygon = PreparedPolygon({'type': 'Polygon', 'coordinates': [ring]})
+        self.assertIsNotNone(polygon.bands)
+        for _ in range(1000):
+            lat, lon = rng.uniform(-1.1, 1.1), rng.uniform(-1.1, 1.1)
+            self.assertEqual(polygon.contains(lat, lon), ray_cast([ring], lat, lon))
+
+    def test_polygon_across_antimeridian(self):
+        geometry = {'type': 'Polygon', 'coordinates': [[[179.5, -1], [-179.5, -1], [-179.5, 1], [179.5, 1], [179.5, -1]]]}
+        polygon = PreparedPolygon(geometry)
+        self.assertTrue(polygon.contains(0, 179.9))
+        self.assertTrue(polygon.contains(0, -179.9))
+        self.assertFalse(polygon.contains(0, 179.0))
+        self.assertFalse(polygon.contains(0, -179.0))
+
+    def test_invalid_geometry_is_rejected(self):
+        for geometry in ('nope', {'type': 'Point', 'coordinates': [1, 2]},
+                         {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 1], [0, 0]]]},
+                         {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 95], [2, 0], [0, 0]]]},
+                         # a bowtie crosses itself
+                         {'type': 'Polygon', 'coordinates': [[[0, 0], [2, 2], [2, 0], [0, 2], [0, 0]]]},
+                         # overlapping members, and one member inside another
+                         {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]],
+                                                                  [[[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]]]]},
+                         {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]],
+                                                                  [[[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]]},
+                         {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 0]]]] * 2},
+                         # a hole outside its polygon
+                         {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]],
+                                                             [[5, 5], [6, 5], [6, 6], [5, 5]]]}):
+            with self.assertRaises(ValueError):
+                DangerZone.objects.create(name='bad', center_lat=0, center_lon=0, radius_m=0, geometry=geometry)
+        # members that only share an edge, and a polygon with a hole, are fine
+        normalize_geometry({'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]],
+                                                                   [[[1, 0], [2, 0], [2, 1], [1, 1], [1, 0]]]]})
+        normalize_geometry({'type': 'Polygon', 'coordinates': [[[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]],
+                                                               [[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]})
+
+    def test_save_derives_bounds_and_is_in_danger_uses_the_shape(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            zone = DangerZone.objects.create(name='Ghats', center_lat=0, center_lon=0, radius_m=0, geometry=self.l_shape)
+        self.assertEqual((zone.min_lat, zone.min_lon, zone.max_lat, zone.max_lon), (12.0, 77.0, 12.2, 77.2))
+        self.assertAlmostEqual(zone.center_lat, 12.1)
+        self.assertGreater(zone.radius_m, haversine(12.1, 77.1, 12.2, 77.2) - 1)
+        self.assertEqual(is_in_danger(12.05, 77.15), zone)
+        self.assertEqual(is_in_danger(12.15, 77.05), zone)
+        # inside the bounding box and circle, but in the notch
+        self.assertIsNone(is_in_danger(12.15, 77.15))
+
+    def test_get_zones_and_crud(self):
+        police = make_police()
+        self.client.force_login(police)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('dangerzone_create'), {'name': 'Ghats', 'geometry': json.dumps(self.l_shape)})
+        self.assertEqual(resp.status_code, 302)
+        zone = DangerZone.objects.get(name='Ghats')
+        self.assertTrue(zone.is_polygon)
+        body = self.client.get(reverse('get_zones')).json()['zones'][0]
+        self.assertEqual(body['geometry']['type'], 'MultiPolygon')
+        self.assertEqual(body['radius_m'], zone.radius_m)
+        self.assertContains(self.client.get(reverse('dangerzone_edit', args=[zone.pk])), 'MultiPolygon')
+        self.assertContains(self.client.get(reverse('dangerzone_list')), 'Polygon')
+        resp = self.client.post(reverse('dangerzone_create'), {'name': 'Broken', 'geometry': '{"type": "Polygon"}'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(DangerZone.objects.filter(name='Broken').exists())
+        resp = self.client.post(reverse('dangerzone_create'), {'name': 'Nothing'})
+        self.assertContains(resp, 'draw a polygon')
+        # back to a circle
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('dangerzone_edit', args=[zone.pk]),
+                             {'name': 'Ghats', 'center_lat': 12.0, 'center_lon': 77.0, 'radius_m': 50})
+        zone.refresh_from_db()
+        self.assertIsNone(zone.geometry)
+        self.assertIsNone(zone.min_lat)
+        self.assertEqual(zone.radius_m, 50)
+
+    def test_geofence_exit_margin_follows_the_edge(self):
+        tourist = make_tourist()
+        DangerZone.objects.create(name='Ghats', center_lat=0, center_lon=0, radius_m=0, geometry=self.l_shape)
+        geofence.forget(tourist.pk)
+
+        def ping(lat, lon):
+            with self.captureOnCommitCallbacks(execute=True):
+                return [e.kind for e in geofence.observe(tourist.pk, [(0, lat, lon, None, timezone_now())])]
+
+        self.assertEqual(ping(12.05, 77.15), ['enter'])
+        # 20 m into the notch: within the margin of the edge
+        self.assertEqual(ping(12.1 + 20 / M_PER_DEG_LAT, 77.15), [])
+        self.assertEqual(ping(12.15, 77.15), ['exit'])
+
+    def test_batch_evaluation_refines_polygons(self):
+        DangerZone.objects.create(name='Ghats', center_lat=0, center_lon=0, radius_m=0, geometry=self.l_shape)
+        result = evaluate([12.05, 12.15, 13.0], [77.15, 77.15, 77.0], ZoneSet.from_zones())
+        self.assertEqual(result.zone_index.tolist(), [0, -1, -1])
+        self.assertEqual(result.distance_m[0], 0)
+        self.assertAlmostEqual(result.distance_m[1], 0.05 * M_PER_DEG_LAT * math.cos(math.radians(12.15)), delta=5)
+
+
+class GeofenceTests(TestCase):
+    def setUp(self):
+        invalidate_zone_index()
+        self.backend = RecordingBackend()
+        previous = set_broker(Broker(self.backend))
+        self.addCleanup(set_broker, previous)
+        self.tourist = make_tourist()
+        self.zone = DangerZone.objects.create(name='Cliff', center_lat=12.0, center_lon=77.5, radius_m=500)
+        geofence.forget(self.tourist.pk)
+        self.client.force_login(self.tourist)
+
+    def ping(self, metres_north, at=None):
+        # a point this far north of the zone centre
+        point = (0, 12.0 + metres_north / M_PER_DEG_LAT, 77.5, None, at or timezone_now())
+        with self.captureOnCommitCallbacks(execute=True):
+            return [e.kind for e in geofence.observe(self.tourist.pk, [point])]
+
+    def test_alerts_only_on_transitions(self):
+        alerts = []
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                alerts.append(self.client.post(reverse('update_location'), {'lat': 12.0, 'lon': 77.5}).json().get('alert'))
+        self.assertEqual(alerts, ["You are entering danger zone: Cliff", None, None])
+        with self.captureOnCommitCallbacks(execute=True):
+            body = self.client.post(reverse('update_location'), {'lat': 13.0, 'lon': 77.5}).json()
+        self.assertEqual(body['alert'], "You have left danger zone: Cliff")
+        self.assertEqual(list(GeofenceEvent.objects.values_list('kind', flat=True).order_by('pk')), ['enter', 'exit'])
+        self.assertEqual([e['type'] for e in self.backend.sent], ['geofence.enter', 'geofence.exit'])
+        self.assertIsNone(GeofenceState.objects.get(tourist=self.tourist).zone_id)
+
+    def test_exit_needs_the_margin(self):
+        self.assertEqual(self.ping(0), ['enter'])
+        # jitter just past the edge does not flap
+        self.assertEqual(self.ping(500 + geofence.EXIT_MARGIN_M / 2), [])
+        self.assertEqual(self.ping(490), [])
+        self.assertEqual(self.ping(500 + geofence.EXIT_MARGIN_M * 2), ['exit'])
+        # and coming back in counts from the radius, not the margin
+        self.assertEqual(self.ping(500 + geofence.EXIT_MARGIN_M / 2), [])
+        self.assertEqual(self.ping(400), ['enter'])
+
+    def test_dwell_is_reported_once(self):
+        start = timezone_now()
+        self.assertEqual(self.ping(0, start), ['enter'])
+        self.assertEqual(self.ping(10, start + geofence.DWELL / 2), [])
+        self.assertEqual(self.ping(20, start + geofence.DWELL), ['dwell'])
+        self.assertEqual(self.ping(30, start + geofence.DWELL * 2), [])
+
+    def test_batches_replay_in_time_order(self):
+        now = timezone_now()
+        points = [(0, 13.0, 77.5, None, now), (1, 12.0, 77.5, None, now - timedelta(minutes=1))]
+        with self.captureOnCommitCallbacks(execute=True):
+            events = geofence.observe(self.tourist.pk, points)
+        self.assertEqual([e.kind for e in events], ['enter', 'exit'])
+
+    def test_stale_cache_is_checked_before_writing(self):
+        self.ping(0)
+        # another worker saw the tourist leave; this worker's cache still says inside
+        GeofenceState.objects.filter(pk=self.tourist.pk).update(zone=None, zone_name='', entered_at=None)
+        self.assertEqual(self.ping(2000), [])
+        self.assertEqual(GeofenceEvent.objects.count(), 1)
+
+    def test_cold_cache_is_checked_before_writing(self):
+        self.ping(0)
+        geofence.forget(self.tourist.pk)
+        # the unlocked read raced another worker's enter and saw nothing yet
+        with mock.patch.object(geofence, '_load', return_value=geofence.UNSEEN):
+            self.assertEqual(self.ping(10), [])
+        self.assertEqual(GeofenceEvent.objects.count(), 1)
+
+    def test_late_fixes_are_skipped(self):
+        start = timezone_now()
+        self.assertEqual(self.ping(0, start), ['enter'])
+        self.assertEqual(self.ping(10, start + timedelta(minutes=2)), [])
+        # a batch held back on the device arrives after newer fixes
+        self.assertEqual(self.ping(2000, start + timedelta(minutes=1)), [])
+        # and is still skipped once the cached state is gone
+        geofence.forget(self.tourist.pk)
+        self.assertEqual(self.ping(2000, start - timedelta(minutes=1)), [])
+        self.assertEqual(self.ping(2000, start + timedelta(minutes=3)), ['exit'])
+        self.assertEqual(GeofenceState.objects.get(pk=self.tourist.pk).last_at, start + timedelta(minutes=3))
+        self.assertEqual(list(GeofenceEvent.objects.values_list('kind', flat=True).order_by('pk')), ['enter', 'exit'])
+
+    def test_steady_pings_cost_no_queries(self):
+        self.ping(0)
+        get_zone_index()
+        with CaptureQueriesContext(connection) as ctx:
+            self.ping(10)
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if 'geofence' in q['sql']], [])
+
+    def test_deleted_zone_is_left(self):
+        self.ping(0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.zone.delete()
+        self.assertEqual(self.ping(0), ['exit'])
+        self.assertEqual(GeofenceEvent.objects.get(kind='exit').zone_name, 'Cliff')
+
+    def test_police_feed(self):
+        self.ping(0)
+        self.ping(2000)
+        url = reverse('api_geofence_events')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(make_police())
+        body = self.client.get(url).json()
+        self.assertEqual([(e['kind'], e['zone_name'], e['tourist_username']) for e in body['events']],
+                         [('enter', 'Cliff', 'tourist'), ('exit', 'Cliff', 'tourist')])
+        self.assertEqual(self.client.get(url, {'after': body['cursor']}).json()['events'], [])
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code, 400)
+
+
+def wall_clock_active(schedule, at, tz):
+    # reference: walk the windows in local wall-clock time
+    local = at.astimezone(tz).replace(tzinfo=None)
+    for window in schedule.get('weekly', ()):
+        start_t, end_t = (datetime.strptime(window[k], '%H:%M').time() for k in ('start', 'end'))
+        for back in (0, 1):
+            day = local.date() - timedelta(days=back)
+            if day.weekday() not in window['days']:
+                continue
+            start = datetime.combine(day, start_t)
+            end = datetime.combine(day, end_t)
+            if end <= start:
+                end += timedelta(days=1)
+            if start <= local < end:
+                return True
+    return any(datetime.fromisoformat(a) <= at < datetime.fromisoformat(b) for a, b in schedule.get('once', ()))
+
+
+class ScheduledZoneTests(TestCase):
+    # 2026-10-19 is a Monday
+    MONDAY = datetime(2026, 10, 19, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        invalidate_zone_index()
+        cache.clear()
+        self.nights = {'weekly': [{'days': [0, 1, 2, 3, 4, 5, 6], 'start': '20:00', 'end': '06:00'}]}
+
+    def at(self, days=0, hours=0, minutes=0):
+        return self.MONDAY + timedelta(days=days, hours=hours, minutes=minutes)
+
+    def test_normalize(self):
+        self.assertIsNone(normalize_schedule(None))
+        self.assertIsNone(normalize_schedule({'weekly': [], 'once': []}))
+        schedule = normalize_schedule({'weekly': [{'days': ['6', 0, 0], 'start': '22:00:30', 'end': '02:00'}],
+                                       'once': [['2026-11-01T18:00+05:30', '2026-11-01T23:00+05:30']]})
+        self.assertEqual(schedule['weekly'], [{'days': [0, 6], 'start': '22:00', 'end': '02:00'}])
+        self.assertEqual(schedule['once'], [['2026-11-01T12:30:00+00:00', '2026-11-01T17:30:00+00:00']])
+        for bad in ('nightly', {'daily': []}, {'weekly': [{'days': [7], 'start': '20:00', 'end': '06:00'}]},
+                    {'weekly': [{'days': [1]}]}, {'once': [['2026-11-02T00:00', '2026-11-01T00:00']]},
+                    {'once': [['2026-11-01T00:00']]}):
+            with self.assertRaises(ValueError):
+                normalize_schedule(bad)
+
+    def test_timeline_matches_wall_clock(self):
+        rng = random.Random(7)
+        schedules = {}
+        for zone_id in range(1, 40):
+            weekly = [{'days': rng.sample(range(7), rng.randint(1, 7)),
+                       'start': f'{rng.randrange(24):02d}:{rng.choice((0, 30)):02d}',
+                       'end': f'{rng.randrange(24):02d}:{rng.choice((0, 30)):02d}'} for _ in range(rng.randint(0, 2))]
+            once = []
+            for _ in range(rng.randint(0, 2)):
+                start = self.at(hours=rng.uniform(-24 * 30, 24 * 30))
+                once.append([start, start + timedelta(hours=rng.uniform(1, 72))])
+            schedules[zone_id] = normalize_schedule({'weekly': weekly, 'once': once})
+        # wall-clock windows across a DST change
+        with mock.patch('accounts.schedule.SCHEDULE_TZ', 'Europe/Berlin'):
+            timeline = ZoneTimeline(schedules.items())
+            zones = ZoneSet(np.arange(1, 40), [''] * 39, np.zeros(39), np.zeros(39), np.zeros(39), timeline=timeline)
+            moments = [self.at(hours=rng.uniform(-24 * 40, 24 * 40)) for _ in range(1500)]
+            mask = zones.active_mask([m.timestamp() for m in moments])
+        tz = timeline.tz
+        for row, moment in enumerate(moments):
+            expected = {z for z, schedule in schedules.items() if schedule and wall_clock_active(schedule, moment, tz)}
+            self.assertEqual(set(timeline.active(moment)), expected, moment)
+            # zones left without windows are always active
+            self.assertEqual({z for j, z in enumerate(range(1, 40)) if mask[row, j]},
+                             expected | (set(range(1, 40)) - timeline.scheduled), moment)
+
+    def test_overnight_window_wraps_the_week(self):
+        schedule = normalize_schedule({'weekly': [{'days': [6], 'start': '22:00', 'end': '02:00'}]})
+        timeline = ZoneTimeline([(1, schedule)])
+        self.assertEqual(timeline.active(self.at(hours=1)), {1})        # Monday 01:00
+        self.assertEqual(timeline.active(self.at(hours=3)), set())      # Monday 03:00
+        self.assertEqual(timeline.active(self.at(days=6, hours=23)), {1})
+        self.assertEqual(timeline.active(self.at(days=6, hours=21)), set())
+
+    def test_index_only_finds_active_zones(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            zone = DangerZone.objects.create(name='Market', center_lat=12.0, center_lon=77.5, radius_m=500,
+                                             schedule=self.nights)
+            always = DangerZone.objects.create(name='Cliff', center_lat=13.0, center_lon=77.5, radius_m=500)
+        get_zone_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(is_in_danger(12.0, 77.5, self.at(hours=22)), zone)
+            self.assertIsNone(is_in_danger(12.0, 77.5, self.at(hours=12)))
+            self.assertEqual(is_in_danger(13.0, 77.5, self.at(hours=12)), always)
+
+    def test_geofence_exits_when_the_window_closes(self):
+        tourist = make_tourist()
+        DangerZone.objects.create(name='Market', center_lat=12.0, center_lon=77.5, radius_m=500, schedule=self.nights)
+        geofence.forget(tourist.pk)
+
+        def ping(at):
+            with self.captureOnCommitCallbacks(execute=True):
+                return [e.kind for e in geofence.observe(tourist.pk, [(0, 12.0, 77.5, None, at)])]
+
+        self.assertEqual(ping(self.at(hours=19)), [])
+        self.assertEqual(ping(self.at(hours=20, minutes=5)), ['enter'])
+        self.assertEqual(ping(self.at(days=1, hours=5, minutes=59)), ['dwell'])
+        self.assertEqual(ping(self.at(days=1, hours=6)), ['exit'])
+
+    def test_batch_evaluation_uses_point_times(self):
+        zone = DangerZone.objects.create(name='Market', center_lat=12.0, center_lon=77.5, radius_m=500,
+                                         schedule=self.nights)
+        tourist = make_tourist()
+        for hour in (12, 22):
+            Location.objects.create(tourist=tourist, latitude=12.0, longitude=77.5, timestamp=self.at(hours=hour))
+        zones = ZoneSet.from_zones()
+        epochs = [self.at(hours=12).timestamp(), self.at(hours=22).timestamp()]
+        result = evaluate([12.0, 12.0], [77.5, 77.5], zones, epochs=epochs)
+        self.assertEqual(result.zone_index.tolist(), [-1, 0])
+        self.assertEqual(result.nearest_index.tolist(), [-1, 0])
+        # without times every zone counts
+        self.assertEqual(evaluate([12.0], [77.5], zones).zone_index.tolist(), [0])
+        processed, hits = scan_locations(zones=zones)
+        self.assertEqual(processed, 2)
+        self.assertEqual([(h['zone_id'], h['points'], h['first_epoch']) for h in hits],
+                         [(zone.pk, 1, self.at(hours=22).timestamp())])
+
+    def test_form_and_zone_list(self):
+        self.client.force_login(make_police())
+        form = {'name': 'Market', 'center_lat': 12.0, 'center_lon': 77.5, 'radius_m': 500,
+                'active_days': ['4', '5'], 'active_from': '20:00', 'active_until': '02:00',
+                'event_start': '2026-12-31T18:00', 'event_end': '2027-01-01T04:00'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(reverse('dangerzone_create'), form).status_code, 302)
+        zone = DangerZone.objects.get(name='Market')
+        self.assertEqual(zone.schedule, {'weekly': [{'days': [4, 5], 'start': '20:00', 'end': '02:00'}],
+                                         'once': [['2026-12-31T18:00:00+00:00', '2027-01-01T04:00:00+00:00']]})
+        self.assertContains(self.client.get(reverse('dangerzone_list')), 'Fri,Sat 20:00-02:00; 2026-12-31 18:00 - 2027-01-01 04:00')
+        self.assertContains(self.client.get(reverse('dangerzone_edit', args=[zone.pk])), 'value="2026-12-31T18:00"')
+        self.assertEqual(self.client.get(reverse('get_zones')).json()['zones'][0]['schedule'], zone.schedule)
+        resp = self.client.post(reverse('dangerzone_edit', args=[zone.pk]), {**form, 'active_days': []})
+        self.assertContains(resp, 'needs its days and both times')
+        # clearing the windows makes it permanent again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('dangerzone_edit', args=[zone.pk]),
+                             {'name': 'Market', 'center_lat': 12.0, 'center_lon': 77.5, 'radius_m': 500})
+        zone.refresh_from_db()
+        self.assertIsNone(zone.schedule)
+
+
+class DeviceTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tourist = make_tourist()
+        self.token, _ = device_auth.issue(self.tourist)
+        # no cookies, and CSRF enforced as for a real device
+        self.device = Client(enforce_csrf_checks=True, headers={'Authorization': f'Bearer {self.token}'})
+
+    def ping(self, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return (client or self.device).post(reverse('update_location'), {'lat': 12.9, 'lon': 77.5})
+
+    def test_issued_for_tourist_credentials(self):
+        url = reverse('api_device_token')
+        body = self.client.post(url, {'username': 'tourist', 'password': 'pw'}).json()
+        self.assertEqual(body['token_type'], 'Bearer')
+        self.assertEqual(device_auth.verify(body['token'])['u'], self.tourist.pk)
+        resp = self.client.post(url, json.dumps({'username': 'tourist', 'password': 'pw'}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.client.post(url, {'username': 'tourist', 'password': 'nope'}).status_code, 401)
+        make_police()
+        self.assertEqual(self.client.post(url, {'username': 'officer', 'password': 'pw'}).status_code, 403)
+
+    def test_device_views_skip_sessions_and_user_reads(self):
+        self.ping()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.ping().status_code, 200)
+        tables = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('accounts_customuser', tables)
+        self.assertEqual(LastKnownPosition.objects.get(tourist=self.tourist).latitude, 12.9)
+        resp = self.device.post(reverse('api_location'), json.dumps({'latitude': 1.0, 'longitude': 2.0}),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Location.objects.get(tourist=self.tourist).latitude, 1.0)
+        resp = self.device.post(reverse('api_sos'), json.dumps({'locations': []}), content_type='application/json')
+        sos = SOSEvent.objects.get(pk=resp.json()['sos_id'])
+        self.assertEqual(sos.tourist, self.tourist)
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            upload = SimpleUploadedFile('clip.webm', b'webm', content_type='audio/webm')
+            resp = self.device.post(reverse('upload_sos_audio', args=[sos.pk]), {'audio': upload})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_resumable_recording_with_a_token(self):
+        sos = SOSEvent.objects.create(tourist=self.tourist)
+        url = reverse('sos_recording', args=[sos.pk])
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.device.generic('PATCH', url, b'hello', content_type='application/offset+octet-stream',
+                                           HTTP_UPLOAD_OFFSET='0')
+            self.assertEqual((resp.status_code, resp['Upload-Offset']), (204, '5'))
+            self.assertNotIn('django_session', ' '.join(q['sql'] for q in ctx.captured_queries))
+            self.assertEqual(self.device.head(url)['Upload-Offset'], '5')
+            resp = self.device.post(reverse('sos_recording_finalize', args=[sos.pk]),
+                                    json.dumps({'size': 5, 'sha256': hashlib.sha256(b'hello').hexdigest()}),
+                                    content_type='application/json')
+            self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(SOSAudio.objects.get(sos_event=sos).finalized_at)
+
+    def test_bad_tokens_are_rejected(self):
+        other_salt = signing.dumps({'u': self.tourist.pk, 'r': 'tourist', 'j': 'x', 'i': 0}, salt='elsewhere')
+        for token in (self.token[:-2] + ('xx' if self.token[-2:] != 'xx' else 'yy'), 'junk', other_salt):
+            resp = self.ping(Client(headers={'Authorization': f'Bearer {token}'}))
+            self.assertEqual(resp.status_code, 401)
+            self.assertIn('Bearer', resp['WWW-Authenticate'])
+        with mock.patch.object(device_auth, 'MAX_AGE', timedelta(seconds=-1)):
+            self.assertEqual(self.ping().json()['error'], 'token expired')
+
+    @override_settings(SECURE_SSL_REDIRECT=True, SECURE_HSTS_SECONDS=3600)
+    def test_fast_path_keeps_the_security_middleware(self):
+        device = Client(headers={'Authorization': f'Bearer {self.token}'})
+        resp = self.ping(device)
+        self.assertEqual(resp.status_code, 301)
+        self.assertTrue(resp['Location'].startswith('https://'))
+        self.assertFalse(LastKnownPosition.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = device.post(reverse('update_location'), {'lat': 12.9, 'lon': 77.5}, secure=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Strict-Transport-Security'], 'max-age=3600')
+        self.assertEqual(resp['X-Content-Type-Options'], 'nosniff')
+        self.assertEqual(resp['X-Frame-Options'], 'DENY')
+        resp = Client(headers={'Authorization': 'Bearer junk'}).post(reverse('update_location'), secure=True)
+        self.assertEqual((resp.status_code, resp['X-Frame-Options']), (401, 'DENY'))
+
+    def test_fast_path_exceptions_are_counted(self):
+        metrics.registry.reset()
+        device = Client(raise_request_exception=False, headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(device.post(reverse('update_location'), {}).status_code, 500)
+        self.assertIn('http_view_exceptions_total{view="update_location"} 1', metrics.render())
+
+    def test_bearer_header_is_ignored_elsewhere(self):
+        # not a device view: the session decides, as before
+        resp = self.device.get(reverse('api_active_sos'))
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.post(reverse('update_location'), {'lat': 1, 'lon': 2})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_revocation(self):
+        other, _ = device_auth.issue(self.tourist)
+        other_device = Client(headers={'Authorization': f'Bearer {other}'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.device.post(reverse('api_device_token_revoke')).json(), {'ok': True})
+        self.assertEqual(self.ping().json()['error'], 'token revoked')
+        self.assertEqual(self.ping(other_device).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            other_device.post(reverse('api_device_token_revoke'), {'all': 1})
+        self.assertEqual(self.ping(other_device).status_code, 401)
+        # tokens issued afterwards still work
+        fresh = Client(headers={'Authorization': f'Bearer {device_auth.issue(self.tourist)[0]}'})
+        self.assertEqual(self.ping(fresh).status_code, 200)
+        # the deny-list is read once, then served from the cache
+        with self.assertNumQueries(0):
+            device_auth.verify(device_auth.issue(self.tourist)[0])
+        self.assertEqual(self.client.post(reverse('api_device_token_revoke')).status_code, 401)
+
+    def test_password_change_and_deactivation_revoke(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tourist.last_login = timezone_now()
+            self.tourist.save(update_fields=['last_login'])
+        self.assertEqual(self.ping().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tourist.set_password('new')
+            self.tourist.save()
+        self.assertEqual(self.ping().status_code, 401)
+        token, _ = device_auth.issue(self.tourist)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tourist.is_active = False
+            self.tourist.save()
+        self.assertEqual(self.ping(Client(headers={'Authorization': f'Bearer {token}'})).status_code, 401)
+
+    def test_issued_at_login_and_revoked_at_logout(self):
+        self.client.post(reverse('login'), {'username': 'tourist', 'password': 'pw'})
+        token = self.client.session['device_token']
+        self.assertContains(self.client.get(reverse('tourist_home')), escapejs(token))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('logout'))
+        with self.assertRaises(device_auth.InvalidToken):
+            device_auth.verify(token)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every route in accounts/urls.py has a query budget, checked with 1, 10
+    and 100 SOS events (each with its own tourist, profile, contacts, trail
+    and audio) and as many danger zones: the count must stay within the
+    budget and must not change with the amount of data. A new route fails
+    here until it gets a budget and a req_<name> request below.
+    """
+    SIZES = (1, 10, 100)
+    BUDGETS = {
+        'register_tourist': 0,
+        'register_police': 0,
+        'login': 0,
+        'logout': 4,
+        'tourist_home': 2,
+        'police_home': 2,
+        'api_location': 13,  # first after grow(): rebuilds the zone index
+        'update_location': 8,  # each ping re-enters the base zone: create, lock and write the state row
+        'get_zones': 1,
+        'api_sos': 9,
+        'api_device_token': 1,
+        'api_device_token_revoke': 3,  # drop expired rows, add one, reload the deny-list
+        'api_active_sos': 5,
+        'api_sos_nearby': 5,
+        'api_geofence_events': 3,
+        'api_map_clusters': 5,
+        'generate_fir_pdf': 8,
+        'fir_pdf_status': 7,
+        'upload_sos_audio': 5,
+        'sos_recording': 8,
+        'sos_recording_finalize': 8,
+        'sos_recording_playback': 3,
+        'dangerzone_list': 3,
+        'dangerzone_create': 2,
+        'dangerzone_edit': 3,
+        'dangerzone_delete': 7,  # nulls the zone on geofence state and events
+        'ingest_stats': 2,
+        'metrics': 2,
+        'get_sos_events': 3,  # not routed; called directly
+    }
+    # routes covered elsewhere: the SSE stream never finishes a response
+    EXEMPT = {'sos_stream': "streaming; SosStreamTests"}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for patcher in (override_settings(MEDIA_ROOT=self.tmp.name),
+                        mock.patch.object(fir, 'ARTIFACT_DIR', os.path.join(self.tmp.name, 'fir')),
+                        mock.patch.object(fir, '_runner', fir.JobRunner(mode='inline'))):
+            patcher.enable() if hasattr(patcher, 'enable') else patcher.start()
+            self.addCleanup(patcher.disable if hasattr(patcher, 'disable') else patcher.stop)
+        self.tourist = make_tourist()
+        self.police = make_police()
+        self.sos = SOSEvent.objects.create(tourist=self.tourist, lat=12.9, lon=77.5)
+        SOSAudio.objects.create(sos_event=self.sos, file='sos_audio/x.webm')
+        Location.objects.create(tourist=self.tourist, latitude=12.9, longitude=77.5)
+        LastKnownPosition.objects.create(tourist=self.tourist, latitude=12.9, longitude=77.5, timestamp=self.sos.created_at)
+        recording.append_chunk(self.sos, 0, BytesIO(b'abc'), 3)
+        self.zone = DangerZone.objects.create(name='Base', center_lat=12.9, center_lon=77.5, radius_m=100)
+        self.size = 1
+
+    def grow(self, size):
+        # the fixture above is event number one; the rest come from the load generator
+        with self.captureOnCommitCallbacks(execute=True):
+            loadgen.seed(tourists=size - self.size, police=0, locations=3, zones=size - self.size,
+                         sos=size - self.size, prefix=f'grow{size}')
+        SOSEvent.objects.update(is_active=True)
+        self.size = size
+
+    def client_for(self, user):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def json(self, body):
+        return {'data': json.dumps(body), 'content_type': 'application/json'}
+
+    def point(self):
+        return {'latitude': 12.9, 'longitude': 77.5, 'timestamp': timezone_now().isoformat()}
+
+    # each returns (user, method, url, request kwargs); set-up queries here are not counted
+    def req_register_tourist(self):
+        return None, 'get', reverse('register_tourist'), {}
+
+    def req_register_police(self):
+        return None, 'get', reverse('register_police'), {}
+
+    def req_login(self):
+        return None, 'get', reverse('login'), {}
+
+    def req_logout(self):
+        return self.tourist, 'get', reverse('logout'), {}
+
+    def req_tourist_home(self):
+        return self.tourist, 'get', reverse('tourist_home'), {}
+
+    def req_police_home(self):
+        return self.police, 'get', reverse('police_home'), {}
+
+    def enter_base_zone_again(self):
+        # every ping then pays for a geofence transition: read, upsert, event
+        GeofenceState.objects.filter(tourist=self.tourist).delete()
+        geofence.forget(self.tourist.pk)
+
+    def req_api_location(self):
+        self.enter_base_zone_again()
+        return self.tourist, 'post', reverse('api_location'), self.json([self.point()] * 5)
+
+    def req_update_location(self):
+        self.enter_base_zone_again()
+        return self.tourist, 'post', reverse('update_location'), {'data': {'lat': 12.9, 'lon': 77.5}}
+
+    def req_get_zones(self):
+        return None, 'get', reverse('get_zones'), {}
+
+    def req_api_sos(self):
+        return self.tourist, 'post', reverse('api_sos'), self.json({'locations': [self.point()] * 5})
+
+    def req_api_device_token(self):
+        return None, 'post', reverse('api_device_token'), {'data': {'username': 'tourist', 'password': 'pw'}}
+
+    def req_api_device_token_revoke(self):
+        token, _ = device_auth.issue(self.tourist)
+        device_auth.invalidate_denylist()
+        return None, 'post', reverse('api_device_token_revoke'), {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def req_api_active_sos(self):
+        return self.police, 'get', reverse('api_active_sos'), {}
+
+    def req_api_sos_nearby(self):
+        # a cold index, so every size pays the same full sync, and at least
+        # one other tourist nearby so the names are always looked up
+        proximity.reset_live_positions()
+        if not hasattr(self, 'neighbour'):
+            self.neighbour = make_tourist('neighbour')
+            LastKnownPosition.objects.create(tourist=self.neighbour, latitude=12.901, longitude=77.5,
+                                             timestamp=timezone_now())
+        return self.police, 'get', reverse('api_sos_nearby', args=[self.sos.pk]), {'data': {'radius_m': 50_000}}
+
+    def req_api_map_clusters(self):
+        proximity.reset_live_positions()
+        tiles.reset_sos_tiles()
+        return self.police, 'get', reverse('api_map_clusters'), {'data': {'bbox': '77,12.5,78.5,13.5', 'zoom': 12}}
+
+    def req_api_geofence_events(self):
+        return self.police, 'get', reverse('api_geofence_events'), {}
+
+    def req_generate_fir_pdf(self):
+        # forget the remembered digest so every size collects the inputs again
+        cache.delete(fir.digest_key(SOSEvent.objects.select_related('tourist__tourist_profile').get(pk=self.sos.pk),
+                                     self.police))
+        return self.police, 'get', reverse('generate_fir_pdf', args=[self.sos.pk]), {}
+
+    def req_fir_pdf_status(self):
+        return self.police, 'get', reverse('fir_pdf_status', args=[self.sos.pk]), {}
+
+    def req_upload_sos_audio(self):
+        upload = SimpleUploadedFile('clip.webm', b'webm', content_type='audio/webm')
+        return self.tourist, 'post', reverse('upload_sos_audio', args=[self.sos.pk]), {'data': {'audio': upload}}
+
+    def req_sos_recording(self):
+        offset = SOSAudio.objects.get(sos_event=self.sos, is_recording=True).size
+        return self.tourist, 'patch', reverse('sos_recording', args=[self.sos.pk]), {
+            'data': b'more', 'content_type': 'application/octet-stream', 'HTTP_UPLOAD_OFFSET': str(offset)}
+
+    def req_sos_recording_finalize(self):
+        sos = SOSEvent.objects.create(tourist=self.tourist)
+        recording.append_chunk(sos, 0, BytesIO(b'abc'), 3)
+        return self.tourist, 'post', reverse('sos_recording_finalize', args=[sos.pk]), self.json({'size': 3})
+
+    def req_sos_recording_playback(self):
+        return self.police, 'get', reverse('sos_recording_playback', args=[self.sos.pk]), {'HTTP_RANGE': 'bytes=0-1'}
+
+    def req_dangerzone_list(self):
+        return self.police, 'get', reverse('dangerzone_list'), {}
+
+    def req_dangerzone_create(self):
+        return self.police, 'get', reverse('dangerzone_create'), {}
+
+    def req_dangerzone_edit(self):
+        return self.police, 'get', reverse('dangerzone_edit', args=[self.zone.pk]), {}
+
+    def req_dangerzone_delete(self):
+        zone = DangerZone.objects.create(name='Doomed', center_lat=1, center_lon=1, radius_m=10)
+        return self.police, 'post', reverse('dangerzone_delete', args=[zone.pk]), {}
+
+    def req_ingest_stats(self):
+        return self.police, 'get', reverse('ingest_stats'), {}
+
+    def req_metrics(self):
+        return self.police, 'get', reverse('metrics'), {}
+
+    def count(self, name):
+        if name == 'get_sos_events':
+            request = RequestFactory().get('/')
+            request.user = self.police
+            with CaptureQueriesContext(connection) as ctx:
+                response = views.get_sos_events(request)
+            self.assertEqual(len(json.loads(response.content)['events']), min(SOSEvent.objects.count(), 50))
+            return len(ctx.captured_queries)
+        user, method, url, kwargs = getattr(self, f'req_{name}')()
+        client = self.client_for(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(client, method)(url, **kwargs)
+        if response.status_code >= 400:
+            self.fail(f"{name}: {response.status_code} {getattr(response, 'content', b'')[:200]!r}")
+        return len(ctx.captured_queries)
+
+    def test_every_route_has_a_budget(self):
+        from .urls import urlpatterns
+        names = {p.name for p in urlpatterns}
+        self.assertEqual(names - set(self.BUDGETS) - set(self.EXEMPT), set())
+
+    def test_query_counts_are_flat_and_within_budget(self):
+        counts = {name: [] for name in self.BUDGETS}
+        for size in self.SIZES:
+            self.grow(size)
+            for name in self.BUDGETS:
+                counts[name].append(self.count(name))
+        problems = [f"{name}: {found} queries for {self.SIZES} events (budget {self.BUDGETS[name]})"
+                    for name, found in counts.items()
+                    if len(set(found)) > 1 or max(found) > self.BUDGETS[name]]
+        self.assertEqual(problems, [])
@@ -0,0 +1,158 @@
+# accounts/tiles.py
+# Geohash-cell counts for the police map: instead of every tourist and SOS,
+# the map gets one (count, centroid) per cell at a precision picked from the
+# zoom level, for the cells under its viewport. Tourist counts are kept by
+# proximity.LivePositions and move with each ping; active SOS counts are
+# rebuilt when the SOS table changes.
+import math
+import threading
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.functions import Coalesce
+
+from .models import SOSEvent
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# precision 8 cells are ~38 x 19 m
+MAX_PRECISION = 8
+# aim for clusters about this far apart on screen
+CLUSTER_PX = getattr(settings, 'MAP_CLUSTER_PX', 60)
+# a viewport is answered with at most this many cells; larger ones get a coarser precision
+MAX_VIEWPORT_CELLS = getattr(settings, 'MAP_MAX_VIEWPORT_CELLS', 4096)
+
+
+def _bits(precision):
+    # (longitude bits, latitude bits); geohash interleaves them starting with longitude
+    n = 5 * precision
+    return (n + 1) // 2, n // 2
+
+
+def cell_of(lat, lon, precision=MAX_PRECISION):
+    """(row, col) of the geohash cell containing the point."""
+    lon_bits, lat_bits = _bits(precision)
+    row = min(max(int((lat + 90.0) / 180.0 * (1 << lat_bits)), 0), (1 << lat_bits) - 1)
+    col = min(int((lon + 180.0) % 360.0 / 360.0 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    return row, col
+
+
+def geohash(row, col, precision):
+    lon_bits, lat_bits = _bits(precision)
+    value = 0
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((col >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((row >> lat_bits) & 1)
+    return ''.join(BASE32[(value >> (5 * k)) & 31] for k in reversed(range(precision)))
+
+
+def precision_for(zoom, min_lat, min_lon, max_lat, max_lon):
+    """Finest precision whose cells are at least CLUSTER_PX wide at this (web mercator) zoom, coarsened
+    until the viewport fits in MAX_VIEWPORT_CELLS."""
+    lon_bits_max = zoom + 8 - math.log2(CLUSTER_PX)  # 256 px tiles
+    precision = MAX_PRECISION
+    while precision > 1 and (_bits(precision)[0] > lon_bits_max
+                             or _viewport_cells(precision, min_lat, min_lon, max_lat, max_lon) > MAX_VIEWPORT_CELLS):
+        precision -= 1
+    return precision
+
+
+def _ranges(precision, min_lat, min_lon, max_lat, max_lon):
+    # row range and column ranges (two when the viewport crosses the antimeridian)
+    r_lo, c_lo = cell_of(min_lat, min_lon, precision)
+    r_hi, c_hi = cell_of(max_lat, max_lon, precision)
+    if max_lon - min_lon >= 360.0:
+        return range(r_lo, r_hi + 1), [range(1 << _bits(precision)[0])]
+    if c_lo <= c_hi:
+        return range(r_lo, r_hi + 1), [range(c_lo, c_hi + 1)]
+    return range(r_lo, r_hi + 1), [range(c_lo, 1 << _bits(precision)[0]), range(0, c_hi + 1)]
+
+
+def _viewport_cells(precision, *bbox):
+    rows, col_ranges = _ranges(precision, *bbox)
+    return len(rows) * sum(len(cols) for cols in col_ranges)
+
+
+class TileCounts:
+    """Per precision 1..MAX_PRECISION: (row, col) -> [count, sum of lat, sum of lon]."""
+
+    def __init__(self):
+        self.levels = {p: {} for p in range(1, MAX_PRECISION + 1)}
+        self._shifts = {p: (_bits(MAX_PRECISION)[1] - _bits(p)[1], _bits(MAX_PRECISION)[0] - _bits(p)[0])
+                        for p in self.levels}
+        self._lock = threading.Lock()
+
+    def add(self, lat, lon, sign=1):
+        """Count a point in (sign=1) or out (sign=-1) of its cell at every precision."""
+        row, col = cell_of(lat, lon)
+        with self._lock:
+            for p, level in self.levels.items():
+                row_shift, col_shift = self._shifts[p]
+                key = (row >> row_shift, col >> col_shift)
+                entry = level.get(key)
+                if entry is None:
+                    entry = level[key] = [0, 0.0, 0.0]
+                entry[0] += sign
+                entry[1] += sign * lat
+                entry[2] += sign * lon
+                if entry[0] <= 0:
+                    del level[key]
+
+    def __len__(self):
+        return sum(entry[0] for entry in self.levels[1].values())
+
+    def clusters(self, precision, min_lat, min_lon, max_lat, max_lon):
+        """[{geohash, count, lat, lon}] for the occupied cells under the viewport; lat/lon is the centroid."""
+        rows, col_ranges = _ranges(precision, min_lat, min_lon, max_lat, max_lon)
+        found = []
+        with self._lock:
+            level = self.levels[precision]
+            if len(rows) * sum(len(cols) for cols in col_ranges) <= len(level):
+                for row in rows:
+                    for cols in col_ranges:
+                        for col in cols:
+                            entry = level.get((row, col))
+                            if entry is not None:
+                                found.append(((row, col), *entry))
+            else:
+                # fewer occupied cells than viewport cells: filter those instead
+                found = [(key, *entry) for key, entry in level.items()
+                         if key[0] in rows and any(key[1] in cols for cols in col_ranges)]
+        return [{'geohash': geohash(row, col, precision), 'count': n,
+                 'lat': round(sum_lat / n, 6), 'lon': round(sum_lon / n, 6)}
+                for (row, col), n, sum_lat, sum_lon in sorted(found)]
+
+
+_sos = None
+_sos_lock = threading.Lock()
+
+
+def sos_tiles():
+    """TileCounts of active SOS events, rebuilt whenever an event is added, changed or deleted."""
+    global _sos
+    state = SOSEvent.objects.aggregate(latest=Max('updated_at'), total=Count('pk'))
+    key = (state['latest'], state['total'])
+    current = _sos
+    if current is not None and current[0] == key:
+        return current[1]
+    counts = TileCounts()
+    # events without their own fix are placed at the tourist's last known position
+    events = (SOSEvent.objects.filter(is_active=True)
+              .annotate(at_lat=Coalesce('lat', 'tourist__last_position__latitude'),
+                        at_lon=Coalesce('lon', 'tourist__last_position__longitude'))
+              .filter(at_lat__isnull=False, at_lon__isnull=False))
+    for lat, lon in events.values_list('at_lat', 'at_lon').iterator():
+        counts.add(lat, lon)
+    with _sos_lock:
+        _sos = (key, counts)
+    return counts
+
+
+def reset_sos_tiles():
+    # drop the cached SOS counts (tests)
+    global _sos
+    with _sos_lock:
+        _sos = None
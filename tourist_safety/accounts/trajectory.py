@@ -0,0 +1,66 @@
+# accounts/trajectory.py
+# Track simplification for reports and track responses: a time-aware
+# Douglas-Peucker that keeps the most significant fixes of a GPS trail.
+import heapq
+import math
+
+from django.conf import settings
+
+from .geo import M_PER_DEG_LAT
+
+# fixes whose deviation from the simplified track is under this are dropped
+TOLERANCE_M = getattr(settings, 'TRACK_SIMPLIFY_TOLERANCE_M', 10.0)
+
+
+def _project(lat, lon, lat0):
+    # local equirectangular metres; plenty for trails a few km long
+    return lon * M_PER_DEG_LAT * math.cos(math.radians(lat0)), lat * M_PER_DEG_LAT
+
+
+def _sed(p, a, b):
+    """
+    Synchronised euclidean distance: how far fix `p` is from where the
+    tourist would have been at p's time moving uniformly from `a` to `b`.
+    Unlike perpendicular distance this keeps stops and speed changes.
+    """
+    (ta, xa, ya), (tb, xb, yb), (tp, xp, yp) = a, b, p
+    f = (tp - ta) / (tb - ta) if tb != ta else 0.0
+    return math.hypot(xp - (xa + f * (xb - xa)), yp - (ya + f * (yb - ya)))
+
+
+def _worst(pts, i, j):
+    worst, worst_k = -1.0, None
+    for k in range(i + 1, j):
+        d = _sed(pts[k], pts[i], pts[j])
+        if d > worst:
+            worst, worst_k = d, k
+    return worst, worst_k
+
+
+def simplify(times, lats, lons, tolerance_m=TOLERANCE_M, max_points=None):
+    """
+    Indices (ascending) of the fixes to keep. Endpoints are always kept.
+    Segments are split worst-first, so when `max_points` caps the output
+    the points kept are the most significant ones.
+    """
+    n = len(times)
+    if n <= 2:
+        return list(range(n))
+    lat0 = lats[0]
+    pts = [(t,) + _project(lat, lon, lat0) for t, lat, lon in zip(times, lats, lons)]
+    keep = {0, n - 1}
+    limit = n if max_points is None else max(max_points, 2)
+    heap = []
+    err, k = _worst(pts, 0, n - 1)
+    if k is not None:
+        heap.append((-err, 0, n - 1, k))
+    while heap and len(keep) < limit:
+        neg_err, i, j, k = heapq.heappop(heap)
+        if -neg_err <= tolerance_m:
+            break
+        keep.add(k)
+        for a, b in ((i, k), (k, j)):
+            err, m = _worst(pts, a, b)
+            if m is not None:
+                heapq.heappush(heap, (-err, a, b, m))
+    return sorted(keep)
@@ -13,9 +13,21 @@ urlpatterns = [
     path('api/location/update/', views.update_location, name='update_location'),
     path('api/zones/', views.get_zones, name='get_zones'),
     path('api/sos/', views.api_sos, name='api_sos'),
+    path('api/device_token/', views.api_device_token, name='api_device_token'),
+    path('api/device_token/revoke/', views.api_device_token_revoke, name='api_device_token_revoke'),
     path('police/api/active_sos/', views.api_active_sos, name='api_active_sos'),  # we'll add view below
+    path('police/api/sos/<int:sos_id>/nearby/', views.api_sos_nearby, name='api_sos_nearby'),
+    path('police/api/map/clusters/', views.api_map_clusters, name='api_map_clusters'),
+    path('police/api/geofence_events/', views.api_geofence_events, name='api_geofence_events'),
+    path('police/api/sos_stream/', views.sos_stream, name='sos_stream'),
+    path('police/api/ingest_stats/', views.ingest_stats, name='ingest_stats'),
+    path('metrics/', views.metrics, name='metrics'),
     path('police/fir/<int:sos_id>/pdf/', views.generate_fir_pdf, name='generate_fir_pdf'),
+    path('police/fir/<int:sos_id>/status/', views.fir_pdf_status, name='fir_pdf_status'),
     path('api/sos/<int:sos_id>/upload_audio/', views.upload_sos_audio, name='upload_sos_audio'),
+    path('api/sos/<int:sos_id>/recording/', views.sos_recording, name='sos_recording'),
+    path('api/sos/<int:sos_id>/recording/finalize/', views.sos_recording_finalize, name='sos_recording_finalize'),
+    path('police/sos/<int:sos_id>/recording/', views.sos_recording_playback, name='sos_recording_playback'),
     path("dangerzones/", views.dangerzone_list, name="dangerzone_list"),
     path("dangerzones/add/", views.dangerzone_create, name="dangerzone_create"),
     path("dangerzones/<int:pk>/edit/", views.dangerzone_edit, name="dangerzone_edit"),
@@ -8,13 +8,34 @@ from django.conf import settings
 from django.http import HttpResponseForbidden
 # accounts/views.py (append)
 import json
+import math
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.utils import timezone
-from .models import Location, SOSEvent, SOSAudio
+from .models import Location, SOSEvent, SOSAudio, TouristProfile
+from django.db.models import Prefetch
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt  # we prefer CSRF via token; keep login_required
 
+from django.db import transaction
+from .ingest import decode_batch, parse_point, parse_points, build_locations, record_last_position, PointError, MAX_BATCH_POINTS
+from . import device_auth, geofence, metrics as metrics_registry, writebehind
+
+
+def _queue_full():
+    response = JsonResponse({'ok': False, 'error': "server busy, retry shortly"}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def _with_alert(body, events):
+    # only geofence transitions produce an alert, not every ping inside a zone
+    message = geofence.alert(events)
+    if message:
+        body['alert'] = message
+    return body
+
+
 @require_POST
 @login_required
 def api_location(request):
@@ -22,22 +43,51 @@ def api_location(request):
     if not request.user.is_tourist():
         return HttpResponseForbidden("Only tourists may post location.")
     try:
-        data = json.loads(request.body)
-        lat = float(data['latitude'])
-        lon = float(data['longitude'])
-        accuracy = float(data.get('accuracy')) if data.get('accuracy') is not None else None
-        ts = data.get('timestamp')
-        if ts:
-            # expect ISO format
-            timestamp = timezone.datetime.fromisoformat(ts)
-            if timezone.is_naive(timestamp):
-                timestamp = timezone.make_aware(timestamp, timezone.get_current_timezone())
-        else:
-            timestamp = timezone.now()
-    except Exception as e:
+        items, rejected, is_batch = decode_batch(request)
+    except ValueError as e:
         return HttpResponseBadRequest(f"Bad payload: {e}")
-    Location.objects.create(tourist=request.user, latitude=lat, longitude=lon, accuracy=accuracy, timestamp=timestamp)
-    return JsonResponse({'ok': True})
+    if is_batch:
+        return _api_location_batch(request, items, rejected)
+    try:
+        lat, lon, accuracy, timestamp = parse_point(items[0][1], timezone.now())
+    except PointError as e:
+        return HttpResponseBadRequest(f"Bad payload: {e}")
+    point = (0, lat, lon, accuracy, timestamp)
+    queue = writebehind.get_queue()
+    if queue is not None:
+        try:
+            queue.submit(request.user.pk, [point])
+        except writebehind.QueueFull:
+            return _queue_full()
+        return JsonResponse(_with_alert({'ok': True, 'queued': True}, geofence.observe(request.user.pk, [point])), status=202)
+    with transaction.atomic():
+        Location.objects.create(tourist=request.user, latitude=lat, longitude=lon, accuracy=accuracy, timestamp=timestamp)
+        record_last_position(request.user, [point])
+        events = geofence.observe(request.user.pk, [point])
+    return JsonResponse(_with_alert({'ok': True}, events))
+
+
+def _api_location_batch(request, items, rejected):
+    # batch mode: validate everything first, then one bulk insert
+    points, invalid = parse_points(items)
+    rejected = sorted(rejected + invalid, key=lambda r: r['index'])
+    queue = writebehind.get_queue()
+    if points and queue is not None:
+        try:
+            queue.submit(request.user.pk, points)
+        except writebehind.QueueFull:
+            return _queue_full()
+        body = {'ok': True, 'queued': True, 'accepted': len(points), 'rejected': rejected}
+        return JsonResponse(_with_alert(body, geofence.observe(request.user.pk, points)), status=202)
+    events = []
+    if points:
+        with transaction.atomic():
+            Location.objects.bulk_create(build_locations(request.user, points))
+            record_last_position(request.user, points)
+            events = geofence.observe(request.user.pk, points)
+    status = 400 if rejected and not points else 200
+    body = {'ok': bool(points) or not rejected, 'accepted': len(points), 'rejected': rejected}
+    return JsonResponse(_with_alert(body, events), status=status)
 
 
 @require_POST
@@ -51,41 +101,33 @@ def api_sos(request):
         description = data.get('description', '')
     except Exception as e:
         return HttpResponseBadRequest(f"Bad JSON: {e}")
+    if not isinstance(locations, list):
+        return HttpResponseBadRequest("Bad payload: locations must be a list")
 
-    # create SOSEvent using first/last loc summary
-    if locations:
-        # pick the latest location as summary
-        latest = locations[-1]
-        lat = float(latest['latitude'])
-        lon = float(latest['longitude'])
+    # validate the whole trail (and parse its timestamps) in one pass
+    points, rejected = parse_points(enumerate(locations[:MAX_BATCH_POINTS]))
+    skipped = len(rejected) + max(len(locations) - MAX_BATCH_POINTS, 0)
+
+    # create SOSEvent using the latest valid location as summary
+    if points:
+        _, lat, lon, _, _ = points[-1]
     else:
         lat = lon = None
 
-    sos = SOSEvent.objects.create(tourist=request.user, description=description, lat=lat, lon=lon)
+    # event and trail are written together or not at all
+    with transaction.atomic():
+        sos = SOSEvent.objects.create(tourist=request.user, description=description, lat=lat, lon=lon)
+        Location.objects.bulk_create(build_locations(request.user, points))
+        record_last_position(request.user, points)
 
-    # store locations
-    for loc in locations:
-        try:
-            ts = loc.get('timestamp')
-            if ts:
-                timestamp = timezone.datetime.fromisoformat(ts)
-                if timezone.is_naive(timestamp):
-                    timestamp = timezone.make_aware(timestamp, timezone.get_current_timezone())
-            else:
-                timestamp = timezone.now()
-            Location.objects.create(
-                tourist=request.user,
-                latitude=float(loc['latitude']),
-                longitude=float(loc['longitude']),
-                accuracy=float(loc.get('accuracy')) if loc.get('accuracy') else None,
-                timestamp=timestamp
-            )
-        except Exception:
-            # skip malformed location entry
-            continue
-
-    # TODO: push realtime notification to police via channels / push service
-    return JsonResponse({'ok': True, 'sos_id': sos.id, 'created_at': sos.created_at.isoformat()})
+    # police consoles are notified after commit by the SOSEvent post_save signal
+    return JsonResponse({
+        'ok': True,
+        'sos_id': sos.id,
+        'created_at': sos.created_at.isoformat(),
+        'locations_saved': len(points),
+        'locations_skipped': skipped,
+    })
 
 def register_tourist(request):
     if request.method == 'POST':
@@ -125,6 +167,8 @@ def login_view(request):
             login(request, user)
             # redirect based on role
             if user.is_tourist():
+                # the page's API calls use the device token fast path
+                request.session['device_token'], _ = device_auth.issue(user)
                 return redirect('tourist_home')
             elif user.is_police():
                 return redirect('police_home')
@@ -139,7 +183,46 @@ def tourist_home(request):
     if not request.user.is_tourist():
         return HttpResponseForbidden("Not a tourist.")
     # Template will include SOS UI (JS will handle geo-permissions later)
-    return render(request, 'accounts/tourist_home.html')
+    return render(request, 'accounts/tourist_home.html', {'device_token': request.session.get('device_token', '')})
+
+
+@csrf_exempt
+@require_POST
+def api_device_token(request):
+    # device login: credentials in, a bearer token for the device endpoints (device_auth.VIEWS) out
+    data = request.POST
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError as e:
+            return HttpResponseBadRequest(f"Bad JSON: {e}")
+    if not hasattr(data, 'get'):
+        return HttpResponseBadRequest("Bad payload: expected an object")
+    user = authenticate(request, username=data.get('username'), password=data.get('password'))
+    if user is None:
+        return device_auth.unauthorized("invalid credentials")
+    if not user.is_tourist():
+        return JsonResponse({'error': "Only tourists get device tokens."}, status=403)
+    token, expires_at = device_auth.issue(user)
+    return JsonResponse({'token': token, 'token_type': 'Bearer', 'expires_at': expires_at.isoformat()})
+
+
+@csrf_exempt
+@require_POST
+def api_device_token_revoke(request):
+    # the device gives up its own token, or with all=1 every token of its tourist
+    token = device_auth.bearer(request)
+    if token is None:
+        return device_auth.unauthorized("bearer token required")
+    try:
+        claims = device_auth.verify(token)
+    except device_auth.InvalidToken as e:
+        return device_auth.unauthorized(str(e))
+    if request.POST.get('all') or request.GET.get('all'):
+        device_auth.revoke_user(claims['u'])
+    else:
+        device_auth.revoke(claims)
+    return JsonResponse({'ok': True})
 
 
 @login_required
@@ -151,170 +234,411 @@ def police_home(request):
 
 
 def logout_view(request):
+    token = request.session.get('device_token')
+    if token:
+        try:
+            device_auth.revoke(device_auth.verify(token))
+        except device_auth.InvalidToken:
+            pass
     logout(request)
     return redirect('login')
 # accounts/views.py (append)
+from datetime import timezone as dt_timezone
 from django.core.serializers import serialize
+from django.db.models import Count, Max, Q
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from .realtime import get_broker
 from django.views.decorators.http import require_GET
 from django.utils.timezone import now
 
+# an event written just before a poll may commit after it; deltas re-send
+# this much history so such late commits are not missed (clients upsert by id)
+SOS_FEED_OVERLAP = timezone.timedelta(seconds=getattr(settings, 'SOS_FEED_CURSOR_OVERLAP', 2))
+SOS_FEED_LIMIT = 200
+
+
+def _feed_cursor(ts):
+    if ts is None:
+        return '0'
+    delta = ts - timezone.datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    return str((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+
+def _parse_feed_cursor(value):
+    # -> (timestamp, pk or None); "<micros>.<pk>" continues a truncated page
+    micros, _, after_pk = value.partition('.')
+    return _cursor_time(micros), int(after_pk) if after_pk else None
+
+
+def _cursor_time(value):
+    micros = int(value)
+    if micros < 0:
+        raise ValueError("negative cursor")
+    # integer arithmetic: a float round-trip could shift the cursor by a microsecond
+    return timezone.datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timezone.timedelta(microseconds=micros)
+
+
+def _serialize_sos(e):
+    last_loc = getattr(e.tourist, 'last_position', None)
+    return {
+        'sos_id': e.id,
+        'tourist_username': e.tourist.username,
+        'tourist_full_name': getattr(e.tourist, 'tourist_profile').full_name if hasattr(e.tourist, 'tourist_profile') else '',
+        'created_at': e.created_at.isoformat(),
+        'updated_at': e.updated_at.isoformat(),
+        'lat': e.lat or (last_loc.latitude if last_loc else None),
+        'lon': e.lon or (last_loc.longitude if last_loc else None),
+        'audio_files': [_audio_url(a) for a in e.audios.all()],
+    }
+
+
+def _audio_url(audio):
+    # the growing per-SOS recording is served through the Range-aware view
+    if audio.is_recording:
+        return reverse('sos_recording_playback', args=[audio.sos_event_id])
+    return audio.file.url
+
+
 @require_GET
 @login_required
 def api_active_sos(request):
+    """
+    Police SOS feed. Without `since` it returns a full snapshot of active
+    events. With `since` (the `cursor` of a previous response) it returns
+    only events changed after it, oldest change first, plus `active_ids` so
+    the client can drop deactivated or deleted ones. A delta of more than
+    SOS_FEED_LIMIT events is paged: the response has `more` set and a cursor
+    just past its last event, and the client asks again right away.
+    Unchanged state is answered with a 304.
+    """
     # Only police can fetch this
     if not request.user.is_police():
         return HttpResponseForbidden("Only police can access SOS events.")
-    # get active SOS events (optionally filter recent)
-    events = SOSEvent.objects.filter(is_active=True).select_related('tourist').prefetch_related('audios').order_by('-created_at')[:200]
-    out = []
+    state = SOSEvent.objects.aggregate(latest=Max('updated_at'), total=Count('pk'))
+    cursor = _feed_cursor(state['latest'])
+    etag = '"sos-%s-%d"' % (cursor, state['total'])
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    since = request.GET.get('since')
+    if since:
+        try:
+            since, after_pk = _parse_feed_cursor(since)
+        except (ValueError, OverflowError, OSError):
+            return HttpResponseBadRequest("Bad cursor")
+
+    # profile and last known position come in the same join so the query
+    # count does not grow per event
+    events = (SOSEvent.objects.filter(is_active=True)
+              .select_related('tourist', 'tourist__tourist_profile', 'tourist__last_position')
+              .prefetch_related(Prefetch('audios', queryset=SOSAudio.objects.order_by('uploaded_at'))))
+    more = False
+    if since:
+        if after_pk is None:
+            events = events.filter(updated_at__gt=since - SOS_FEED_OVERLAP)
+        else:
+            # next page: exactly after the last event sent, so a burst of equal timestamps cannot repeat
+            events = events.filter(Q(updated_at__gt=since) | Q(updated_at=since, pk__gt=after_pk))
+        events = list(events.order_by('updated_at', 'pk')[:SOS_FEED_LIMIT + 1])
+        more = len(events) > SOS_FEED_LIMIT
+        events = events[:SOS_FEED_LIMIT]
+        if more:
+            cursor = f'{_feed_cursor(events[-1].updated_at)}.{events[-1].pk}'
+    else:
+        events = events.order_by('-created_at')[:SOS_FEED_LIMIT]
+    body = {'events': [_serialize_sos(e) for e in events], 'cursor': cursor, 'full': not since}
+    if more:
+        body['more'] = True
+    if since:
+        body['active_ids'] = list(SOSEvent.objects.filter(is_active=True).order_by('-created_at')
+                                  .values_list('pk', flat=True)[:SOS_FEED_LIMIT])
+    response = JsonResponse(body)
+    if not more:
+        # a partial page must not let the client's next request end in a 304
+        response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+from .models import CustomUser
+from . import proximity
+
+NEARBY_DEFAULT_RADIUS_M = 1000
+NEARBY_MAX_RADIUS_M = getattr(settings, 'PROXIMITY_MAX_RADIUS_M', 50_000)
+NEARBY_MAX_K = 200
+NEARBY_DEFAULT_MAX_AGE = timezone.timedelta(minutes=30)
+
+
+@require_GET
+@login_required
+def api_sos_nearby(request, sos_id):
+    """
+    Other tourists near an SOS, nearest first: those within `radius_m`
+    (default 1000), or with `k` the k nearest within it. Positions older
+    than `max_age_minutes` (default 30) are left out.
+    """
+    if not request.user.is_police():
+        return HttpResponseForbidden("Only police can access SOS events.")
+    try:
+        radius_m = float(request.GET.get('radius_m', NEARBY_DEFAULT_RADIUS_M))
+        k = int(request.GET['k']) if 'k' in request.GET else None
+        max_age = (timezone.timedelta(minutes=float(request.GET['max_age_minutes']))
+                   if 'max_age_minutes' in request.GET else NEARBY_DEFAULT_MAX_AGE)
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest("Bad radius_m, k or max_age_minutes")
+    if not 0 < radius_m <= NEARBY_MAX_RADIUS_M or (k is not None and not 0 < k <= NEARBY_MAX_K):
+        return HttpResponseBadRequest(f"radius_m must be in (0, {NEARBY_MAX_RADIUS_M}], k in [1, {NEARBY_MAX_K}]")
+    try:
+        sos = SOSEvent.objects.select_related('tourist__last_position').get(pk=sos_id)
+    except SOSEvent.DoesNotExist:
+        raise Http404("SOS event not found.")
+    last = getattr(sos.tourist, 'last_position', None)
+    lat = sos.lat if sos.lat is not None else (last.latitude if last else None)
+    lon = sos.lon if sos.lon is not None else (last.longitude if last else None)
+    if lat is None or lon is None:
+        return JsonResponse({'sos_id': sos.id, 'center': None, 'tourists': []})
+
+    live = proximity.get_live_positions()
+    query = dict(since=timezone.now() - max_age, exclude={sos.tourist_id})
+    if k is None:
+        hits = live.within(lat, lon, radius_m, **query)
+    else:
+        hits = live.nearest(lat, lon, k, max_radius_m=radius_m, **query)
+    users = CustomUser.objects.select_related('tourist_profile').in_bulk([hit[1] for hit in hits])
+    tourists = []
+    for distance, tourist_id, t_lat, t_lon, ts in hits:
+        user = users.get(tourist_id)
+        if user is None:
+            continue
+        profile = getattr(user, 'tourist_profile', None)
+        tourists.append({
+            'tourist_id': tourist_id,
+            'tourist_username': user.username,
+            'tourist_full_name': profile.full_name if profile else '',
+            'distance_m': round(distance, 1),
+            'lat': t_lat,
+            'lon': t_lon,
+            'last_seen': ts.isoformat(),
+        })
+    return JsonResponse({'sos_id': sos.id, 'center': {'lat': lat, 'lon': lon}, 'radius_m': radius_m, 'tourists': tourists})
+
+
+from . import tiles
+
+
+@require_GET
+@login_required
+def api_map_clusters(request):
+    """
+    Tourist and active SOS counts per geohash cell for the police map.
+    `bbox` is the viewport as west,south,east,north (Leaflet's
+    toBBoxString; west > east when it crosses the antimeridian) and `zoom`
+    the map zoom, which picks the cell size.
+    """
+    if not request.user.is_police():
+        return HttpResponseForbidden("Only police can access the map.")
+    try:
+        west, south, east, north = (float(v) for v in request.GET['bbox'].split(','))
+        zoom = int(request.GET['zoom'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("bbox=west,south,east,north and zoom are required")
+    if not (-90 <= south <= north <= 90 and 0 <= zoom <= 30 and all(math.isfinite(v) for v in (west, east))):
+        return HttpResponseBadRequest("Bad bbox or zoom")
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    bbox = (south, west, north, east)
+    precision = tiles.precision_for(zoom, *bbox)
+    return JsonResponse({
+        'precision': precision,
+        'tourists': proximity.get_live_positions().clusters(precision, *bbox),
+        'sos': tiles.sos_tiles().clusters(precision, *bbox),
+    })
+
+
+from .models import GeofenceEvent
+
+GEOFENCE_FEED_LIMIT = 200
+
+
+@require_GET
+@login_required
+def api_geofence_events(request):
+    """
+    Danger-zone transitions (enter, dwell, exit), oldest first. `after` is
+    the `cursor` of a previous response; without it the latest
+    GEOFENCE_FEED_LIMIT are returned.
+    """
+    if not request.user.is_police():
+        return HttpResponseForbidden("Only police can access geofence events.")
+    events = GeofenceEvent.objects.select_related('tourist__tourist_profile')
+    after = request.GET.get('after')
+    if after:
+        try:
+            events = events.filter(pk__gt=int(after)).order_by('pk')[:GEOFENCE_FEED_LIMIT]
+        except ValueError:
+            return HttpResponseBadRequest("Bad cursor")
+    else:
+        events = reversed(events.order_by('-pk')[:GEOFENCE_FEED_LIMIT])
+    body = []
     for e in events:
-        # get last 1 location for this tourist (most recent)
-        last_loc = Location.objects.filter(tourist=e.tourist).order_by('-timestamp').first()
-        out.append({
-            'sos_id': e.id,
+        profile = getattr(e.tourist, 'tourist_profile', None)
+        body.append({
+            'id': e.id,
+            'kind': e.kind,
+            'tourist_id': e.tourist_id,
             'tourist_username': e.tourist.username,
-            'tourist_full_name': getattr(e.tourist, 'tourist_profile').full_name if hasattr(e.tourist, 'tourist_profile') else '',
-            'created_at': e.created_at.isoformat(),
-            'lat': e.lat or (last_loc.latitude if last_loc else None),
-            'lon': e.lon or (last_loc.longitude if last_loc else None),
-            'audio_files': [a.file.url for a in e.audios.all().order_by('uploaded_at')],
+            'tourist_full_name': profile.full_name if profile else '',
+            'zone_id': e.zone_id,
+            'zone_name': e.zone_name,
+            'lat': e.lat,
+            'lon': e.lon,
+            'at': e.at.isoformat(),
         })
-    return JsonResponse({'events': out})
+    return JsonResponse({'events': body, 'cursor': body[-1]['id'] if body else int(after or 0)})
+
+
+from django.core.handlers.asgi import ASGIRequest
+
+SOS_STREAM_HEARTBEAT = getattr(settings, 'SOS_STREAM_HEARTBEAT', 15)
+
+
+@require_GET
+async def sos_stream(request):
+    """
+    Server-Sent Events stream of SOS lifecycle events (created, updated,
+    deactivated, audio). Events only carry ids and a cursor hint; consoles
+    pull the details from the api_active_sos delta feed. Only served under
+    the ASGI entry point: WSGI reads a streamed async iterator to the end
+    before sending anything, so there it answers 204, which tells
+    EventSource not to reconnect, and consoles keep polling.
+    """
+    user = await request.auser()
+    if not user.is_authenticated or not user.is_police():
+        return HttpResponseForbidden("Only police can access SOS events.")
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_sos_event_stream(get_broker()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
+
+
+async def _sos_event_stream(broker):
+    async with broker.listen() as listener:
+        yield "retry: 3000\n\n"
+        while True:
+            event = await listener.get(timeout=SOS_STREAM_HEARTBEAT)
+            if event is None:
+                # comment line keeps proxies from closing an idle connection
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
 
 # accounts/views.py (append)
-from io import BytesIO
-from django.http import HttpResponse, Http404
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from . import fir
+
+
+def _fir_sos(sos_id):
+    try:
+        return SOSEvent.objects.select_related('tourist', 'tourist__tourist_profile').get(pk=sos_id)
+    except SOSEvent.DoesNotExist:
+        raise Http404("SOS event not found.")
+
+
+def _fir_job(request, sos_id, sos=None, key=None):
+    # -> (sos, inputs, digest); collecting reads the trail, so the digest is remembered
+    sos = sos or _fir_sos(sos_id)
+    inputs = fir.collect_inputs(sos, request.user)
+    digest = fir.inputs_hash(inputs)
+    fir.remember_digest(key or fir.digest_key(sos, request.user), digest)
+    return sos, inputs, digest
+
 
 def generate_fir_pdf(request, sos_id):
+    """
+    Serve the FIR PDF from the artifact cache, or queue its render and
+    answer 202: JSON with a status URL for API clients, a self-refreshing
+    page for browsers following the dashboard link.
+    """
     # Only police can generate FIR PDFs
     if not request.user.is_authenticated or not request.user.is_police():
         return HttpResponse(status=403, content="Forbidden: police access only.")
 
-    try:
-        sos = SOSEvent.objects.select_related('tourist').get(pk=sos_id)
-    except SOSEvent.DoesNotExist:
-        raise Http404("SOS event not found.")
+    sos = _fir_sos(sos_id)
+    runner = fir.get_runner()
+    key = fir.digest_key(sos, request.user)
+    digest = fir.remembered_digest(key)
+    state = runner.status(sos.id, digest)[0] if digest else None
+    if state in (None, fir.FAILED):
+        # not rendered from these sources yet, evicted, or failed: collect and (re)submit
+        sos, inputs, digest = _fir_job(request, sos_id, sos, key)
+        job = runner.submit(inputs, digest)
+        if job.done() and job.exception() is not None:
+            return HttpResponse(status=500, content=f"FIR rendering failed: {job.exception()}")
+    # rendered inline, finished earlier, or still pending (None)
+    artifact = fir.open_artifact(sos.id, digest)
+    if artifact is not None:
+        response = FileResponse(artifact, content_type='application/pdf', as_attachment=True, filename=f"FIR_SOS_{sos.id}.pdf")
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+    status_url = reverse('fir_pdf_status', args=[sos.id])
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'status': fir.PENDING, 'status_url': status_url,
+                             'download_url': request.path}, status=202)
+    return HttpResponse(
+        '<meta http-equiv="refresh" content="2">Generating FIR PDF, this page will refresh&hellip;',
+        status=202,
+    )
 
-    # Gather tourist information (sensitive data; police-only)
-    tourist_user = sos.tourist
-    tp = None
-    try:
-        tp = tourist_user.tourist_profile
-    except Exception:
-        tp = None
-
-    # Gather recent locations for this SOS: last 10 minutes or related to the created_at
-    # We'll take up to 50 most recent locations for context
-    from django.utils import timezone
-    ten_min_ago = sos.created_at - timezone.timedelta(minutes=10)
-    locations = list(Location.objects.filter(tourist=tourist_user, timestamp__gte=ten_min_ago).order_by('timestamp')[:200])
-
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=40, rightMargin=40, topMargin=40, bottomMargin=40)
-    styles = getSampleStyleSheet()
-    normal = styles['Normal']
-    heading = styles['Heading1']
-    small = ParagraphStyle('small', parent=normal, fontSize=9, leading=11)
-
-    elements = []
-
-    # Header
-    elements.append(Paragraph("DIGITAL FIR - EMERGENCY SOS REPORT", heading))
-    elements.append(Spacer(1, 12))
-
-    # Meta
-    elements.append(Paragraph(f"<b>FIR ID:</b> {sos.id}", normal))
-    elements.append(Paragraph(f"<b>Generated by (police):</b> {request.user.get_full_name() or request.user.username}", normal))
-    elements.append(Paragraph(f"<b>FIR Created At:</b> {sos.created_at.strftime('%Y-%m-%d %H:%M:%S %Z')}", normal))
-    elements.append(Spacer(1, 12))
-
-    # Tourist info block
-    elements.append(Paragraph("<b>Tourist Information</b>", styles['Heading2']))
-    t_rows = []
-    t_rows.append(["Username", tourist_user.username])
-    if tp:
-        t_rows.append(["Full name", tp.full_name])
-        t_rows.append(["Age", str(tp.age)])
-        t_rows.append(["Phone", tp.phone_number])
-        # Aadhaar/passport are sensitive; only included because police requested FIR
-        t_rows.append(["Aadhaar / National ID", tp.aadhaar_number or ""])
-        t_rows.append(["Passport ID", tp.passport_id or ""])
-        t_rows.append(["Entry Date", tp.entry_date.isoformat()])
-        t_rows.append(["Leave Date", tp.leave_date.isoformat()])
-    else:
-        t_rows.append(["Profile", "No tourist profile data available."])
-
-    t_table = Table(t_rows, colWidths=[140, 340])
-    t_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-        ('BOX', (0,0), (-1,-1), 0.25, colors.black),
-        ('INNERGRID', (0,0), (-1,-1), 0.25, colors.grey),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('LEFTPADDING', (0,0), (-1,-1), 6),
-        ('RIGHTPADDING', (0,0), (-1,-1), 6),
-    ]))
-    elements.append(t_table)
-    elements.append(Spacer(1, 12))
-
-    # SOS summary
-    elements.append(Paragraph("<b>SOS Event Summary</b>", styles['Heading2']))
-    elements.append(Paragraph(f"<b>SOS Created at:</b> {sos.created_at.strftime('%Y-%m-%d %H:%M:%S %Z')}", normal))
-    if sos.lat and sos.lon:
-        elements.append(Paragraph(f"<b>Reported Location (summary):</b> {sos.lat}, {sos.lon}", normal))
-    if sos.description:
-        elements.append(Paragraph(f"<b>Description:</b> {sos.description}", normal))
-    elements.append(Spacer(1, 12))
-
-    # Locations table
-    elements.append(Paragraph("<b>Recent Location Points (chronological)</b>", styles['Heading3']))
-    if locations:
-        loc_table_data = [["#", "Timestamp (ISO)", "Latitude", "Longitude", "Accuracy (m)"]]
-        for i, loc in enumerate(locations, start=1):
-            loc_table_data.append([
-                str(i),
-                loc.timestamp.astimezone().isoformat(),
-                f"{loc.latitude:.6f}",
-                f"{loc.longitude:.6f}",
-                f"{loc.accuracy if loc.accuracy is not None else ''}"
-            ])
-        # Try to keep the table width reasonable
-        loc_table = Table(loc_table_data, colWidths=[30, 160, 90, 90, 90])
-        loc_table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f0f0f0')),
-            ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-            ('FONTSIZE', (0,0), (-1,-1), 9),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ]))
-        elements.append(loc_table)
-    else:
-        elements.append(Paragraph("No recent location points found for the 10 minutes before the SOS creation.", normal))
 
-    elements.append(Spacer(1, 16))
+@require_GET
+def fir_pdf_status(request, sos_id):
+    if not request.user.is_authenticated or not request.user.is_police():
+        return HttpResponse(status=403, content="Forbidden: police access only.")
+    sos = _fir_sos(sos_id)
+    digest = fir.remembered_digest(fir.digest_key(sos, request.user))
+    state, error = fir.get_runner().status(sos.id, digest) if digest else (None, None)
+    body = {'status': state or 'missing', 'download_url': reverse('generate_fir_pdf', args=[sos.id])}
+    if error:
+        body['error'] = error
+    return JsonResponse(body)
+
 
-    # Footer / signature placeholder
-    elements.append(Paragraph("Statement:", styles['Heading3']))
-    elements.append(Paragraph("This digital FIR was generated automatically from the SOS event record stored in the Tourist Safety System. For any further verification, please contact the station.", small))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph("Signature (Police Officer): ______________________", normal))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(f"Station: {getattr(request.user, 'police_profile').station_name if hasattr(request.user, 'police_profile') else ''}", small))
+@require_GET
+def ingest_stats(request):
+    # this worker's write-behind queue: depth, flush sizes, lag, rejections
+    if not request.user.is_authenticated or not request.user.is_police():
+        return HttpResponseForbidden("Only police can access ingestion metrics.")
+    return JsonResponse(writebehind.stats())
 
-    # Build the PDF
-    doc.build(elements)
 
-    pdf = buffer.getvalue()
-    buffer.close()
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+WRITE_BEHIND_GAUGES = {
+    'depth': "Location points queued or awaiting a retried flush.",
+    'lag_seconds': "Age of the oldest unflushed location point.",
+    'last_flush_rows': "Rows in the last write-behind flush.",
+    'last_flush_seconds': "Duration of the last write-behind flush.",
+    'rejected': "Location points turned away because the queue was full.",
+    'failures': "Failed write-behind flushes.",
+    'dead_lettered': "Location points moved to the dead-letter journal after repeated failures.",
+}
 
-    filename = f"FIR_SOS_{sos.id}.pdf"
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    response.write(pdf)
-    return response
+
+@require_GET
+def metrics(request):
+    # police/staff sessions, or a scraper presenting METRICS_TOKEN as a bearer token
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not (METRICS_TOKEN and token == METRICS_TOKEN) and not (
+            request.user.is_authenticated and (request.user.is_police() or request.user.is_staff)):
+        return HttpResponseForbidden("Only police can access metrics.")
+    queue = writebehind.stats()
+    gauges = {f'location_write_behind_{key}': (queue[key], help_text)
+              for key, help_text in WRITE_BEHIND_GAUGES.items() if key in queue}
+    return HttpResponse(metrics_registry.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -350,19 +674,121 @@ def upload_sos_audio(request, sos_id):
         "audio_id": sos_audio.id,
         "file_url": sos_audio.file.url
     })
+from . import recording
+from django.views.decorators.http import require_http_methods
+
+
+def _upload_error(e):
+    response = JsonResponse({"error": str(e), "offset": e.offset}, status=e.status)
+    if e.offset is not None:
+        response['Upload-Offset'] = str(e.offset)
+    return response
+
+
+@require_http_methods(["HEAD", "GET", "PATCH"])
+@login_required
+def sos_recording(request, sos_id):
+    """
+    Resumable audio upload for an SOS. HEAD/GET report the committed offset;
+    PATCH appends the raw request body at Upload-Offset, optionally verified
+    against "Upload-Checksum: sha256 <base64>". After a failure the client
+    asks for the offset and resends only what is missing.
+    """
+    if not request.user.is_tourist():
+        return JsonResponse({"error": "Only tourists can upload audio."}, status=403)
+    try:
+        sos = SOSEvent.objects.get(id=sos_id, tourist=request.user)
+    except SOSEvent.DoesNotExist:
+        return JsonResponse({"error": "SOS not found"}, status=404)
+
+    if request.method == "PATCH":
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            length = int(request.headers["Content-Length"]) if request.headers.get("Content-Length") else None
+        except ValueError:
+            return JsonResponse({"error": "Upload-Offset and Content-Length must be integers"}, status=400)
+        try:
+            checksum = recording.parse_checksum(request.headers.get("Upload-Checksum"))
+            # read from the request stream block by block; request.body is never built
+            new_offset = recording.append_chunk(sos, offset, request, length, checksum)
+        except recording.UploadError as e:
+            return _upload_error(e)
+        response = HttpResponse(status=204)
+        response['Upload-Offset'] = str(new_offset)
+        return response
+
+    audio = recording.get_recording(sos)
+    body = {"offset": audio.size if audio else 0, "finalized": bool(audio and audio.finalized_at)}
+    response = JsonResponse(body)
+    response['Upload-Offset'] = str(body["offset"])
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@require_POST
+@login_required
+def sos_recording_finalize(request, sos_id):
+    if not request.user.is_tourist():
+        return JsonResponse({"error": "Only tourists can upload audio."}, status=403)
+    try:
+        sos = SOSEvent.objects.get(id=sos_id, tourist=request.user)
+        data = json.loads(request.body)
+        size = int(data["size"])
+    except SOSEvent.DoesNotExist:
+        return JsonResponse({"error": "SOS not found"}, status=404)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "expected {size, sha256}"}, status=400)
+    try:
+        audio = recording.finalize(sos, size, data.get("sha256"))
+    except recording.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse({"status": "ok", "audio_id": audio.id, "size": audio.size, "sha256": audio.sha256})
+
+
+@require_http_methods(["GET", "HEAD"])
+@login_required
+def sos_recording_playback(request, sos_id):
+    """Police playback with Range support; only committed bytes are served."""
+    if not request.user.is_police():
+        return HttpResponseForbidden("Only police can access SOS audio.")
+    audio = SOSAudio.objects.filter(sos_event_id=sos_id, is_recording=True).first()
+    if audio is None or not audio.size:
+        raise Http404("No recording.")
+    size = audio.size
+    try:
+        byte_range = recording.parse_range(request.headers.get("Range"), size)
+    except recording.UploadError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(recording.iter_file_range(recording.recording_path(audio), start, end),
+                                     status=206 if byte_range else 200, content_type="audio/webm")
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Length'] = str(end - start + 1)
+    if byte_range:
+        # while recording, the total is still growing
+        response['Content-Range'] = f"bytes {start}-{end}/{size if audio.finalized_at else '*'}"
+    response['Cache-Control'] = 'private, no-cache' if audio.finalized_at is None else 'private, max-age=3600'
+    return response
+
+
 # accounts/views.py (inside get_sos_events)
 def get_sos_events(request):
     if not request.user.is_police():
         return JsonResponse({"error": "Forbidden"}, status=403)
 
-    events = SOSEvent.objects.select_related("tourist").prefetch_related("audios").order_by("-created_at")[:50]
+    # profile joined and audio prefetched in order: a fixed number of queries for any page
+    events = (SOSEvent.objects.select_related("tourist", "tourist__tourist_profile")
+              .prefetch_related(Prefetch("audios", queryset=SOSAudio.objects.order_by("uploaded_at")))
+              .order_by("-created_at")[:50])
 
     data = []
     for ev in events:
         # try full name, fallback to username
         try:
             name = ev.tourist.tourist_profile.full_name
-        except:
+        except TouristProfile.DoesNotExist:
             name = ev.tourist.username
         data.append({
             "sos_id": ev.id,
@@ -370,28 +796,19 @@ def get_sos_events(request):
             "lat": ev.lat,
             "lon": ev.lon,
             "created_at": ev.created_at.isoformat(),
-            "audio_files": [a.file.url for a in ev.audios.order_by("uploaded_at")],
+            "audio_files": [a.file.url for a in ev.audios.all()],
         })
     return JsonResponse({"events": data})
 
-import math
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from .models import DangerZone
+from .geo import haversine, get_zone_index, zone_list_body, zone_set_state
 
-def haversine(lat1, lon1, lat2, lon2):
-    # returns distance in meters
-    R = 6371000
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-def is_in_danger(lat, lon):
-    for zone in DangerZone.objects.all():
-        d = haversine(lat, lon, zone.center_lat, zone.center_lon)
-        if d <= zone.radius_m:
-            return zone
-    return None
+def is_in_danger(lat, lon, at=None):
+    # only the zones whose bounding box covers the point's grid cell, and that are active at `at`
+    # (default now) by their schedule, are tested
+    return get_zone_index().find(lat, lon, at)
 
 # accounts/views.py
 from django.views.decorators.csrf import csrf_exempt
@@ -406,26 +823,38 @@ def update_location(request):
     lat = float(request.POST.get("lat"))
     lon = float(request.POST.get("lon"))
 
-    # Save location (optional: keep history)
-    profile = request.user.tourist_profile
-    profile.last_lat = lat
-    profile.last_lon = lon
-    profile.last_updated = now()
-    profile.save()
-
-    # Check geofence
-    zone = is_in_danger(lat, lon)
-    if zone:
-        return JsonResponse({"status": "ok", "alert": f"You are entering danger zone: {zone.name}"})
+    # keep the tourist's last known position current (no history kept here)
+    point = (0, lat, lon, None, now())
+    queue = writebehind.get_queue()
+    if queue is not None:
+        try:
+            queue.submit(request.user.pk, [point], history=False)
+        except writebehind.QueueFull:
+            return _queue_full()
     else:
-        return JsonResponse({"status": "ok"})
+        record_last_position(request.user, [point])
 
+    # alerts only on entering, dwelling in or leaving a zone
+    return JsonResponse(_with_alert({"status": "ok"}, geofence.observe(request.user.pk, [point])))
+
+ZONES_MAX_AGE = getattr(settings, 'ZONES_MAX_AGE', 0)
+
+
+@require_GET
 def get_zones(request):
-    zones = DangerZone.objects.all()
-    return JsonResponse({"zones": [
-        {"name": z.name, "lat": z.center_lat, "lon": z.center_lon, "radius_m": z.radius_m}
-        for z in zones
-    ]})
+    # served from the per-version cached body; a matching If-None-Match /
+    # If-Modified-Since is answered without touching the database
+    version, updated_at = zone_set_state()
+    etag = f'"zones-{version}"'
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(zone_list_body(version, updated_at), content_type='application/json')
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=ZONES_MAX_AGE, must_revalidate=True)
+    return response
 
 # accounts/views.py
 from django.shortcuts import render, redirect, get_object_or_404
@@ -437,7 +866,11 @@ from .models import DangerZone
 def dangerzone_list(request):
     if not request.user.is_police():
         return redirect("home")
-    zones = DangerZone.objects.all()
+    zones = list(DangerZone.objects.all())
+    timeline = get_zone_index().timeline
+    active = timeline.active()
+    for zone in zones:
+        zone.active_now = timeline.is_active(zone.pk, active=active)
     return render(request, "accounts/dangerzone_list.html", {"zones": zones})
 
 @login_required
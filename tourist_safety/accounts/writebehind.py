@@ -0,0 +1,320 @@
+# accounts/writebehind.py
+# Optional write-behind ingestion for location pings (LOCATION_WRITE_BEHIND).
+# Validated points are journaled and put on a bounded in-process queue; a
+# flusher thread bulk-inserts them every FLUSH_MS or once FLUSH_ROWS are
+# waiting, so request latency no longer includes the database write.
+# The journal is a set of append-only JSON-lines segments: the active one
+# receives every accepted point, it is rotated when a batch is drained and
+# deleted once that batch has committed. Segments left behind by a crashed
+# process are replayed (and de-duplicated) on the next start. A batch that
+# still fails after MAX_ATTEMPTS writes is moved, segment and all, to the
+# dead-letter directory so the batches behind it can go through; it can be
+# replayed from there with `replay_location_journal --journal <dir>`.
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .ingest import record_last_position
+from .models import CustomUser, Location
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks: assume one writer process per journal dir
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'LOCATION_WRITE_BEHIND', False)
+FLUSH_MS = getattr(settings, 'LOCATION_WRITE_BEHIND_FLUSH_MS', 200)
+FLUSH_ROWS = getattr(settings, 'LOCATION_WRITE_BEHIND_FLUSH_ROWS', 500)
+MAX_QUEUE = getattr(settings, 'LOCATION_WRITE_BEHIND_MAX_QUEUE', 10_000)
+# how long a request may wait for room before it is turned away with a 503
+ENQUEUE_TIMEOUT = getattr(settings, 'LOCATION_WRITE_BEHIND_ENQUEUE_TIMEOUT', 0.05)
+JOURNAL_DIR = getattr(settings, 'LOCATION_WRITE_BEHIND_JOURNAL',
+                      os.path.join(settings.BASE_DIR, 'var', 'location_journal'))
+# write() alone survives a process crash; fsync also survives losing the host
+JOURNAL_FSYNC = getattr(settings, 'LOCATION_WRITE_BEHIND_FSYNC', False)
+MAX_ATTEMPTS = getattr(settings, 'LOCATION_WRITE_BEHIND_MAX_ATTEMPTS', 10)
+DEAD_LETTER_DIR = 'dead-letter'
+RETRY_SECONDS = 1.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _entry(tourist_id, point, history):
+    _, lat, lon, accuracy, ts = point
+    # UTC so replay can match rows read back from the database
+    return [tourist_id, lat, lon, accuracy, ts.astimezone(dt_timezone.utc).isoformat(), history]
+
+
+def _open_locked(path, mode):
+    f = open(path, mode)
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+
+def write_entries(entries):
+    """Insert journal entries: Location rows for history points, then last positions. -> rows inserted."""
+    rows = [Location(tourist_id=t, latitude=lat, longitude=lon, accuracy=acc, timestamp=datetime.fromisoformat(ts))
+            for t, lat, lon, acc, ts, history in entries if history]
+    latest = {}
+    for t, lat, lon, acc, ts, _ in entries:
+        latest.setdefault(t, []).append((0, lat, lon, acc, datetime.fromisoformat(ts)))
+    with transaction.atomic():
+        Location.objects.bulk_create(rows)
+        for tourist_id, points in latest.items():
+            record_last_position(CustomUser(pk=tourist_id), points)
+    return len(rows)
+
+
+def _dedupe(entries):
+    # a segment may have committed just before the crash that left it behind
+    keys = {(t, ts) for t, _, _, _, ts, history in entries if history}
+    if not keys:
+        return entries
+    stamps = [datetime.fromisoformat(ts) for _, ts in keys]
+    existing = set(Location.objects
+                   .filter(tourist_id__in={t for t, _ in keys}, timestamp__gte=min(stamps), timestamp__lte=max(stamps))
+                   .values_list('tourist_id', 'timestamp', 'latitude', 'longitude'))
+    existing = {(t, ts.isoformat(), lat, lon) for t, ts, lat, lon in existing}
+    return [e for e in entries if not (e[5] and (e[0], e[4], e[1], e[2]) in existing)]
+
+
+def replay(journal_dir=None):
+    """Insert the contents of abandoned journal segments and delete them. -> (segments, rows)."""
+    journal_dir = journal_dir or JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return 0, 0
+    segments = rows = 0
+    for name in sorted(os.listdir(journal_dir)):
+        if not name.endswith('.jsonl'):
+            continue
+        path = os.path.join(journal_dir, name)
+        f = _open_locked(path, 'r')
+        if f is None:
+            continue  # still owned by a live process
+        with f:
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break  # torn final line from the crash
+            rows += write_entries(_dedupe(entries))
+        os.unlink(path)
+        segments += 1
+    return segments, rows
+
+
+class WriteBehindQueue:
+    def __init__(self, journal_dir=None, flush_ms=FLUSH_MS, flush_rows=FLUSH_ROWS, max_queue=MAX_QUEUE,
+                 enqueue_timeout=ENQUEUE_TIMEOUT, fsync=JOURNAL_FSYNC, max_attempts=MAX_ATTEMPTS, start=True):
+        self.journal_dir = journal_dir or JOURNAL_DIR
+        self.flush_interval = flush_ms / 1000.0
+        self.flush_rows = flush_rows
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self._queue = deque()  # (enqueued_at, entry)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = []  # drained batches awaiting a successful write: (segment path, file, entries, oldest)
+        self._pending_rows = 0
+        self._attempts = 0  # failed writes of the oldest pending batch
+        self._journal = self._journal_path = None
+        self._closed = False
+        self._thread = None
+        self.enqueued = self.flushed = self.flushes = self.rejected = self.failures = self.dead_lettered = 0
+        self.peak_depth = self.last_flush_rows = self.max_flush_rows = 0
+        self.last_flush_seconds = self.last_lag_seconds = 0.0
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.replayed = replay(self.journal_dir)
+        self._rotate()
+        if start:
+            self._thread = threading.Thread(target=self._run, name='location-write-behind', daemon=True)
+            self._thread.start()
+
+    def _rotate(self):
+        # called with _cond held (or before the flusher starts)
+        previous = (self._journal_path, self._journal)
+        self._journal_path = os.path.join(self.journal_dir, f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.jsonl")
+        self._journal = _open_locked(self._journal_path, 'a')
+        return previous
+
+    def submit(self, tourist_id, points, history=True):
+        """Journal and enqueue validated (index, lat, lon, accuracy, ts) points; raises QueueFull."""
+        if not points:
+            return
+        entries = [_entry(tourist_id, p, history) for p in points]
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            if self._closed:
+                raise QueueFull("location queue is closed")
+            # batches stuck behind a failing database count too
+            while len(self._queue) + self._pending_rows + len(entries) > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += len(entries)
+                    raise QueueFull("location queue is full")
+                self._cond.notify_all()  # wake the flusher early
+                self._cond.wait(remaining)
+            self._journal.write(''.join(json.dumps(e) + '\n' for e in entries))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            now = time.monotonic()
+            self._queue.extend((now, e) for e in entries)
+            self.enqueued += len(entries)
+            self.peak_depth = max(self.peak_depth, len(self._queue))
+            if len(self._queue) >= self.flush_rows:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Write out everything queued so far. -> rows written (0 if the write failed and will be retried)."""
+        with self._flush_lock:
+            with self._cond:
+                if self._queue:
+                    oldest = self._queue[0][0]
+                    entries = [e for _, e in self._queue]
+                    self._queue.clear()
+                    path, journal = self._rotate()
+                    self._pending.append((path, journal, entries, oldest))
+                    self._pending_rows += len(entries)
+            written = 0
+            while self._pending:
+                path, journal, entries, oldest = self._pending[0]
+                started = time.perf_counter()
+                try:
+                    write_entries(entries)
+                except Exception:
+                    self.failures += 1
+                    self._attempts += 1
+                    if self._attempts < self.max_attempts:
+                        logger.exception("write-behind flush of %d points failed; will retry", len(entries))
+                        return written
+                    self._release()
+                    self._dead_letter(path, journal, len(entries))
+                    continue
+                self._release()
+                journal.close()
+                os.unlink(path)
+                self.flushes += 1
+                self.flushed += len(entries)
+                self.last_flush_rows = len(entries)
+                self.max_flush_rows = max(self.max_flush_rows, len(entries))
+                self.last_flush_seconds = time.perf_counter() - started
+                self.last_lag_seconds = time.monotonic() - oldest
+                written += len(entries)
+            return written
+
+    def _release(self):
+        # drop the oldest pending batch from the queue's accounting
+        _, _, entries, _ = self._pending.pop(0)
+        self._attempts = 0
+        with self._cond:
+            self._pending_rows -= len(entries)
+            self._cond.notify_all()  # room for blocked submitters
+
+    def _dead_letter(self, path, journal, rows):
+        journal.close()
+        target_dir = os.path.join(self.journal_dir, DEAD_LETTER_DIR)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.basename(path))
+        os.replace(path, target)
+        self.dead_lettered += rows
+        logger.exception("write-behind batch of %d points failed %d times; moved to %s",
+                         rows, self.max_attempts, target)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if len(self._queue) < self.flush_rows:
+                    self._cond.wait(self.flush_interval)
+            try:
+                if self.flush() == 0 and self._pending:
+                    time.sleep(RETRY_SECONDS)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            if not self._pending and os.path.exists(self._journal_path) and not os.path.getsize(self._journal_path):
+                os.unlink(self._journal_path)
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._queue) + self._pending_rows
+            oldest = self._pending[0][3] if self._pending else (self._queue[0][0] if self._queue else None)
+        return {
+            'enabled': True,
+            'depth': depth,
+            'peak_depth': self.peak_depth,
+            'max_queue': self.max_queue,
+            'lag_seconds': time.monotonic() - oldest if oldest is not None else 0.0,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'last_flush_rows': self.last_flush_rows,
+            'max_flush_rows': self.max_flush_rows,
+            'last_flush_seconds': self.last_flush_seconds,
+            'last_lag_seconds': self.last_lag_seconds,
+            'rejected': self.rejected,
+            'failures': self.failures,
+            'dead_lettered': self.dead_lettered,
+            'replayed_segments': self.replayed[0],
+            'replayed_rows': self.replayed[1],
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The process write-behind queue, or None when LOCATION_WRITE_BEHIND is off."""
+    global _queue
+    if _queue is None and ENABLED:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue()
+                atexit.register(_queue.close)
+    return _queue
+
+
+def set_queue(queue):
+    # swap the process queue (tests / benchmarks); returns the previous one
+    global _queue
+    with _queue_lock:
+        previous, _queue = _queue, queue
+    return previous
+
+
+def stats():
+    queue = _queue
+    return queue.stats() if queue is not None else {'enabled': False}
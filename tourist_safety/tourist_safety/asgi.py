@@ -3,6 +3,12 @@ ASGI config for tourist_safety project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this entry point (e.g. ``uvicorn
+tourist_safety.asgi:application``) in production: the police SOS stream
+(``accounts.views.sos_stream``) is a long-lived Server-Sent Events response
+that only costs a coroutine per console here, but a whole worker thread under
+WSGI.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
 from pathlib import Path
+
+import django
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()  # optional, if using a .env file
 
@@ -45,7 +48,11 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 MIDDLEWARE = [
+    # first, so its latency covers the whole stack (accounts/metrics.py)
+    'accounts.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # device API calls with a bearer token are answered here, skipping the rest (accounts/device_auth.py)
+    'accounts.device_auth.DeviceTokenMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,12 +85,66 @@ WSGI_APPLICATION = 'tourist_safety.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE picks the database setup:
+#   sqlite-basic  (default) stock Django SQLite settings (rollback journal)
+#   sqlite        WAL journal, tuned pragmas, busy timeout; readers no longer
+#                 block behind the ingest writer. Opt-in: WAL converts the
+#                 database file and keeps -wal/-shm files next to it, so point
+#                 SQLITE_PATH at a copy outside the repository
+#   postgres      POSTGRES_* variables, persistent connections, optional pool
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite-basic')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'tourist_safety'),
+            'USER': os.environ.get('POSTGRES_USER', 'tourist_safety'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer in transaction mode cannot keep named cursors open
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER') == '1',
+            'OPTIONS': {},
+        }
+    }
+    if int(os.environ.get('DB_POOL_MAX_SIZE', 0)):
+        # psycopg 3 connection pool per worker (Django >= 5.1, psycopg[pool]);
+        # it replaces persistent connections
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+elif DB_PROFILE in ('sqlite', 'sqlite-basic'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
     }
-}
+    if DB_PROFILE == 'sqlite':
+        DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+        # seconds a connection waits on a lock before "database is locked"
+        DATABASES['default']['OPTIONS'] = {'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))}
+        if django.VERSION >= (5, 1):
+            # take the write lock at BEGIN: a deferred transaction that has to
+            # upgrade its lock fails at once instead of waiting for the timeout
+            DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+        # applied to every new connection (accounts.signals)
+        SQLITE_PRAGMAS = {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',  # durable at checkpoints; WAL keeps the file consistent
+            'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 20_000)),
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_BYTES', 256 * 1024 * 1024)),
+            'temp_store': 'MEMORY',
+        }
+else:
+    raise ImproperlyConfigured(f"Unknown DB_PROFILE {DB_PROFILE!r}")
 
 
 # Password validation
@@ -108,6 +169,12 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Bearer token for Prometheus scrapes of /metrics/ (police sessions work without it)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+# log requests slower than this (ms) with their SQL; SLOW_REQUEST_SAMPLE is
+# the fraction of requests whose SQL is kept for that
+SLOW_REQUEST_MS = float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
+SLOW_REQUEST_SAMPLE = float(os.environ.get('SLOW_REQUEST_SAMPLE', 1.0))
 # Police registration keys (comma-separated in env)
 POLICE_REGISTRATION_KEYS = os.environ.get('POLICE_REGISTRATION_KEYS', '').split(',')
 